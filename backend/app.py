@@ -1,14 +1,13 @@
-from flask import Flask, request, jsonify, session, make_response
+from flask import Flask, request, jsonify, session, make_response, Response, stream_with_context
 from flask_cors import CORS
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
 from dotenv import load_dotenv
 import os
-import requests
 from datetime import datetime, timedelta
 import traceback
 import sys
 import jwt
+import json
+import hashlib
 from functools import wraps
 
 
@@ -16,6 +15,19 @@ from functools import wraps
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, parent_dir)
 from database.models import DatabaseManager
+from database.maintenance import HistoryMaintenance
+from context_window import build_context
+from llm_gateway import LLMGateway, GatewayBusyError
+from llm_client import LLMClient, CircuitBreaker, CircuitOpenError
+from model_router import ModelRouter
+from completion_cache import CompletionCache, cache_key
+from google_certs import GoogleCertCache, GOOGLE_CERTS_URL as DEFAULT_GOOGLE_CERTS_URL
+from metrics import Metrics
+from token_cache import TokenCache
+from single_flight import SingleFlight, CoalesceTimeoutError, CoalesceCancelledError
+from classifier import PromptClassifier
+from response_compression import compress_response, strip_etag_suffix
+from job_queue import RecipeJobQueue, JobQueueFullError
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)  # Used for session encryption
@@ -40,17 +52,305 @@ load_dotenv()
 
 # Environment variables
 GOOGLE_CLIENT_ID    = os.getenv("GOOGLE_CLIENT_ID")
+GOOGLE_CERTS_URL    = os.getenv("GOOGLE_CERTS_URL", DEFAULT_GOOGLE_CERTS_URL)  # override for local stubs
 OPENROUTER_API_KEY  = os.getenv("OPENROUTER_API_KEY")  # get yours at https://openrouter.ai
+OPENROUTER_API_URL  = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+OPENROUTER_MODEL    = os.getenv("OPENROUTER_MODEL", "mistralai/mistral-7b-instruct")
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))  # verified JWTs remembered per worker; 0 = off
+JWT_EMBED_CLAIMS = os.getenv("JWT_EMBED_CLAIMS", "false").lower() == "true"  # let /me answer from the token
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))  # SQLite connections kept open per worker
+DATABASE_PATH = os.getenv("DATABASE_PATH", "/tmp/recipe_app.db")
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() == "true"  # add "Server-Timing: db;dur=..." to responses
+
+# gzip (or brotli, if installed) for JSON bodies of at least COMPRESS_MIN_BYTES, and
+# ETag / If-None-Match on /me and GET /favorites
+RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "true").lower() == "true"
+COMPRESS_MIN_BYTES   = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+ETAGS_ENABLED        = os.getenv("ETAGS_ENABLED", "true").lower() == "true"
+
+# GET /favorites pagination
+FAVORITES_PAGE_SIZE     = int(os.getenv("FAVORITES_PAGE_SIZE", "20"))
+FAVORITES_MAX_PAGE_SIZE = int(os.getenv("FAVORITES_MAX_PAGE_SIZE", "100"))
+
+# GET /search pagination
+SEARCH_PAGE_SIZE     = int(os.getenv("SEARCH_PAGE_SIZE", "20"))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", "50"))
+
+# User cache: bounded LRU per worker, invalidated across workers through a small shared file
+USER_CACHE_SIZE        = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL         = float(os.getenv("USER_CACHE_TTL", "300"))
+USER_CACHE_SHARED_PATH = os.getenv("USER_CACHE_SHARED_PATH", DATABASE_PATH + "-usercache")
+
+# Conversation writes: group-committed by a background writer per worker
+WRITE_BEHIND             = os.getenv("WRITE_BEHIND", "true").lower() == "true"
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+WRITE_BEHIND_FLUSH_MS    = float(os.getenv("WRITE_BEHIND_FLUSH_MS", "20"))
+
+# Recipe and message bodies at least this many characters are stored zlib-compressed; 0 = off
+BODY_COMPRESSION_THRESHOLD = int(os.getenv("BODY_COMPRESSION_THRESHOLD", "512"))
+
+# Conversation history retention, archiving and compaction (one worker runs it at a time).
+# Nothing is deleted unless HISTORY_MAX_TURNS or HISTORY_MAX_AGE_DAYS is set; compaction always runs
+HISTORY_MAX_TURNS         = int(os.getenv("HISTORY_MAX_TURNS", "0"))  # messages kept per user; 0 = no limit
+HISTORY_MAX_AGE_DAYS      = float(os.getenv("HISTORY_MAX_AGE_DAYS", "0"))  # 0 = keep forever
+HISTORY_ARCHIVE_DIR       = os.getenv("HISTORY_ARCHIVE_DIR", DATABASE_PATH + "-archive")  # "" = don't archive
+HISTORY_ARCHIVE_MAX_DAYS  = float(os.getenv("HISTORY_ARCHIVE_MAX_DAYS", "365"))  # archives kept this long; 0 = forever
+HISTORY_ARCHIVE_MAX_MB    = float(os.getenv("HISTORY_ARCHIVE_MAX_MB", "1024"))  # oldest archives go above this; 0 = no cap
+MAINTENANCE_INTERVAL      = float(os.getenv("MAINTENANCE_INTERVAL", "3600"))  # seconds between runs; 0 = off
+
+# Timing histograms on /metrics, summed over all workers through files in METRICS_DIR
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_DIR     = os.getenv("METRICS_DIR", DATABASE_PATH + "-metrics")
+METRICS_TOKEN   = os.getenv("METRICS_TOKEN")  # if set, /metrics needs "Authorization: Bearer <token>"
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))  # log slower requests with a per-phase breakdown; 0 = off
+
+# Concurrent OpenRouter calls allowed per worker (the rest of its threads serve other endpoints)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_QUEUE_TIMEOUT   = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+
+# OpenRouter HTTP client: keep-alive pool, retries and circuit breaker
+LLM_POOL_SIZE         = int(os.getenv("LLM_POOL_SIZE", "10"))
+LLM_TIMEOUT           = float(os.getenv("LLM_TIMEOUT", "15"))
+LLM_MAX_RETRIES       = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_RESET     = float(os.getenv("LLM_BREAKER_RESET", "30"))
+
+# Model pool: each completion goes to the fastest healthy model, and is hedged to the next one
+# when it takes longer than that model's recent p95 (clamped to the min/max delay below)
+LLM_MODELS          = [m.strip() for m in os.getenv("LLM_MODELS", OPENROUTER_MODEL).split(",") if m.strip()]
+LLM_HEDGE           = os.getenv("LLM_HEDGE", "true").lower() == "true"
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+LLM_HEDGE_MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", "5"))
+
+# Identical prompts in flight at the same time share one OpenRouter call
+LLM_COALESCE         = os.getenv("LLM_COALESCE", "true").lower() == "true"
+LLM_COALESCE_TIMEOUT = float(os.getenv("LLM_COALESCE_TIMEOUT", "60"))  # how long a joined request waits
+
+# Background recipe jobs (POST /suggest_recipe/jobs, then poll GET /jobs/<id>); the pool and
+# queue limits are per gunicorn worker, the per-user limit is across all of them
+JOB_WORKERS      = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_QUEUED   = int(os.getenv("JOB_MAX_QUEUED", "64"))
+JOB_MAX_PER_USER = int(os.getenv("JOB_MAX_PER_USER", "3"))  # queued or running at once
+JOB_TTL          = float(os.getenv("JOB_TTL", "3600"))  # seconds a job and its result are kept
+JOB_MAX_WAIT     = float(os.getenv("JOB_MAX_WAIT", "25"))  # longest long-poll, below GUNICORN_TIMEOUT
+
+# Local check that refuses non-English and clearly off-topic messages without calling OpenRouter:
+# "enforce" answers them locally, "shadow" only counts disagreements with the model, "off" skips it
+PROMPT_CLASSIFIER = os.getenv("PROMPT_CLASSIFIER", "shadow").lower()
+
+# Completion cache: per-worker LRU, optionally backed by a table shared by all workers
+COMPLETION_CACHE_SIZE    = int(os.getenv("COMPLETION_CACHE_SIZE", "512"))
+COMPLETION_CACHE_TTL     = float(os.getenv("COMPLETION_CACHE_TTL", "86400"))
+COMPLETION_CACHE_PERSIST = os.getenv("COMPLETION_CACHE_PERSIST", "true").lower() == "true"
+
+# Conversation context sent to the LLM
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_MAX_TURNS    = int(os.getenv("CONTEXT_MAX_TURNS", "40"))  # rows fetched per request
+CONTEXT_SUMMARIZE    = os.getenv("CONTEXT_SUMMARIZE", "true").lower() == "true"
 
 if not JWT_SECRET_KEY:
     raise ValueError("JWT_SECRET_KEY is not set in environment variables")
 
 # Initialize database with new path (recipe-app/database instead of recipe-app/backend/database)
 # Run Locally:
-# db = DatabaseManager("../database/recipe_app.db")
-#Run on Render:
-db = DatabaseManager("/tmp/recipe_app.db")
+# db = DatabaseManager("../database/recipe_app.db", pool_size=DB_POOL_SIZE)
+#Run on Render (override with DATABASE_PATH):
+db = DatabaseManager(
+    DATABASE_PATH,
+    pool_size=DB_POOL_SIZE,
+    user_cache_size=USER_CACHE_SIZE,
+    user_cache_ttl=USER_CACHE_TTL,
+    shared_cache_path=USER_CACHE_SHARED_PATH or None,
+    write_behind=WRITE_BEHIND,
+    write_behind_max_pending=WRITE_BEHIND_MAX_PENDING,
+    write_behind_flush_interval=WRITE_BEHIND_FLUSH_MS / 1000.0,
+    compress_threshold=BODY_COMPRESSION_THRESHOLD
+)
+
+llm_gateway = LLMGateway(max_concurrency=LLM_MAX_CONCURRENCY, queue_timeout=LLM_QUEUE_TIMEOUT)
+model_router = ModelRouter(
+    [
+        LLMClient(
+            OPENROUTER_API_URL, OPENROUTER_API_KEY, model,
+            pool_size=LLM_POOL_SIZE,
+            timeout=LLM_TIMEOUT,
+            max_retries=LLM_MAX_RETRIES,
+            breaker=CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_RESET)
+        )
+        for model in LLM_MODELS
+    ],
+    hedge=LLM_HEDGE,
+    hedge_min_delay=LLM_HEDGE_MIN_DELAY,
+    hedge_max_delay=LLM_HEDGE_MAX_DELAY,
+    max_workers=2 * LLM_MAX_CONCURRENCY  # a primary and a hedge for every slot
+)
+# Completions are cached per pool, since any of its models may have written one
+MODEL_POOL = ",".join(LLM_MODELS)
+google_certs = GoogleCertCache(GOOGLE_CERTS_URL)
+token_cache = TokenCache(max_entries=TOKEN_CACHE_SIZE)
+single_flight = SingleFlight(wait_timeout=LLM_COALESCE_TIMEOUT)
+prompt_classifier = PromptClassifier()
+completion_cache = CompletionCache(
+    max_entries=COMPLETION_CACHE_SIZE,
+    ttl=COMPLETION_CACHE_TTL,
+    store=db if COMPLETION_CACHE_PERSIST else None
+)
+
+maintenance = HistoryMaintenance(
+    db,
+    max_turns=HISTORY_MAX_TURNS,
+    max_age_days=HISTORY_MAX_AGE_DAYS,
+    archive_dir=HISTORY_ARCHIVE_DIR or None,
+    archive_max_age_days=HISTORY_ARCHIVE_MAX_DAYS,
+    archive_max_bytes=int(HISTORY_ARCHIVE_MAX_MB * 1024 * 1024)
+)
+if MAINTENANCE_INTERVAL > 0:
+    maintenance.start(MAINTENANCE_INTERVAL)
+
+# DatabaseManager methods that don't serve requests and aren't worth timing
+DB_UNTIMED_METHODS = {
+    "connection", "get_connection", "close", "init_database", "migrate", "get_schema_version",
+    "pool_stats", "user_cache_stats", "write_behind_stats", "generate_password", "hash_password",
+}
+
+metrics = Metrics(directory=METRICS_DIR or None)
+if METRICS_ENABLED:
+    # Time every database, OpenRouter and Google call from the outside
+    metrics.instrument(db, "db", exclude=DB_UNTIMED_METHODS)
+    metrics.instrument(llm_gateway, "llm_queue", ["acquire"])
+    metrics.instrument(model_router, "llm", ["complete", "stream"])
+    model_router.listener = lambda event, model: metrics.inc("llm_route_events_total", event=event, model=model)
+    metrics.instrument(google_certs, "google", ["verify_oauth2_token"])
+
+    # Each component's own counters, exported per worker next to the timings
+    metrics.register_stats("db_pool", db.pool_stats)
+    metrics.register_stats("user_cache", db.user_cache_stats)
+    metrics.register_stats("write_behind", db.write_behind_stats)
+    metrics.register_stats("completion_cache", completion_cache.stats)
+    for llm_client in model_router.clients.values():
+        metrics.register_stats(
+            "llm_client",
+            lambda client=llm_client: dict(client.stats(), circuit_open=int(client.breaker.state != "closed")),
+            model=llm_client.model
+        )
+    metrics.register_stats("llm_gateway", llm_gateway.stats)
+    metrics.register_stats("single_flight", single_flight.stats)
+    metrics.register_stats("token_cache", token_cache.stats)
+
+
+# Phrases the model uses when it refuses a non-cooking request
+NON_COOKING_INDICATORS = [
+    "I can only help with cooking",
+    "I'm a cooking assistant",
+    "Please ask me about ingredients",
+    "cooking and recipe suggestions",
+    "I only understand English"
+]
+# Streamed replies are held back until this many characters have arrived,
+# so a refusal at the start of a reply never reaches the client as tokens
+STREAM_HOLDBACK_CHARS = max(len(indicator) for indicator in NON_COOKING_INDICATORS)
+
+
+def get_refusal_message(reply):
+    """Return the refusal sentence if the reply declines a non-cooking request, else None"""
+    if not any(indicator in reply for indicator in NON_COOKING_INDICATORS):
+        return None
+
+    # Extract just the first sentence (up to first period or newline)
+    # This ensures we drop any recipe text that follows.
+    first_line = reply.strip().split("\n")[0]
+    if "." in first_line:
+        # Keep everything through the first period.
+        return first_line.split(".", 1)[0].strip() + "."
+    return first_line.strip()
+
+
+def local_verdict(message, user_id):
+    verdict = prompt_classifier.classify(message)
+    if verdict.label == "off_topic" and db.get_recent_conversation(user_id, 1):
+        # With earlier turns it may be a follow-up ("make it for the football crowd")
+        verdict = prompt_classifier.classify(message, follow_up=True)
+    return verdict
+
+
+def classify_prompt(message, user_id):
+    """Local verdict on a new chat message, or None when the classifier is off"""
+    if PROMPT_CLASSIFIER not in ("enforce", "shadow"):
+        return None
+    verdict = local_verdict(message, user_id)
+    metrics.inc("prompt_classifications_total", verdict=verdict.label)
+    return verdict
+
+
+def local_refusal(verdict):
+    """Refusal to send without calling the model, if the classifier is enforcing one"""
+    if verdict is not None and verdict.reply and PROMPT_CLASSIFIER == "enforce":
+        return verdict.reply
+    return None
+
+
+def record_shadow_verdict(verdict, refusal_msg):
+    """In shadow mode, count messages where the model and the local verdict disagree"""
+    if verdict is None or PROMPT_CLASSIFIER != "shadow":
+        return
+    if bool(verdict.reply) != bool(refusal_msg):
+        metrics.inc("prompt_classifier_disagreements_total", verdict=verdict.label,
+                    model="refused" if refusal_msg else "answered")
+
+
+# Part of every ETag; bump it when the JSON returned by /me or /favorites changes shape
+RESPONSE_FORMAT_VERSION = 1
+
+
+def user_etag(kind, user):
+    """Strong ETag for a per-user response at the current query string, from the user's version counter"""
+    if not ETAGS_ENABLED or user is None:
+        return None
+    variant = hashlib.sha256(request.query_string).hexdigest()[:12]
+    return f'"{kind}.{RESPONSE_FORMAT_VERSION}.{user["id"]}.{user["version"]}.{variant}"'
+
+
+def not_modified(etag):
+    """A 304 if the request's If-None-Match already holds ``etag`` (in any encoding), else None"""
+    if etag is None:
+        return None
+    for sent in request.headers.get("If-None-Match", "").split(","):
+        sent = sent.strip()
+        if sent and (sent == "*" or strip_etag_suffix(sent) == etag):
+            resp = make_response("", 304)
+            # The tag the client holds names its encoding; "*" names none, so send ours
+            resp.headers["ETag"] = etag if sent == "*" else sent
+            resp.headers["Cache-Control"] = "private, no-cache"
+            if RESPONSE_COMPRESSION:
+                # Same Vary as the 200 it stands for (compress_response leaves 304s alone)
+                resp.vary.add("Accept-Encoding")
+            return resp
+    return None
+
+
+def with_etag(response, etag):
+    """Tag a response so the browser revalidates it with If-None-Match next time"""
+    if etag is not None:
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def gateway_busy_response(error):
+    resp = jsonify({"error": str(error)})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(int(LLM_QUEUE_TIMEOUT))
+    return resp
+
+
+def completion_text(jr):
+    return jr.get("choices", [])[0].get("message", {}).get("content", "").strip()
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 
 def generate_token(user_data):
@@ -60,16 +360,29 @@ def generate_token(user_data):
         "email": user_data["email"],
         "exp": datetime.utcnow() + timedelta(days=7)  # Token expires in 7 days
     }
+    if JWT_EMBED_CLAIMS:
+        # Profile fields only change at login (which issues a new token) and
+        # terms can't be un-accepted, so /me can trust these until exp
+        payload.update({
+            "name": user_data.get("name", ""),
+            "picture": user_data.get("picture", ""),
+            "terms_accepted": bool(user_data.get("terms_accepted", False))
+        })
     return jwt.encode(payload, JWT_SECRET_KEY, algorithm="HS256")
 
 def verify_token(token):
+    # Repeat requests with the same token skip the signature check until exp
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=["HS256"])
-        return payload
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
+    token_cache.put(token, payload)
+    return payload
 
 def require_auth(f):
     @wraps(f)
@@ -92,7 +405,8 @@ def require_auth(f):
         if token.startswith('Bearer '):
             token = token[7:]
         
-        payload = verify_token(token)
+        with metrics.phase("auth", "verify_token"):
+            payload = verify_token(token)
         if not payload:
             return jsonify({"error": "Invalid or expired token"}), 401
         
@@ -103,6 +417,21 @@ def require_auth(f):
     return decorated_function
 
 
+@app.before_request
+def before_request():
+    db.pool.thread_busy_time(reset=True)
+    if METRICS_ENABLED:
+        metrics.start_request()
+
+
+def record_request(endpoint, method, status):
+    """Close the request's timings; runs once the response body has been sent"""
+    timings = metrics.finish_request(endpoint, method, status)
+    if timings and SLOW_REQUEST_MS and timings.total * 1000 >= SLOW_REQUEST_MS:
+        metrics.inc("slow_requests_total", endpoint=endpoint)
+        print(f"Slow request: {method} {endpoint} {status} {timings.total * 1000:.1f} ms - {timings.breakdown()}")
+
+
 @app.after_request
 def after_request(response):
     # More permissive CORS for mobile browsers
@@ -114,8 +443,27 @@ def after_request(response):
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type,Authorization,X-Requested-With'
     # Remove problematic COOP
     response.headers.pop("Cross-Origin-Opener-Policy", None)
+    if SERVER_TIMING:
+        # Database time spent so far in this request (streamed bodies write later)
+        response.headers['Server-Timing'] = f"db;dur={db.pool.thread_busy_time() * 1000:.2f}"
+    if RESPONSE_COMPRESSION:
+        compress_response(response, request.headers.get('Accept-Encoding'), COMPRESS_MIN_BYTES)
+    if METRICS_ENABLED:
+        # Route pattern rather than path keeps the label set small
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        method, status = request.method, response.status_code
+        response.call_on_close(lambda: record_request(endpoint, method, status))
     return response
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        return jsonify({"error": "Invalid metrics token"}), 401
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/ping')
 def ping():
     return "pong", 200
@@ -126,11 +474,8 @@ def login_with_google():
     token = data.get("token")
 
     try:
-        idinfo = id_token.verify_oauth2_token(
-            token,
-            google_requests.Request(),
-            GOOGLE_CLIENT_ID
-        )
+        # Certs are cached per worker, so this is normally a local signature check
+        idinfo = google_certs.verify_oauth2_token(token, GOOGLE_CLIENT_ID)
 
         google_id = idinfo["sub"]
         email = idinfo["email"]
@@ -172,6 +517,20 @@ def me():
     user_id = request.current_user["user_id"]
     google_id = request.current_user["google_id"]
     
+    claims = request.current_user
+    if JWT_EMBED_CLAIMS and claims.get("terms_accepted"):
+        # Everything /me returns is in the verified token
+        profile = {
+            "email": claims["email"],
+            "name": claims.get("name", ""),
+            "picture": claims.get("picture", "")
+        }
+        etag = None
+        if ETAGS_ENABLED:
+            digest = hashlib.sha256(json.dumps(profile, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+            etag = f'"me.{RESPONSE_FORMAT_VERSION}.{digest}"'
+        return not_modified(etag) or with_etag(jsonify(profile), etag)
+    
     user = db.get_user_by_google_id(google_id)
     if not user:
         return jsonify({"error": "User not found"}), 404
@@ -179,11 +538,12 @@ def me():
     if not user.get("terms_accepted", False):
         return jsonify({"error": "Terms not accepted"}), 403
     
-    return jsonify({
+    etag = user_etag("me", user)
+    return not_modified(etag) or with_etag(jsonify({
         "email": user["email"],
         "name": user["name"],
         "picture": user["picture"]
-    })
+    }), etag)
 
 @app.route("/accept-terms", methods=["POST"])
 @require_auth
@@ -192,6 +552,10 @@ def accept_terms():
     try:
         success = db.accept_terms(user_id)
         if success:
+            if JWT_EMBED_CLAIMS:
+                # Hand out a token that records the acceptance, so /me can skip the database
+                user = db.get_user_by_google_id(request.current_user["google_id"])
+                return jsonify({"message": "Terms accepted successfully", "token": generate_token(user)})
             return jsonify({"message": "Terms accepted successfully"})
         else:
             return jsonify({"error": "Failed to accept terms"}), 500
@@ -200,6 +564,97 @@ def accept_terms():
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+def generate_recipe(user_id, message, verdict):
+    """Get the reply to a chat message: from the cache, an identical call in flight, or the model pool.
+
+    Returns ``(body, status, reply)``: the JSON body and status code for
+    the client, and the reply to save with the message (None when the model
+    refused). Saving is left to the caller. Gateway and OpenRouter errors
+    are raised.
+    """
+    # Build the context window: system prompt, summary, recent turns and the new message
+    conversation_history, context_stats = build_context(
+        db, user_id, message,
+        token_budget=CONTEXT_TOKEN_BUDGET,
+        max_turns=CONTEXT_MAX_TURNS,
+        summarize=CONTEXT_SUMMARIZE
+    )
+
+    # Call OpenRouter API with conversation history, unless the same context was answered before
+    key = cache_key(MODEL_POOL, conversation_history)
+    jr = completion_cache.get(key)
+    cached = jr is not None
+    coalesced = False
+    if not cached:
+        def call_llm():
+            with llm_gateway.slot():
+                return model_router.complete(conversation_history)
+
+        if LLM_COALESCE:
+            # Only the first of several identical requests calls OpenRouter (and takes a slot)
+            jr, coalesced = single_flight.do(key, call_llm)
+            if coalesced:
+                metrics.inc("llm_coalesced_requests_total")
+        else:
+            jr = call_llm()
+    reply = completion_text(jr)
+
+    # Check if the AI is refusing to help with non-cooking topics
+    refusal_msg = get_refusal_message(reply)
+    record_shadow_verdict(verdict, refusal_msg)
+    if refusal_msg:
+        return {"error": refusal_msg, "is_cooking_error": True}, 400, None
+
+    if not cached and not coalesced:
+        completion_cache.put(key, jr.get("model") or MODEL_POOL, jr)
+
+    return {
+        "recipe": reply,
+        "context": context_stats,
+        "usage": {} if cached or coalesced else jr.get("usage", {}),
+        "cached": cached,
+        "coalesced": coalesced
+    }, 200, reply
+
+
+def run_recipe_job(job):
+    """Job queue worker: the same work as /suggest_recipe, with the exchange saved by the queue"""
+    message = job["message"]
+    # The message was classified on submit; only shadow mode needs the verdict again
+    verdict = local_verdict(message, job["user_id"]) if PROMPT_CLASSIFIER == "shadow" else None
+    try:
+        body, status, reply = generate_recipe(job["user_id"], message, verdict)
+    except (GatewayBusyError, CircuitOpenError, CoalesceTimeoutError, CoalesceCancelledError) as e:
+        return "failed", {"error": str(e), "retryable": True}, None
+    if reply is None:
+        return "failed", body, None
+    return "done", body, [("user", message), ("assistant", reply)]
+
+
+recipe_jobs = RecipeJobQueue(
+    db, run_recipe_job,
+    workers=JOB_WORKERS,
+    max_queued=JOB_MAX_QUEUED,
+    max_per_user=JOB_MAX_PER_USER,
+    ttl=JOB_TTL
+)
+
+
+def job_response(job, status=200):
+    """A job as the client sees it: its state plus, once finished, the /suggest_recipe body"""
+    body = {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "expires_at": job["expires_at"]
+    }
+    body.update(job["result"] or {})
+    resp = jsonify(body)
+    resp.status_code = status
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+
 @app.route("/suggest_recipe", methods=["POST", "OPTIONS"])
 @require_auth
 def suggest_recipe():
@@ -214,73 +669,182 @@ def suggest_recipe():
     data = request.get_json() or {}
     message = data.get("message", "")
 
-    # Get conversation history from database
-    conversation_history = db.get_conversation_history(user_id)
-    
-    # Add user message to local history
-    conversation_history.append({"role": "user", "content": message})
+    # Non-English and off-topic messages are refused here, before any database or OpenRouter work
+    verdict = classify_prompt(message, user_id)
+    refusal_msg = local_refusal(verdict)
+    if refusal_msg:
+        return jsonify({"error": refusal_msg, "is_cooking_error": True}), 400
 
-    # Call OpenRouter API with conversation history
     try:
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "Content-Type":  "application/json",
-            "Referer":       "http://localhost:3000"
-        }
-        payload = {
-            "model":    "mistralai/mistral-7b-instruct",
-            "messages": conversation_history
+        body, status, reply = generate_recipe(user_id, message, verdict)
+        if reply is not None:
+            # Save the exchange (one transaction, committed in the background)
+            db.add_conversation_messages(user_id, [("user", message), ("assistant", reply)])
+        return jsonify(body), status
+
+    except (GatewayBusyError, CircuitOpenError, CoalesceTimeoutError, CoalesceCancelledError) as e:
+        return gateway_busy_response(e)
+    except Exception as e:
+        print("Error calling OpenRouter:")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/suggest_recipe/stream", methods=["POST", "OPTIONS"])
+@require_auth
+def suggest_recipe_stream():
+    """Stream the recipe to the client as Server-Sent Events while the model writes it.
+
+    Events: ``token`` ({"content": ...}) for each chunk of the reply, then
+    either ``done`` ({"recipe", "context"}) or ``error`` ({"error", ...}).
+    An ``error`` with ``is_cooking_error`` means the reply was a refusal and
+    any tokens already shown should be discarded.
+    """
+    if request.method == "OPTIONS":
+        return make_response(("", 200))
+
+    user_id = request.current_user["user_id"]
+    if not user_id:
+        return jsonify({"error": "Not logged in"}), 401
+
+    data = request.get_json() or {}
+    message = data.get("message", "")
+
+    verdict = classify_prompt(message, user_id)
+    refusal_msg = local_refusal(verdict)
+    if refusal_msg:
+        return Response(sse_event("error", {"error": refusal_msg, "is_cooking_error": True}),
+                        mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    conversation_history, context_stats = build_context(
+        db, user_id, message,
+        token_budget=CONTEXT_TOKEN_BUDGET,
+        max_turns=CONTEXT_MAX_TURNS,
+        summarize=CONTEXT_SUMMARIZE
+    )
+
+    key = cache_key(MODEL_POOL, conversation_history)
+    cached = completion_cache.get(key)
+
+    # Take the LLM slot up front so a full gateway still gets a proper 503;
+    # it is released when the streamed response is closed
+    if cached is None:
+        try:
+            llm_gateway.acquire()
+        except GatewayBusyError as e:
+            return gateway_busy_response(e)
+
+    def generate():
+        reply = ""
+        sent = 0  # characters of reply already relayed to the client
+        try:
+            # A cached completion is relayed as a single chunk
+            deltas = [completion_text(cached)] if cached else model_router.stream(conversation_history)
+            for delta in deltas:
+                reply += delta
+
+                refusal_msg = get_refusal_message(reply)
+                if refusal_msg:
+                    record_shadow_verdict(verdict, refusal_msg)
+                    yield sse_event("error", {"error": refusal_msg, "is_cooking_error": True})
+                    return
+
+                if len(reply) >= STREAM_HOLDBACK_CHARS:
+                    yield sse_event("token", {"content": reply[sent:]})
+                    sent = len(reply)
+
+            reply_text = reply.strip()
+            refusal_msg = get_refusal_message(reply_text)
+            record_shadow_verdict(verdict, refusal_msg)
+            if refusal_msg:
+                yield sse_event("error", {"error": refusal_msg, "is_cooking_error": True})
+                return
+            if sent < len(reply):
+                yield sse_event("token", {"content": reply[sent:]})
+
+            if cached is None:
+                completion_cache.put(key, MODEL_POOL, {
+                    "choices": [{"message": {"role": "assistant", "content": reply_text}}]
+                })
+
+            # Persist the exchange only once the full reply has arrived
+            db.add_conversation_messages(user_id, [("user", message), ("assistant", reply_text)])
+
+            yield sse_event("done", {"recipe": reply_text, "context": context_stats, "cached": cached is not None})
+
+        except Exception as e:
+            print("Error streaming from OpenRouter:")
+            traceback.print_exc()
+            yield sse_event("error", {"error": str(e)})
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Don't let proxies buffer the stream
         }
+    )
+    if cached is None:
+        response.call_on_close(llm_gateway.release)
+    return response
 
-        resp = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=15
-        )
-        resp.raise_for_status()
-        jr = resp.json()
-        reply = jr.get("choices", [])[0].get("message", {}).get("content", "").strip()
-
-        # Check if the AI is refusing to help with non-cooking topics
-        non_cooking_indicators = [
-            "I can only help with cooking",
-            "I'm a cooking assistant",
-            "Please ask me about ingredients",
-            "cooking and recipe suggestions"
-        ]
-        
-        is_non_cooking_response = any(indicator in reply for indicator in non_cooking_indicators)
-        
-        if is_non_cooking_response:
-            # Extract just the first sentence (up to first period or newline)
-            # This ensures we drop any recipe text that follows.
-            # Find the earliest break (newline or period)
-            first_line = reply.split("\n")[0]
-            if "." in first_line:
-                # Keep everything through the first period.
-                refusal_msg = first_line.split(".", 1)[0].strip() + "."
-            else:
-                refusal_msg = first_line.strip()
+@app.route("/suggest_recipe/jobs", methods=["POST", "OPTIONS"])
+@require_auth
+def submit_recipe_job():
+    """Queue a recipe request and return its job id at once (202); poll GET /jobs/<id> for the recipe.
+
+    An ``Idempotency-Key`` header makes a retried submission return the
+    job created the first time instead of starting another one.
+    """
+    if request.method == "OPTIONS":
+        return make_response(("", 200))
 
-            # Remove user message from local history
-            if conversation_history and conversation_history[-1]["role"] == "user":
-                conversation_history.pop()
+    user_id = request.current_user["user_id"]
+    if not user_id:
+        return jsonify({"error": "Not logged in"}), 401
+
+    data = request.get_json() or {}
+    message = data.get("message", "")
+    if not message.strip():
+        return jsonify({"error": "Message is required"}), 400
 
-            return jsonify({"error": refusal_msg, "is_cooking_error": True}), 400
+    verdict = classify_prompt(message, user_id)
+    refusal_msg = local_refusal(verdict)
+    if refusal_msg:
+        return jsonify({"error": refusal_msg, "is_cooking_error": True}), 400
 
-        # Add user message to db history
-        db.add_conversation_message(user_id, "user", message)
+    client_key = request.headers.get("Idempotency-Key") or None
+    if client_key and len(client_key) > 200:
+        return jsonify({"error": "Idempotency-Key is too long"}), 400
 
-        # Add assistant reply to database
-        db.add_conversation_message(user_id, "assistant", reply)
+    try:
+        job, created = recipe_jobs.submit(user_id, message, client_key)
+    except JobQueueFullError as e:
+        if e.per_user:
+            return jsonify({"error": str(e)}), 429
+        return gateway_busy_response(e)
 
-        return jsonify({"recipe": reply})
+    resp = job_response(job, 202 if created else 200)
+    resp.headers["Location"] = f"/jobs/{job['job_id']}"
+    return resp
 
-    except Exception as e:
-        print("Error calling OpenRouter:")
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+@app.route("/jobs/<job_id>", methods=["GET"])
+@require_auth
+def get_recipe_job(job_id):
+    """A recipe job's state; ``?wait=N`` holds the request up to N seconds for it to finish"""
+    user_id = request.current_user["user_id"]
+    if not user_id:
+        return jsonify({"error": "Not logged in"}), 401
+
+    try:
+        wait = min(max(float(request.args.get("wait", 0)), 0.0), JOB_MAX_WAIT)
+    except ValueError:
+        return jsonify({"error": "wait must be a number of seconds"}), 400
+
+    job = recipe_jobs.wait(user_id, job_id, wait)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return job_response(job)
 
 @app.route("/favorites", methods=["GET", "POST", "DELETE"])
 @require_auth
@@ -290,10 +854,34 @@ def manage_favorites():
         return jsonify({"error": "Not logged in"}), 401
     
     if request.method == "GET":
-        # Return user's favorite recipes from database
+        # The user's version moves on every add/remove, so an unchanged one
+        # answers 304 before any favorites are read
+        etag = None
+        if ETAGS_ENABLED:
+            etag = user_etag("favorites", db.get_user_by_google_id(request.current_user["google_id"]))
+            cached = not_modified(etag)
+            if cached:
+                return cached
+        
+        # Paginated listing when limit/cursor/fields is given; otherwise the full list
+        paginated = any(arg in request.args for arg in ("limit", "cursor", "fields"))
         try:
+            if paginated:
+                try:
+                    limit = min(max(int(request.args.get("limit", FAVORITES_PAGE_SIZE)), 1), FAVORITES_MAX_PAGE_SIZE)
+                    page = db.get_user_favorites_page(
+                        user_id,
+                        limit=limit,
+                        cursor=request.args.get("cursor"),
+                        summary_only=request.args.get("fields") == "summary"
+                    )
+                except ValueError as e:
+                    return jsonify({"error": str(e)}), 400
+                return with_etag(jsonify(page), etag)
+            
+            # Return user's favorite recipes from database
             favorites = db.get_user_favorites(user_id)
-            return jsonify({"favorites": favorites})
+            return with_etag(jsonify({"favorites": favorites}), etag)
         except Exception as e:
             print("Error getting favorites:")
             traceback.print_exc()
@@ -337,6 +925,89 @@ def manage_favorites():
             traceback.print_exc()
             return jsonify({"error": str(e)}), 500
 
+@app.route("/favorites/<int:recipe_id>", methods=["GET"])
+@require_auth
+def get_favorite(recipe_id):
+    """Fetch one favorite recipe with its full body"""
+    user_id = request.current_user["user_id"]
+    if not user_id:
+        return jsonify({"error": "Not logged in"}), 401
+    
+    try:
+        recipe = db.get_favorite_recipe(user_id, recipe_id)
+        if not recipe:
+            return jsonify({"error": "Recipe not found or not owned by user"}), 404
+        return jsonify({"recipe": recipe})
+    except Exception as e:
+        print("Error getting favorite:")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/favorites/query", methods=["GET"])
+@require_auth
+def query_favorites():
+    """Find favorites by ingredient and time, e.g. "cook with what I have".
+
+    Query args (comma-separated lists): have, uses, max_minutes, min_coverage, limit.
+    """
+    user_id = request.current_user["user_id"]
+    if not user_id:
+        return jsonify({"error": "Not logged in"}), 401
+    
+    def listed(name):
+        return [item.strip() for item in request.args.get(name, "").split(",") if item.strip()]
+    
+    try:
+        limit = min(max(int(request.args.get("limit", FAVORITES_PAGE_SIZE)), 1), FAVORITES_MAX_PAGE_SIZE)
+        max_minutes = request.args.get("max_minutes")
+        results = db.query_favorites(
+            user_id,
+            have=listed("have"),
+            uses=listed("uses"),
+            max_minutes=int(max_minutes) if max_minutes else None,
+            min_coverage=float(request.args.get("min_coverage", 0)),
+            limit=limit
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print("Error querying favorites:")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+    
+    return jsonify({"favorites": results})
+
+@app.route("/search", methods=["GET"])
+@require_auth
+def search():
+    """Full-text search over the user's favorites and chat history.
+
+    Query args: q (required), scope (all|favorites|history), limit, offset.
+    """
+    user_id = request.current_user["user_id"]
+    if not user_id:
+        return jsonify({"error": "Not logged in"}), 401
+    
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "Search query is required"}), 400
+    
+    try:
+        limit = min(max(int(request.args.get("limit", SEARCH_PAGE_SIZE)), 1), SEARCH_MAX_PAGE_SIZE)
+        offset = max(int(request.args.get("offset", 0)), 0)
+        results = db.search(user_id, query, scope=request.args.get("scope", "all"), limit=limit, offset=offset)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print("Error searching:")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+    
+    return jsonify({
+        "results": results,
+        "next_offset": offset + limit if len(results) == limit else None
+    })
+
 @app.route("/clear_history", methods=["POST"])
 @require_auth
 def clear_conversation_history():
@@ -357,5 +1028,11 @@ def clear_conversation_history():
 def index():
     return "Backend is running with SQLite database and conversational OpenRouter!"
 
+if METRICS_ENABLED:
+    metrics.register_stats("recipe_jobs", recipe_jobs.stats)
+
+# Last, so the sweep at startup can run the jobs it takes over with the whole module loaded
+recipe_jobs.start()
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,202 @@
+import re
+import unicodedata
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Replies the system prompt tells the model to give, sent verbatim when the
+# message is rejected locally so the client sees no difference
+NON_ENGLISH_REPLY = "I only understand English."
+OFF_TOPIC_REPLY = "I can only help with cooking."
+
+# Dishes, ingredients, meals and techniques. Any one of these makes a message
+# a cooking request (rule 2 of the system prompt: ignore everything else).
+# Plurals are added when the matcher is built.
+COOKING_TERMS = """
+    pasta, spaghetti, lasagna, lasagne, penne, macaroni, noodle, ramen, udon, gnocchi, ravioli, risotto, pizza,
+    soup, stew, chili, curry, salad, sandwich, burger, taco, burrito, quesadilla, enchilada, wrap, omelette, omelet,
+    pancake, waffle, crepe, cake, cupcake, cookie, brownie, muffin, pie, tart, bread, bagel, toast, biscuit, scone,
+    dessert, pudding, custard, ice cream, smoothie, milkshake, casserole, quiche, frittata, stir fry, fried rice,
+    paella, pilaf, couscous, hummus, falafel, kebab, shawarma, schnitzel, meatball, meatloaf, dumpling, sushi,
+    tempura, pad thai, shakshuka, ratatouille, minestrone, gazpacho, goulash, tagine, biryani, dal, dahl,
+    chowder, bisque, broth, sauce, gravy, dressing, marinade, salsa, guacamole, pesto, dip, jam,
+    granola, oatmeal, porridge, cereal, muesli, fajita, nachos, cheesecake, tiramisu, ribs, donut, doughnut,
+    chicken, beef, pork, lamb, turkey, duck, bacon, ham, sausage, steak, mince, veal, salmon, tuna, cod, shrimp, prawn,
+    fish, seafood, crab, lobster, mussel, clam, squid, octopus, tofu, tempeh, seitan, egg, cheese, mozzarella,
+    parmesan, cheddar, feta, ricotta, butter, cream, milk, yogurt, yoghurt, rice, quinoa, barley, bulgur, oat,
+    flour, sugar, honey, chocolate, cocoa, vanilla, cinnamon, garlic, onion, shallot, leek, tomato, potato,
+    carrot, celery, pepper, chilli, spinach, kale, lettuce, cabbage, broccoli, cauliflower, zucchini, courgette,
+    eggplant, aubergine, mushroom, pea, bean, lentil, chickpea, corn, avocado, cucumber, pumpkin, squash,
+    beetroot, beet, radish, asparagus, artichoke, olive, lemon, lime, orange, apple, banana, berry, strawberry,
+    blueberry, raspberry, mango, pineapple, peach, pear, cherry, grape, coconut, almond, walnut, peanut, cashew,
+    pistachio, hazelnut, sesame, ginger, basil, parsley, cilantro, coriander, mint, thyme, rosemary, oregano,
+    dill, sage, paprika, cumin, turmeric, saffron, nutmeg, salt, vinegar, soy sauce, miso, tahini, mayonnaise,
+    mustard, ketchup, yeast, noodles, herb, spice, vegetable, fruit, nut, meat, poultry, legume, grain,
+    breakfast, brunch, lunch, dinner, supper, snack, appetizer, starter, side dish, main course, meal,
+    bake, roast, grill, fry, saute, sauté, simmer, boil, poach, steam, braise, marinate, barbecue, bbq,
+    slow cooker, air fryer, instant pot, oven, skillet, wok,
+"""
+
+# Words that are about food in general but name nothing to cook, plus the
+# phrases used to adjust a previous recipe ("make it spicier"). They keep a
+# message away from the off-topic rule ("food to take on a flight"), so it
+# goes to the model, which refuses "gun recipe" itself.
+KITCHEN_TERMS = """
+    recipe, cook, cooking, chef, kitchen, food, eat, eating, hungry, taste, tasty, flavor, flavour, delicious,
+    spicy, spicier, sweet, sweeter, savory, savoury, vegan, vegetarian, gluten free, dairy free, keto, paleo,
+    healthy, low carb, protein, calories, portion, serving, servings, ingredient, leftovers,
+    substitute, replace, instead, without, swap, double, halve, update, modify, change, version,
+    metric, make ahead, last one, previous, easy, quick, kid friendly, kids, family, crowd, party, potluck,
+    picnic, lunchbox, movie night, game day, game night,
+"""
+
+# Subjects the model is told to refuse. These only reject a message that has
+# no cooking term at all.
+OFF_TOPIC_TERMS = """
+    gun, weapon, rifle, pistol, bomb, explosive, ammunition, poison, hack, hacking, malware,
+    password, virus, code, coding, program, programming, python, javascript, java, sql, html, css, software,
+    computer, laptop, phone, app, website, server, database, algorithm,
+    math, equation, calculus, algebra, homework, essay, poem, poetry, story, novel, song, lyrics, joke,
+    movie, film, tv, series, game, video game, football, soccer, basketball, tennis, sport,
+    stock, stocks, crypto, bitcoin, invest, investment, loan, mortgage, tax, taxes, bank, insurance, salary,
+    lawyer, legal, lawsuit, contract, doctor, diagnosis, symptom, medicine, prescription, therapy,
+    politics, election, president, government, war, history, capital, country, weather, forecast,
+    car, engine, travel, flight, hotel, visa, translate, translation, grammar, resume, job, interview,
+"""
+
+# Function words that tell Latin-script languages apart. A message with a
+# couple of these and no English ones is treated as not English.
+ENGLISH_WORDS = """
+    the a an and or of to in on for with without is are was be can could would should please
+    i me my you your it this that some any what how make give want need have like recipe
+"""
+FOREIGN_WORDS = """
+    el la los las un una unos del al con sin por para que como quiero hazme dame receta
+    le les des une du au avec sans pour je veux moi recette est
+    der die das ein eine mit ohne und ich möchte bitte rezept ist nicht
+    il lo gli per con senza voglio ricetta di
+    o os um uma com sem eu quero receita
+    het een met zonder en ik wil recept
+"""
+
+_WORD_RE = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+
+class Verdict(NamedTuple):
+    label: str  # "cooking", "non_english", "off_topic" or "unknown"
+    reply: Optional[str]  # refusal to send instead of calling the model, or None
+    matches: Tuple[str, ...] = ()  # lexicon phrases that decided it
+
+
+def _variants(word: str) -> Iterable[str]:
+    yield word
+    if word.endswith("y") and len(word) > 3 and word[-2] not in "aeiou":
+        yield word[:-1] + "ies"
+    elif word.endswith(("s", "x", "ch", "sh", "o")):
+        yield word + "es"
+    yield word + "s"
+
+
+class PhraseMatcher:
+    """Finds lexicon phrases in a list of words, at word boundaries.
+
+    Phrases are stored in a word-level trie, so a message is matched in one
+    pass with a dictionary lookup per word; every phrase is only a few words
+    long, so restarting the walk at each word costs what Aho-Corasick's
+    failure links would save at character level. Plurals of each phrase's
+    last word are compiled in, so "tomatoes" matches "tomato".
+    """
+
+    def __init__(self):
+        self._root: Dict = {}
+
+    def add(self, phrase: str, category: str):
+        words = phrase.split()
+        for last in _variants(words[-1]):
+            node = self._root
+            for word in words[:-1] + [last]:
+                node = node.setdefault(word, {})
+            node.setdefault(None, (phrase, category))  # the first category added wins
+
+    def add_all(self, phrases: str, category: str):
+        """Add a comma-separated list of phrases"""
+        for phrase in phrases.split(","):
+            if phrase.strip():
+                self.add(phrase.strip(), category)
+
+    def find(self, words: List[str]) -> List[Tuple[str, str]]:
+        """(phrase, category) of the longest match starting at each word"""
+        found = []
+        for start in range(len(words)):
+            node = self._root
+            longest = None
+            for word in words[start:]:
+                node = node.get(word)
+                if node is None:
+                    break
+                if None in node:
+                    longest = node[None]
+            if longest is not None:
+                found.append(longest)
+        return found
+
+
+def _script(ch: str) -> str:
+    if ch < "ɐ":
+        return "latin"
+    try:
+        return unicodedata.name(ch).split(" ", 1)[0].lower()
+    except ValueError:
+        return "other"
+
+
+class PromptClassifier:
+    """Decides locally whether a chat message needs the model at all.
+
+    Mirrors the language and keyword rules of the system prompt, but only
+    answers when it is sure: a message is rejected as not English when it
+    is entirely in another language (nearly all of its letters in another
+    script, or Latin-script text with foreign function words) and has no
+    English word in it, and as off topic when it names a non-cooking
+    subject and nothing about food at all. A cooking term anywhere always
+    lets the message through; a kitchen term, or ``follow_up`` (the user
+    has earlier turns the message may refer to, as in "make the last one
+    for the football crowd"), turns an off-topic verdict into "unknown".
+    Everything "unknown" goes to the model as before.
+    """
+
+    def __init__(self, non_latin_share: float = 0.9, foreign_words: int = 2):
+        self.non_latin_share = non_latin_share
+        self.foreign_words = foreign_words
+        self.matcher = PhraseMatcher()
+        self.matcher.add_all(COOKING_TERMS, "cooking")
+        self.matcher.add_all(KITCHEN_TERMS, "kitchen")
+        self.matcher.add_all(OFF_TOPIC_TERMS, "off_topic")
+        self._english = frozenset(ENGLISH_WORDS.split())
+        self._foreign = frozenset(FOREIGN_WORDS.split()) - self._english
+
+    def classify(self, message: str, follow_up: bool = False) -> Verdict:
+        text = unicodedata.normalize("NFKC", message or "").casefold()
+        words = _WORD_RE.findall(text)
+
+        matches = self.matcher.find(words)
+        cooking = tuple(phrase for phrase, category in matches if category == "cooking")
+        if cooking:
+            return Verdict("cooking", None, cooking)
+
+        letters = [ch for ch in text if ch.isalpha()]
+        if not letters:
+            return Verdict("unknown", None)
+        # "make me שקשוקה" is partly English, so the model gets to read it
+        english = sum(1 for word in words if word in self._english)
+        kitchen = tuple(phrase for phrase, category in matches if category == "kitchen")
+        if not english and not kitchen:
+            foreign_script = sum(1 for ch in letters if _script(ch) != "latin")
+            if foreign_script >= len(letters) * self.non_latin_share:
+                return Verdict("non_english", NON_ENGLISH_REPLY)
+            foreign = [word for word in words if word in self._foreign]
+            if len(foreign) >= self.foreign_words:
+                return Verdict("non_english", NON_ENGLISH_REPLY, tuple(foreign))
+
+        off_topic = tuple(phrase for phrase, category in matches if category == "off_topic")
+        if off_topic and not kitchen and not follow_up:
+            return Verdict("off_topic", OFF_TOPIC_REPLY, off_topic)
+        return Verdict("unknown", None, kitchen)
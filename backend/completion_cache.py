@@ -0,0 +1,113 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+def normalize_messages(messages: List[Dict]) -> List[Dict]:
+    """Collapse whitespace everywhere and case in user messages.
+
+    "Chicken  Curry" and "chicken curry" should share one cached answer;
+    assistant and system text keep their case since it is what the model saw.
+    """
+    normalized = []
+    for message in messages:
+        content = " ".join(message["content"].split())
+        if message["role"] == "user":
+            content = content.lower()
+        normalized.append({"role": message["role"], "content": content})
+    return normalized
+
+
+def cache_key(model: str, messages: List[Dict]) -> str:
+    """Cache key: model plus a hash of the normalized message list"""
+    body = json.dumps(normalize_messages(messages), separators=(",", ":"), ensure_ascii=False)
+    return model + ":" + hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """Two-tier cache for LLM completions.
+
+    The first tier is an in-process LRU with a TTL. The optional second tier
+    is the ``completion_cache`` table behind ``store`` (a DatabaseManager),
+    which survives restarts and is shared by every gunicorn worker using the
+    same database file.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = 86400.0, store=None,
+                 purge_every: int = 200):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.store = store
+        self.purge_every = purge_every
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (response, expires_at)
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "persistent_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                response, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return response
+                del self._entries[key]
+
+        if self.store is not None:
+            try:
+                cached = self.store.get_cached_completion(key)
+            except Exception as e:
+                # The cache must never take a request down with it
+                print(f"Completion cache read failed: {e}")
+                cached = None
+            if cached is not None:
+                self._remember(key, cached["response"], cached["expires_at"])
+                with self._lock:
+                    self._stats["persistent_hits"] += 1
+                return cached["response"]
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, key: str, model: str, response: Dict):
+        expires_at = time.time() + self.ttl
+        self._remember(key, response, expires_at)
+        with self._lock:
+            self._stats["stores"] += 1
+            purge = self._stats["stores"] % self.purge_every == 0
+
+        if self.store is not None:
+            try:
+                self.store.put_cached_completion(key, model, response, expires_at)
+                if purge:
+                    self.store.purge_expired_completions()
+            except Exception as e:
+                print(f"Completion cache write failed: {e}")
+
+    def _remember(self, key: str, response: Dict, expires_at: float):
+        with self._lock:
+            self._entries[key] = (response, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+        stats["hit_rate"] = round((lookups - stats["misses"]) / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,130 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Rough token estimate: ~4 characters per token for English text, plus a few
+# tokens of chat-format overhead per message. Good enough for budgeting
+# without shipping the model's tokenizer.
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Cap on the number of summary lines kept, so the summary itself stays small
+MAX_SUMMARY_LINES = 20
+
+_TITLE_RE = re.compile(r"<h3[^>]*>(.*?)</h3>", re.IGNORECASE | re.DOTALL)
+_TAG_RE = re.compile(r"<[^>]+>")
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of a piece of text"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def message_tokens(message: Dict) -> int:
+    """Estimate the tokens a chat message adds to the prompt"""
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _summarize_turn(message: Dict) -> Optional[str]:
+    """One summary line for a turn that no longer fits in the window"""
+    if message["role"] == "user":
+        text = " ".join(message["content"].split())
+        if not text:
+            return None
+        return f"- User asked: {text[:120]}"
+
+    title = _TITLE_RE.search(message["content"])
+    if title:
+        text = _TAG_RE.sub("", title.group(1)).strip()
+    else:
+        text = " ".join(_TAG_RE.sub(" ", message["content"]).split())[:80]
+    return f"- You suggested: {text}" if text else None
+
+
+def _summary_message(summary_text: str) -> Dict:
+    return {
+        "role": "system",
+        "content": "Summary of the earlier conversation:\n" + summary_text,
+    }
+
+
+def _summary_tokens(summary_text: Optional[str]) -> int:
+    return message_tokens(_summary_message(summary_text)) if summary_text else 0
+
+
+def _fold_into_summary(previous: Optional[str], dropped: List[Dict]) -> str:
+    lines = previous.splitlines() if previous else []
+    lines.extend(line for line in map(_summarize_turn, dropped) if line)
+    return "\n".join(lines[-MAX_SUMMARY_LINES:])
+
+
+def build_context(db, user_id: int, message: str, token_budget: int,
+                  max_turns: int = 40, summarize: bool = True) -> Tuple[List[Dict], Dict]:
+    """Assemble the messages sent to the LLM for one request.
+
+    The system message and the new user message are always included. The
+    rest of the budget is filled with the most recent turns, newest first,
+    and stops at the first turn that doesn't fit. When ``summarize`` is on,
+    turns pushed out of the window are folded into a stored rolling summary
+    that is sent as a second system message; once folded, a turn is only
+    ever sent as part of the summary, even if a later budget has room.
+
+    Returns the message list and a dict of token counts for the request.
+    """
+    system = db.get_system_message(user_id)
+    user_message = {"role": "user", "content": message}
+    summary = db.get_conversation_summary(user_id) if summarize else None
+    turns = db.get_recent_conversation(user_id, max_turns)
+
+    system_tokens = message_tokens(system) if system else 0
+    user_tokens = message_tokens(user_message)
+    summary_text = summary["summary"] if summary else None
+    summarized_through = summary["summarized_through_id"] if summary else 0
+    # Turns already folded into the summary reach the model through it, never verbatim as well
+    turns = [turn for turn in turns if turn["id"] > summarized_through]
+
+    # Fill from the newest turn backwards until the budget runs out
+    remaining = token_budget - system_tokens - user_tokens - _summary_tokens(summary_text)
+    kept: List[Dict] = []
+    for turn in reversed(turns):
+        if message_tokens(turn) > remaining:
+            break
+        kept.append(turn)
+        remaining -= message_tokens(turn)
+    kept.reverse()
+    dropped = turns[:len(turns) - len(kept)]
+
+    if summarize:
+        previous_text = summary_text
+        while True:
+            new_dropped = list(dropped)
+            summary_text = _fold_into_summary(previous_text, new_dropped) if new_dropped else previous_text
+            # A grown summary may push the oldest kept turns out as well
+            growth = _summary_tokens(summary_text) - _summary_tokens(previous_text)
+            if growth <= remaining or not kept:
+                break
+            turn = kept.pop(0)
+            remaining += message_tokens(turn)
+            dropped.append(turn)
+        if new_dropped:
+            summarized_through = new_dropped[-1]["id"]
+            db.save_conversation_summary(user_id, summary_text, summarized_through)
+
+    messages = [system] if system else []
+    if summary_text:
+        messages.append(_summary_message(summary_text))
+    messages.extend({"role": turn["role"], "content": turn["content"]} for turn in kept)
+    messages.append(user_message)
+
+    summary_tokens = _summary_tokens(summary_text)
+    history_tokens = sum(message_tokens(turn) for turn in kept)
+    stats = {
+        "budget": token_budget,
+        "system_tokens": system_tokens,
+        "summary_tokens": summary_tokens,
+        "history_tokens": history_tokens,
+        "message_tokens": user_tokens,
+        "total_tokens": system_tokens + summary_tokens + history_tokens + user_tokens,
+        "turns_included": len(kept),
+        "turns_dropped": len(dropped),
+    }
+    return messages, stats
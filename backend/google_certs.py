@@ -0,0 +1,156 @@
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+from google.auth import exceptions as google_exceptions
+from google.auth import jwt as google_jwt
+
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = ["accounts.google.com", "https://accounts.google.com"]
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+class GoogleCertCache:
+    """Google's ID-token signing certificates, fetched once and kept fresh.
+
+    ``verify_oauth2_token`` from google-auth downloads the certs on every
+    call. This cache keeps them for as long as the response's
+    ``Cache-Control: max-age`` allows and refreshes them in a background
+    thread before they expire, so after warmup a login only does the
+    signature check. A token signed with a key id we haven't seen triggers
+    one synchronous refresh, which covers Google rotating its keys early;
+    such refreshes happen at most once per ``min_force_interval`` seconds,
+    so tokens with made-up key ids can't turn logins into Google fetches.
+    A failed refresh keeps serving the cached certs and is retried by the
+    background timer with exponential backoff (``retry_delay`` doubling
+    up to ``max_retry_delay``).
+    """
+
+    def __init__(self, certs_url: str = GOOGLE_CERTS_URL, default_max_age: float = 3600.0,
+                 refresh_ahead: float = 0.1, timeout: float = 5.0, min_force_interval: float = 60.0,
+                 retry_delay: float = 30.0, max_retry_delay: float = 600.0):
+        self.certs_url = certs_url
+        self.default_max_age = default_max_age
+        self.refresh_ahead = refresh_ahead  # share of the lifetime left when refreshing
+        self.timeout = timeout
+        self.min_force_interval = min_force_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.session = requests.Session()
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._certs: Dict[str, str] = {}
+        self._fetched_at = 0.0
+        self._expires_at = 0.0
+        self._forced_at = float("-inf")  # last refresh forced by an unknown key id
+        self._failures = 0  # consecutive failed fetches
+        self._timer: Optional[threading.Timer] = None
+        self._stats = {"fetches": 0, "fetch_errors": 0, "verifications": 0, "forced_refreshes_skipped": 0}
+
+    def get_certs(self, force: bool = False) -> Dict[str, str]:
+        with self._lock:
+            if not force and self._certs and (time.time() < self._expires_at or self._failures):
+                # After a failed fetch the background timer does the retrying
+                return self._certs
+            if force and self._certs:
+                now = time.monotonic()
+                if now - self._forced_at < self.min_force_interval:
+                    # Refreshed for an unknown key id very recently: answer
+                    # without a fetch, and without queueing on _refresh_lock
+                    self._stats["forced_refreshes_skipped"] += 1
+                    return self._certs
+                self._forced_at = now
+        return self.refresh(force=force)
+
+    def refresh(self, force: bool = True) -> Dict[str, str]:
+        """Fetch the certs now (one fetch at a time; waiters reuse its result)"""
+        started = time.time()
+        with self._refresh_lock:
+            with self._lock:
+                # Someone else refreshed while we waited for the lock
+                fresh = self._certs and time.time() < self._expires_at
+                if fresh and (not force or self._fetched_at >= started):
+                    return self._certs
+            try:
+                resp = self.session.get(self.certs_url, timeout=self.timeout)
+                resp.raise_for_status()
+                certs = resp.json()
+            except (requests.RequestException, ValueError) as e:
+                with self._lock:
+                    self._stats["fetch_errors"] += 1
+                    self._failures += 1
+                    retry_in = min(self.max_retry_delay, self.retry_delay * 2 ** (self._failures - 1))
+                    certs = self._certs
+                # Whoever failed, the timer keeps trying in the background
+                self._schedule_refresh(retry_in)
+                if certs:
+                    # Keep serving the old certs until a retry succeeds
+                    print(f"Google cert refresh failed, using cached certs (retry in {retry_in:.0f}s): {e}")
+                    return certs
+                raise google_exceptions.TransportError(
+                    f"Could not fetch certificates at {self.certs_url}"
+                ) from e
+
+            max_age = self._max_age(resp.headers.get("Cache-Control", ""))
+            with self._lock:
+                self._certs = certs
+                self._fetched_at = time.time()
+                self._expires_at = self._fetched_at + max_age
+                self._failures = 0
+                self._stats["fetches"] += 1
+            self._schedule_refresh(max_age * (1 - self.refresh_ahead))
+            return certs
+
+    def verify_oauth2_token(self, token: str, audience: Optional[str] = None,
+                            clock_skew_in_seconds: int = 0) -> Dict:
+        """Drop-in replacement for google.oauth2.id_token.verify_oauth2_token"""
+        certs = self.get_certs()
+        if isinstance(token, str):
+            token = token.encode("utf-8")
+        kid = google_jwt.decode_header(token).get("kid")
+        if kid is not None and kid not in certs:
+            certs = self.get_certs(force=True)
+
+        idinfo = google_jwt.decode(
+            token,
+            certs=certs,
+            audience=audience,
+            clock_skew_in_seconds=clock_skew_in_seconds,
+        )
+        if idinfo["iss"] not in GOOGLE_ISSUERS:
+            raise google_exceptions.GoogleAuthError(
+                f"Wrong issuer. 'iss' should be one of the following: {GOOGLE_ISSUERS}"
+            )
+        with self._lock:
+            self._stats["verifications"] += 1
+        return idinfo
+
+    def _max_age(self, cache_control: str) -> float:
+        match = _MAX_AGE_RE.search(cache_control)
+        return float(match.group(1)) if match else self.default_max_age
+
+    def _schedule_refresh(self, delay: float):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(max(delay, 1.0), self._background_refresh)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            # refresh() has already scheduled the next attempt with backoff
+            print(f"Background Google cert refresh failed: {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["keys"] = len(self._certs)
+            stats["expires_in"] = max(0.0, round(self._expires_at - time.time(), 1))
+        return stats
@@ -0,0 +1,22 @@
+# Gunicorn settings (loaded with --config, see Procfile)
+import os
+
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+
+# Threaded workers: a request waiting on OpenRouter pins one thread, not the
+# whole worker, so cheap endpoints stay responsive. LLM_MAX_CONCURRENCY in
+# app.py keeps LLM calls from using up every thread.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+
+# Streamed completions can legitimately run longer than gunicorn's 30 s default
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+
+def worker_exit(server, worker):
+    # Commit conversation writes still queued in this worker's write-behind buffer
+    try:
+        import app
+        app.db.close()
+    except Exception as e:
+        print(f"Error flushing database on worker exit: {e}")
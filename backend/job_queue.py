@@ -0,0 +1,198 @@
+import os
+import queue
+import random
+import threading
+import time
+import traceback
+from typing import Callable, Dict, Optional, Tuple
+
+
+BUSY_MESSAGE = "Too many recipe requests in progress, please try again shortly"
+USER_BUSY_MESSAGE = "You already have recipes being prepared, please wait for them"
+
+
+class JobQueueFullError(Exception):
+    """Raised when no more jobs can be queued right now (for everyone, or for this user)"""
+
+    def __init__(self, message: str, per_user: bool = False):
+        super().__init__(message)
+        self.per_user = per_user
+
+
+class RecipeJobQueue:
+    """Runs recipe requests in the background for the submit/poll jobs API.
+
+    ``submit()`` records the job in the recipe_jobs table and returns at
+    once; one of ``workers`` threads later takes it, calls ``run(job)``
+    and stores what it returns. ``run`` returns ``(status, result,
+    messages)``: "done" or "failed", the JSON body the poller gets, and the
+    (role, content) exchange to add to the user's history, which is
+    written in the same transaction as the result and only once.
+
+    At most ``max_queued`` jobs wait per worker process and each user may
+    have ``max_per_user`` jobs queued or running; beyond that submit()
+    raises JobQueueFullError, which the API turns into 503 or 429, so a
+    burst is pushed back to the clients instead of piling up.
+
+    ``wait()`` long-polls a job. It wakes up as soon as a job run by this
+    process finishes; a job run by another gunicorn worker is seen at the
+    next re-read of its row, every ``poll_interval`` seconds.
+
+    Job ids wait in an in-memory queue, so a worker process that dies takes
+    its queued jobs with it. Every process sweeps the table when it starts
+    and then every ``sweep_interval`` seconds: expired jobs are deleted,
+    jobs queued without an update for ``stale_after`` seconds are taken
+    over into its own queue (as far as it has room), and jobs running that
+    long, or queued for ``max_wait`` seconds, are failed. Stale jobs don't
+    count towards ``max_per_user``.
+    """
+
+    def __init__(self, db, run: Callable[[Dict], Tuple[str, Dict, Optional[list]]], workers: int = 4,
+                 max_queued: int = 64, max_per_user: int = 3, ttl: float = 3600.0,
+                 stale_after: float = 600.0, max_wait: float = 1800.0, poll_interval: float = 0.5,
+                 sweep_interval: float = 60.0):
+        self.db = db
+        self.run = run
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_per_user = max_per_user
+        self.ttl = ttl
+        self.stale_after = stale_after
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval
+
+        self._queue: "queue.Queue[str]" = queue.Queue(maxsize=max_queued)
+        self._lock = threading.Lock()
+        self._finished = threading.Condition(self._lock)
+        self._threads = []
+        self._pid = None
+        self._stats = {"submitted": 0, "deduplicated": 0, "rejected": 0, "done": 0, "failed": 0,
+                       "purged": 0, "stale": 0, "requeued": 0}
+
+    def start(self):
+        """Start the worker and sweeper threads of this process (idempotent)"""
+        self._ensure_workers()
+
+    def _ensure_workers(self):
+        # Checked on every use so each gunicorn worker gets its own threads after a fork
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self._work, name=f"recipe-job-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            self._threads.append(threading.Thread(target=self._sweep_loop, name="recipe-job-sweeper", daemon=True))
+            for thread in self._threads:
+                thread.start()
+
+    def submit(self, user_id: int, message: str, client_key: Optional[str] = None) -> Tuple[Dict, bool]:
+        """Queue a job; returns ``(job, created)`` like DatabaseManager.create_recipe_job"""
+        self._ensure_workers()
+        if self._queue.full():
+            self._count("rejected")
+            raise JobQueueFullError(BUSY_MESSAGE)
+
+        job, created = self.db.create_recipe_job(user_id, message, self.ttl, client_key)
+        if not created:
+            self._count("deduplicated")
+            return job, False
+
+        # The row is written first so a concurrent retry with the same key
+        # finds it; when it turns out to be one too many it is removed again
+        if self.db.count_active_recipe_jobs(user_id, self.stale_after) > self.max_per_user:
+            self._reject(job, USER_BUSY_MESSAGE, per_user=True)
+        try:
+            self._queue.put_nowait(job["job_id"])
+        except queue.Full:
+            self._reject(job, BUSY_MESSAGE)
+
+        self._count("submitted")
+        return job, True
+
+    def _reject(self, job: Dict, message: str, per_user: bool = False):
+        # Deleted rather than failed, so a retry under the same key gets another chance
+        self.db.delete_recipe_job(job["job_id"])
+        self._count("rejected")
+        raise JobQueueFullError(message, per_user=per_user)
+
+    def wait(self, user_id: int, job_id: str, timeout: float = 0.0) -> Optional[Dict]:
+        """The job, once finished or after ``timeout`` seconds, whichever comes first; None if unknown"""
+        self._ensure_workers()
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.db.get_recipe_job(user_id, job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in ("done", "failed") or remaining <= 0:
+                return job
+            with self._finished:
+                self._finished.wait(min(remaining, self.poll_interval))
+
+    def sweep(self) -> Dict[str, int]:
+        """Delete expired jobs, fail dead ones and take over orphaned queued ones (see the class docstring)"""
+        try:
+            swept = self.db.purge_recipe_jobs(self.stale_after, self.max_wait)
+            room = self.max_queued - self._queue.qsize()
+            job_ids = self.db.requeue_stale_recipe_jobs(self.stale_after, room) if room > 0 else []
+        except Exception:
+            print("Error sweeping recipe jobs:")
+            traceback.print_exc()
+            return {}
+        requeued = 0
+        for job_id in job_ids:
+            try:
+                self._queue.put_nowait(job_id)
+            except queue.Full:
+                # Claimed but no room after all; it goes stale again and is picked up by a later sweep
+                break
+            requeued += 1
+        swept["requeued"] = requeued
+        with self._lock:
+            self._stats["purged"] += swept["expired"]
+            self._stats["stale"] += swept["stale"]
+            self._stats["requeued"] += requeued
+        if swept["stale"] or requeued:
+            print(f"Recipe jobs: failed {swept['stale']} stale, took over {requeued} orphaned")
+        return swept
+
+    def _sweep_loop(self):
+        # The first sweep runs at startup, to pick up what a worker that just died left behind
+        while True:
+            self.sweep()
+            time.sleep(self.sweep_interval * random.uniform(0.9, 1.1))
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run_one(job_id)
+            except Exception:
+                print(f"Error running recipe job {job_id}:")
+                traceback.print_exc()
+            finally:
+                with self._finished:
+                    self._finished.notify_all()
+
+    def _run_one(self, job_id: str):
+        job = self.db.start_recipe_job(job_id)
+        if job is None:
+            return
+        try:
+            status, result, messages = self.run(job)
+        except Exception as e:
+            traceback.print_exc()
+            status, result, messages = "failed", {"error": str(e)}, None
+        self.db.finish_recipe_job(job_id, status, result, messages)
+        self._count(status)
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queued"] = self._queue.qsize()
+        return stats
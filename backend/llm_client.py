@@ -0,0 +1,267 @@
+import json
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Upstream statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """Raised when the completion could not be obtained from the upstream"""
+
+
+class CircuitOpenError(LLMError):
+    """Raised without calling upstream while the circuit breaker is open"""
+
+
+class RequestCancelledError(LLMError):
+    """Raised instead of retrying once the caller no longer wants the result"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    After ``failure_threshold`` failures in a row the circuit opens and calls
+    fail fast for ``reset_timeout`` seconds. Then a single trial call is let
+    through (half-open): success closes the circuit, failure re-opens it.
+    A trial that ends without a verdict (cancelled, or an unexpected error)
+    is handed back with ``release_trial()`` so the next call can be the
+    trial instead.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._trial_thread: Optional[int] = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                self._trial_thread = threading.get_ident()
+                return True
+            return False
+
+    @property
+    def available(self) -> bool:
+        """Whether allow() would let a call through right now"""
+        with self._lock:
+            state = self._state()
+            return state == "closed" or (state == "half-open" and not self._trial_in_flight)
+
+    def release_trial(self):
+        """Give up the half-open trial taken by this thread, leaving the state as it is"""
+        with self._lock:
+            if self._trial_in_flight and self._trial_thread == threading.get_ident():
+                self._trial_in_flight = False
+                self._trial_thread = None
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+            self._trial_thread = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+            self._trial_thread = None
+
+
+class LLMClient:
+    """OpenRouter chat-completions client shared by all requests of a worker.
+
+    Keeps a pooled ``requests.Session`` so TCP/TLS connections are reused,
+    retries 429/5xx and connection errors with jittered exponential backoff
+    (honouring ``Retry-After``), and trips a circuit breaker when the
+    upstream keeps failing.
+    """
+
+    def __init__(self, api_url: str, api_key: str, model: str,
+                 pool_size: int = 10, timeout: float = 15.0, max_retries: int = 2,
+                 backoff_base: float = 0.5, backoff_cap: float = 8.0,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.api_url = api_url
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type":  "application/json",
+            "Referer":       "http://localhost:3000"
+        })
+
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "attempts": 0,
+            "retries": 0,
+            "failures": 0,
+            "short_circuited": 0,
+            "latency_count": 0,
+            "latency_total": 0.0,
+            "latency_max": 0.0,
+        }
+
+    def complete(self, messages: List[Dict], model: Optional[str] = None,
+                 cancel: Optional[threading.Event] = None) -> Dict:
+        """Run a chat completion and return the decoded JSON response.
+
+        Setting ``cancel`` stops further retries; an attempt already sent
+        still runs to completion or timeout.
+        """
+        payload = {"model": model or self.model, "messages": messages}
+        resp = self._post(payload, stream=False, timeout=self.timeout, cancel=cancel)
+        try:
+            return resp.json()
+        finally:
+            resp.close()
+
+    def stream(self, messages: List[Dict], model: Optional[str] = None) -> Iterator[str]:
+        """Run a streamed chat completion, yielding content deltas as they arrive.
+
+        Retries only cover opening the stream; once bytes are flowing an error
+        is raised to the caller. The read timeout applies between chunks.
+        """
+        payload = {"model": model or self.model, "messages": messages, "stream": True}
+        resp = self._post(payload, stream=True, timeout=(5, self.timeout))
+        with resp:
+            for line in resp.iter_lines(decode_unicode=True):
+                # Upstream SSE: "data: {...}" lines, ": keep-alive" comments
+                if not line or not line.startswith("data:"):
+                    continue
+                chunk = line[len("data:"):].strip()
+                if chunk == "[DONE]":
+                    return
+                delta = json.loads(chunk).get("choices", [{}])[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+
+    def _post(self, payload: Dict, stream: bool, timeout,
+              cancel: Optional[threading.Event] = None) -> requests.Response:
+        self._count("requests")
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            raise CircuitOpenError("Recipe service is temporarily unavailable, please try again shortly")
+
+        start = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                self._count("attempts")
+                retry_after = None
+                try:
+                    resp = self.session.post(self.api_url, json=payload, stream=stream, timeout=timeout)
+                    if resp.status_code not in RETRY_STATUSES:
+                        resp.raise_for_status()
+                        self.breaker.record_success()
+                        self._record_latency(time.perf_counter() - start)
+                        return resp
+                    retry_after = self._retry_after(resp)
+                    error = requests.HTTPError(f"{resp.status_code} from upstream", response=resp)
+                    resp.close()
+                except requests.HTTPError as e:
+                    # Non-retryable 4xx: upstream is reachable but rejected this
+                    # request, so it counts as healthy for the breaker
+                    if e.response is not None:
+                        e.response.close()  # a streamed body is never read; free the connection now
+                    self.breaker.record_success()
+                    self._count("failures")
+                    raise
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    self.breaker.record_failure()
+                    raise LLMError(f"Upstream failed after {attempt + 1} attempts: {error}") from error
+
+                attempt += 1
+                self._count("retries")
+                delay = self._backoff(attempt, retry_after)
+                if cancel is None:
+                    time.sleep(delay)
+                elif cancel.wait(delay):
+                    # Neither a success nor a verdict on upstream health, so the breaker isn't told
+                    raise RequestCancelledError("Completion no longer needed") from error
+        except BaseException:
+            # Cancelled or failed in an unexpected way: no verdict on upstream
+            # health, but a half-open trial must not stay taken forever
+            self.breaker.release_trial()
+            raise
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        """Full-jitter exponential backoff, never shorter than Retry-After"""
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_cap))
+        return delay
+
+    @staticmethod
+    def _retry_after(resp: requests.Response) -> Optional[float]:
+        value = resp.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _record_latency(self, seconds: float):
+        with self._lock:
+            self._stats["latency_count"] += 1
+            self._stats["latency_total"] += seconds
+            self._stats["latency_max"] = max(self._stats["latency_max"], seconds)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        count = stats["latency_count"]
+        stats["latency_avg"] = stats["latency_total"] / count if count else 0.0
+        stats["circuit"] = self.breaker.state
+        return stats
@@ -0,0 +1,65 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+
+class GatewayBusyError(Exception):
+    """Raised when every LLM slot stayed busy for the whole queue timeout"""
+
+
+class LLMGateway:
+    """Caps how many request threads may be inside an LLM call at once.
+
+    Workers run with several threads each (see gunicorn.conf.py), so a slow
+    completion only pins one thread. The gateway keeps LLM calls from taking
+    all of them: once ``max_concurrency`` calls are in flight, further LLM
+    requests wait up to ``queue_timeout`` seconds for a slot and are then
+    turned away, while /me, /favorites and the rest keep their threads.
+    """
+
+    def __init__(self, max_concurrency: int = 8, queue_timeout: float = 10.0):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._queue_wait = 0.0
+
+    def acquire(self):
+        """Take a slot or raise GatewayBusyError"""
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self._rejected += 1
+            raise GatewayBusyError("Too many recipe requests in progress, please try again shortly")
+        with self._lock:
+            self._in_flight += 1
+            self._queue_wait += time.perf_counter() - start
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._completed += 1
+        self._slots.release()
+
+    @contextmanager
+    def slot(self):
+        """Hold an LLM slot for the duration of the ``with`` block"""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "queue_wait_total": round(self._queue_wait, 6),
+            }
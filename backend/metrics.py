@@ -0,0 +1,452 @@
+import glob
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: folding is only serialized within a process
+    fcntl = None
+
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CALL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+# name -> (type, help, buckets)
+METRICS = {
+    "request_duration_seconds": ("histogram", "HTTP request latency by endpoint", DURATION_BUCKETS),
+    "phase_duration_seconds": ("histogram", "Time per instrumented call, by phase and call", DURATION_BUCKETS),
+    "request_calls": ("histogram", "Instrumented calls made by one request, by endpoint and phase", CALL_COUNT_BUCKETS),
+    "phase_errors_total": ("counter", "Instrumented calls that raised, by phase and call", None),
+    "slow_requests_total": ("counter", "Requests slower than SLOW_REQUEST_MS, by endpoint", None),
+    "llm_coalesced_requests_total": ("counter", "Completions served by joining an identical in-flight call", None),
+    "llm_route_events_total": ("counter", "Model router hedges, hedge wins and failovers, by model", None),
+    "prompt_classifications_total": ("counter", "Chat messages by local classifier verdict", None),
+    "prompt_classifier_disagreements_total": ("counter", "Shadow mode: local verdict and model disagreed", None),
+}
+
+# Components whose own stats() are exported per worker: name -> (help, stats that are gauges).
+# Every other numeric stat is a counter
+COMPONENT_STATS = {
+    "db_pool": ("SQLite connection pool", {"max_size", "open", "idle", "in_use", "wait_time_avg"}),
+    "user_cache": ("User lookup cache", {"entries", "max_entries", "hit_rate", "shared"}),
+    "write_behind": ("Group-committed conversation writes", {"queued", "avg_batch"}),
+    "completion_cache": ("Completion cache", {"entries", "hit_rate"}),
+    "llm_client": ("OpenRouter HTTP client, by model", {"latency_avg", "latency_max", "circuit_open"}),
+    "llm_gateway": ("OpenRouter concurrency limit", {"max_concurrency", "in_flight"}),
+    "single_flight": ("Coalescing of identical in-flight completions", {"in_flight", "waiting"}),
+    "token_cache": ("Verified session token cache", {"entries", "hit_rate"}),
+    "recipe_jobs": ("Background recipe job queue", {"queued"}),
+}
+
+
+def _label_key(labels: Dict[str, str]) -> str:
+    return json.dumps(sorted(labels.items()), separators=(",", ":"))
+
+
+def _merge(merged: Dict, state: Dict):
+    """Add the counts in ``state`` to ``merged``"""
+    for name, series in state.get("histograms", {}).items():
+        target = merged["histograms"].setdefault(name, {})
+        for key, counts in series.items():
+            if key in target:
+                target[key] = [a + b for a, b in zip(target[key], counts)]
+            else:
+                target[key] = list(counts)
+    for name, series in state.get("counters", {}).items():
+        target = merged["counters"].setdefault(name, {})
+        for key, value in series.items():
+            target[key] = target.get(key, 0) + value
+
+
+class RequestTimings:
+    """Where the request running on this thread has spent its time so far"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total: Optional[float] = None  # set when the request finishes
+        self.phases: Dict[str, float] = {}  # phase -> seconds
+        self.calls: Dict[str, int] = {}  # phase -> number of calls
+        self.detail: Dict[str, List] = {}  # "phase.call" -> [calls, seconds]
+        self.active = set()  # phases currently on the stack (nested calls aren't counted twice)
+
+    def add(self, phase: str, call: str, elapsed: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + elapsed
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        entry = self.detail.setdefault(f"{phase}.{call}", [0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+
+    def breakdown(self) -> str:
+        """One-line summary for the slow-request log"""
+        total = self.total if self.total is not None else time.perf_counter() - self.started
+        parts = []
+        for phase, seconds in sorted(self.phases.items(), key=lambda item: -item[1]):
+            parts.append(f"{phase} {seconds * 1000:.1f} ms in {self.calls[phase]} call(s)")
+        other = total - sum(self.phases.values())
+        parts.append(f"other {other * 1000:.1f} ms")
+        calls = ", ".join(
+            f"{name} x{count} {seconds * 1000:.1f} ms"
+            for name, (count, seconds) in sorted(self.detail.items(), key=lambda item: -item[1][1])
+        )
+        return "; ".join(parts) + (f" [{calls}]" if calls else "")
+
+
+class Metrics:
+    """Request and per-phase timing histograms with Prometheus text output.
+
+    Phases are named stretches of work inside a request ("auth", "db",
+    "llm", ...). They are timed with ``phase()`` or by wrapping an object's
+    methods with ``instrument()``, which leaves the object's code untouched.
+    Each call lands in a process-wide histogram and in the timings of the
+    request running on the current thread, so a slow request can be logged
+    with its own breakdown.
+
+    gunicorn workers are separate processes. With a ``directory``, every
+    worker writes its counts to ``metrics-<pid>.json`` there (every
+    ``flush_interval`` seconds, and on every scrape), and ``render()`` adds
+    up the files of all workers. When a worker has died, its counts are
+    added to ``archive.json`` in the same directory before its file is
+    removed (as prometheus_client's multiprocess mode does), so totals only
+    ever go up across worker restarts. The counts a worker gathered since
+    its last flush are lost with it.
+
+    Components with a ``stats()`` method of their own (the connection
+    pool, caches, OpenRouter clients, ...) are added with
+    ``register_stats()``. Their numbers are read at every flush and
+    exported per worker, with a ``pid`` label, for live workers only.
+    """
+
+    counted_phases = ("auth", "db", "llm")  # per-request call counts are recorded for these
+
+    def __init__(self, namespace: str = "recipe_app", directory: Optional[str] = None,
+                 flush_interval: float = 5.0):
+        self.namespace = namespace
+        self.directory = directory
+        self.flush_interval = flush_interval
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[str, List[float]]] = {}  # name -> label key -> bucket counts + [sum]
+        self._counters: Dict[str, Dict[str, float]] = {}
+        self._local = threading.local()
+        self._flusher_pid = None  # process the background flush thread runs in
+        self._archive_lock = threading.Lock()
+        self._providers: List[tuple] = []  # (component, label key, stats function)
+
+    def register_stats(self, component: str, stats, **labels):
+        """Export what ``stats()`` returns (a dict, or None to skip) under ``component`` of COMPONENT_STATS"""
+        if component not in COMPONENT_STATS:
+            raise ValueError(f"Unknown metrics component: {component}")
+        self._providers.append((component, _label_key(labels), stats))
+
+    # Recording
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = METRICS[name][2]
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            counts = series.get(key)
+            if counts is None:
+                counts = series[key] = [0] * (len(buckets) + 1) + [0.0]  # buckets, +Inf, sum
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(buckets)] += 1
+            counts[-1] += value
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def current(self) -> Optional[RequestTimings]:
+        return getattr(self._local, "request", None)
+
+    def start_request(self):
+        self._local.request = RequestTimings()
+
+    def finish_request(self, endpoint: str, method: str, status: int) -> Optional[RequestTimings]:
+        """Record the request started on this thread; returns its timings"""
+        timings = self.current()
+        if timings is None:
+            return None
+        self._local.request = None
+        total = time.perf_counter() - timings.started
+        self.observe("request_duration_seconds", total, endpoint=endpoint, method=method, status=str(status))
+        for phase in self.counted_phases:
+            self.observe("request_calls", timings.calls.get(phase, 0), endpoint=endpoint, phase=phase)
+        timings.total = total
+
+        if self.directory and self._flusher_pid != os.getpid():
+            self._start_flusher()
+        return timings
+
+    @contextmanager
+    def phase(self, phase: str, call: str = ""):
+        """Time the ``with`` block as one call of ``phase``"""
+        timings = self.current()
+        if timings is not None and phase in timings.active:
+            yield
+            return
+        if timings is not None:
+            timings.active.add(phase)
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc("phase_errors_total", phase=phase, call=call)
+            raise
+        finally:
+            if timings is not None:
+                timings.active.discard(phase)
+            self._record(phase, call, time.perf_counter() - start)
+
+    def _record(self, phase: str, call: str, elapsed: float):
+        self.observe("phase_duration_seconds", elapsed, phase=phase, call=call)
+        timings = self.current()
+        if timings is not None:
+            timings.add(phase, call, elapsed)
+
+    def instrument(self, obj, phase: str, names: Optional[Iterable[str]] = None,
+                   exclude: Iterable[str] = ()):
+        """Replace ``obj``'s methods with timed wrappers (all public ones by default).
+
+        Generator methods, such as a streamed completion, are timed across
+        their iteration rather than at creation.
+        """
+        if names is None:
+            names = [name for name in dir(type(obj)) if not name.startswith("_")]
+        exclude = set(exclude)
+        for name in names:
+            method = getattr(obj, name)
+            if name in exclude or not callable(method):
+                continue
+            setattr(obj, name, self._wrap(method, phase, name))
+        return obj
+
+    def _wrap(self, func, phase: str, call: str):
+        if inspect.isgeneratorfunction(func):
+            @wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                return self._timed_generator(func(*args, **kwargs), phase, call)
+            return generator_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.phase(phase, call):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def _timed_generator(self, gen, phase: str, call: str):
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(gen)
+                except StopIteration:
+                    return
+                except Exception:
+                    self.inc("phase_errors_total", phase=phase, call=call)
+                    raise
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield item
+        finally:
+            gen.close()
+            self._record(phase, call, elapsed)
+
+    # Aggregation and output
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            state = {
+                "histograms": {name: {key: list(counts) for key, counts in series.items()}
+                               for name, series in self._histograms.items()},
+                "counters": {name: dict(series) for name, series in self._counters.items()},
+            }
+        # Outside our lock: the components take their own
+        state["components"] = self._component_stats()
+        return state
+
+    def _component_stats(self) -> Dict:
+        components = {}
+        for component, key, stats in self._providers:
+            try:
+                values = stats()
+            except Exception as e:
+                print(f"Could not read {component} stats: {e}")
+                continue
+            if values is not None:
+                components.setdefault(component, {})[key] = values
+        return components
+
+    def _start_flusher(self):
+        # Started lazily from a request so it runs in the gunicorn worker, not the master
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        thread = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+        thread.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write this worker's counts to the shared directory"""
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self.snapshot(), f, separators=(",", ":"))
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Could not write metrics file {path}: {e}")
+
+    def collect(self) -> Dict:
+        """Counts summed over every worker, past and present (or just this one without a directory)"""
+        if not self.directory:
+            state = self.snapshot()
+            state["components"] = {str(os.getpid()): state["components"]}
+            return state
+        self.flush()
+        merged = {"histograms": {}, "counters": {}, "components": {}}  # components: pid -> stats
+        dead = []
+        for path in glob.glob(os.path.join(self.directory, "metrics-*.json")):
+            pid = os.path.basename(path)[len("metrics-"):-len(".json")]
+            if not _alive(pid):
+                dead.append(path)
+                continue
+            state = _read_state(path)
+            if state is not None:
+                _merge(merged, state)
+                merged["components"][pid] = state.get("components", {})
+        if dead:
+            self._fold(dead)
+        archived = _read_state(os.path.join(self.directory, "archive.json"))
+        if archived is not None:
+            _merge(merged, archived)
+        return merged
+
+    def _fold(self, paths: List[str]):
+        """Add dead workers' files to the archive, then remove them"""
+        archive_path = os.path.join(self.directory, "archive.json")
+        with self._archive_lock, open(os.path.join(self.directory, "archive.lock"), "a") as lock_file:
+            if fcntl:
+                # Another worker may be scraping, and folding the same files, right now
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            archive = _read_state(archive_path) or {"histograms": {}, "counters": {}}
+            folded = []
+            for path in paths:
+                state = _read_state(path)
+                if state is None and not os.path.exists(path):
+                    continue  # already folded by another worker
+                if state is not None:  # an unreadable file is just removed
+                    _merge(archive, state)
+                folded.append(path)
+            if not folded:
+                return
+            tmp = f"{archive_path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp, "w") as f:
+                    json.dump(archive, f, separators=(",", ":"))
+                os.replace(tmp, archive_path)
+            except OSError as e:
+                # Keep the dead workers' files, so nothing is lost; try again next scrape
+                print(f"Could not write metrics archive {archive_path}: {e}")
+                return
+            for path in folded:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        state = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            full = f"{self.namespace}_{name}"
+            lines.append(f"# HELP {full} {help_text}")
+            lines.append(f"# TYPE {full} {kind}")
+            if kind == "histogram":
+                for key, counts in sorted(state["histograms"].get(name, {}).items()):
+                    labels = json.loads(key)
+                    cumulative = 0
+                    for bound, count in zip(list(buckets) + ["+Inf"], counts):
+                        cumulative += count
+                        le = bound if bound == "+Inf" else repr(float(bound))
+                        lines.append(f"{full}_bucket{_format_labels(labels + [['le', le]])} {int(cumulative)}")
+                    lines.append(f"{full}_sum{_format_labels(labels)} {counts[-1]:.6f}")
+                    lines.append(f"{full}_count{_format_labels(labels)} {int(cumulative)}")
+            else:
+                for key, value in sorted(state["counters"].get(name, {}).items()):
+                    lines.append(f"{full}{_format_labels(json.loads(key))} {value:g}")
+        lines.extend(self._render_components(state.get("components", {})))
+        return "\n".join(lines) + "\n"
+
+    def _render_components(self, components: Dict) -> List[str]:
+        lines = []
+        for component, (help_text, gauges) in COMPONENT_STATS.items():
+            series = {}  # stat -> [(labels, value)]
+            for pid, by_component in sorted(components.items()):
+                for key, stats in sorted(by_component.get(component, {}).items()):
+                    labels = json.loads(key) + [["pid", pid]]
+                    for stat, value in stats.items():
+                        if isinstance(value, bool):
+                            value = int(value)
+                        if isinstance(value, (int, float)):
+                            series.setdefault(stat, []).append((labels, value))
+            for stat in sorted(series):
+                kind = "gauge" if stat in gauges else "counter"
+                full = f"{self.namespace}_{component}_{stat}"
+                if kind == "counter" and not full.endswith("_total"):
+                    full += "_total"
+                lines.append(f"# HELP {full} {help_text}: {stat}")
+                lines.append(f"# TYPE {full} {kind}")
+                for labels, value in series[stat]:
+                    lines.append(f"{full}{_format_labels(labels)} {value:g}")
+        return lines
+
+
+def _read_state(path: str) -> Optional[Dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _alive(pid: str) -> bool:
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
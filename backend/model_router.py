@@ -0,0 +1,250 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from llm_client import CircuitOpenError, LLMClient, RequestCancelledError
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    index = min(len(ordered) - 1, max(0, int(round(q / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class ModelStats:
+    """Rolling record of one model's recent calls: the last ``window`` calls within ``max_age`` seconds.
+
+    Old samples age out, so a model that was failing or slow gets another
+    chance once its bad record has expired.
+    """
+
+    def __init__(self, window: int = 100, max_age: float = 300.0):
+        self.max_age = max_age
+        self._samples: Deque[Tuple[float, float, bool]] = deque(maxlen=window)  # (when, seconds, ok)
+
+    def record(self, seconds: float, ok: bool):
+        self._samples.append((time.monotonic(), seconds, ok))
+
+    def latencies(self) -> List[float]:
+        """Sorted latencies of the recent successful calls"""
+        cutoff = time.monotonic() - self.max_age
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        return sorted(seconds for _, seconds, ok in self._samples if ok)
+
+    def snapshot(self) -> Dict:
+        latencies = self.latencies()
+        errors = sum(1 for _, _, ok in self._samples if not ok)
+        count = len(self._samples)
+        return {
+            "calls": count,
+            "errors": errors,
+            "error_rate": errors / count if count else 0.0,
+            "p50": _percentile(latencies, 50) if latencies else None,
+            "p95": _percentile(latencies, 95) if latencies else None,
+        }
+
+
+class ModelRouter:
+    """Sends each completion to the fastest healthy model of a pool, hedging slow ones.
+
+    Every model has its own LLMClient (connection pool, retries, circuit
+    breaker) and a rolling record of latency and errors. Models are ranked
+    by median latency divided by their success rate (the expected time to
+    an answer if failures were simply repeated); a model is unhealthy while
+    its breaker would refuse a call (open, or half-open with its trial
+    call taken) or more than ``max_error_rate`` of its recent calls
+    failed, and is only used when nothing better is left. Models with fewer
+    than ``min_samples`` recent calls come first, in pool order, until they
+    have a record: that is how a new model, or one whose bad record has
+    aged out, gets measured.
+
+    ``complete()`` calls the best model. If it hasn't answered after its
+    own p95 latency (clamped to ``hedge_min_delay``..``hedge_max_delay``,
+    the maximum while it has no record), the same request goes to the next
+    model too, and the first success wins. Waiting for the p95 keeps the
+    extra upstream load around 5% while cutting off the slowest tail. A
+    failure moves on to the next model straight away. The losing attempt
+    is cancelled: it is dropped if still queued and makes no further
+    retries, but an HTTP request already sent runs to its timeout in the
+    background, and its latency still goes into the model's record.
+
+    ``listener(event, model)`` is told about "hedge", "hedge_won" and
+    "failover" events, e.g. to count them in metrics.
+    """
+
+    def __init__(self, clients: List[LLMClient], hedge: bool = True,
+                 hedge_quantile: float = 95.0, hedge_min_delay: float = 0.5, hedge_max_delay: float = 5.0,
+                 window: int = 100, max_age: float = 300.0, min_samples: int = 5, max_error_rate: float = 0.25,
+                 max_workers: int = 16, listener: Optional[Callable[[str, str], None]] = None):
+        if not clients:
+            raise ValueError("ModelRouter needs at least one model")
+        self.clients: Dict[str, LLMClient] = {client.model: client for client in clients}
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.listener = listener
+
+        self._lock = threading.Lock()
+        self._model_stats = {model: ModelStats(window, max_age) for model in self.clients}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-router")
+        self._stats = {"requests": 0, "hedged": 0, "hedge_wins": 0, "failovers": 0, "failures": 0}
+
+    @property
+    def models(self) -> List[str]:
+        return list(self.clients)
+
+    def ranked(self) -> List[str]:
+        """Models in the order they should be tried right now"""
+        with self._lock:
+            snapshots = {model: stats.snapshot() for model, stats in self._model_stats.items()}
+
+        def key(item):
+            position, model = item
+            snap = snapshots[model]
+            measured = snap["calls"] >= self.min_samples
+            # An open breaker, or a half-open one whose single trial call is taken, would refuse the call
+            unhealthy = not self.clients[model].breaker.available or (
+                measured and snap["error_rate"] > self.max_error_rate)
+            if not measured:
+                return unhealthy, 0.0, position
+            if snap["p50"] is None:
+                return True, float("inf"), position
+            return unhealthy, snap["p50"] / (1.0 - snap["error_rate"]), position
+
+        return [model for _, model in sorted(enumerate(self.clients), key=key)]
+
+    def hedge_delay(self, model: str) -> float:
+        """How long to wait for ``model`` before asking the next one as well"""
+        with self._lock:
+            latencies = self._model_stats[model].latencies()
+        if len(latencies) < self.min_samples:
+            return self.hedge_max_delay
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, _percentile(latencies, self.hedge_quantile)))
+
+    def complete(self, messages: List[Dict]) -> Dict:
+        """Run a chat completion on the best model, hedged and failed over as described above"""
+        self._count("requests")
+        order = self.ranked()
+        cancel = threading.Event()
+        pending: Dict[Future, Tuple[str, str]] = {}  # future -> (model, why it was sent)
+
+        def launch(why: str) -> Optional[float]:
+            """Send to the next model in line; returns when to hedge it, if ever"""
+            model = order.pop(0)
+            pending[self._executor.submit(self._attempt, model, messages, cancel)] = (model, why)
+            if why != "primary":
+                self._event(why, model)
+            return time.monotonic() + self.hedge_delay(model) if self.hedge and order else None
+
+        hedge_at = launch("primary")
+        last_error: Optional[BaseException] = None
+        try:
+            while pending:
+                timeout = None if hedge_at is None else max(0.0, hedge_at - time.monotonic())
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    # Still no answer after the model's p95: ask the next one as well
+                    self._count("hedged")
+                    launch("hedge")
+                    hedge_at = None
+                    continue
+
+                for future in done:
+                    model, why = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        last_error = e
+                        continue
+                    if why == "hedge":
+                        self._count("hedge_wins")
+                        self._event("hedge_won", model)
+                    return result
+
+                if not pending and order:
+                    self._count("failovers")
+                    hedge_at = launch("failover")
+        finally:
+            # The winner is in; the others stop retrying and are dropped if still queued
+            cancel.set()
+            for future in pending:
+                future.cancel()
+
+        self._count("failures")
+        raise last_error
+
+    def stream(self, messages: List[Dict]) -> Iterator[str]:
+        """Stream a completion from the best model, failing over until the first delta arrives.
+
+        Tokens reach the client as soon as they are produced, so a stream is
+        never hedged, and a failure after that point is raised to the caller.
+        """
+        self._count("requests")
+        last_error: Optional[BaseException] = None
+        for position, model in enumerate(self.ranked()):
+            if position:
+                self._count("failovers")
+                self._event("failover", model)
+            start = time.perf_counter()
+            started = False
+            try:
+                for delta in self.clients[model].stream(messages):
+                    started = True
+                    yield delta
+            except CircuitOpenError as e:
+                last_error = e
+                continue
+            except Exception as e:
+                self._record(model, time.perf_counter() - start, False)
+                if started:
+                    raise
+                last_error = e
+                continue
+            self._record(model, time.perf_counter() - start, True)
+            return
+
+        self._count("failures")
+        raise last_error
+
+    def _attempt(self, model: str, messages: List[Dict], cancel: threading.Event) -> Dict:
+        if cancel.is_set():
+            raise RequestCancelledError("Completion no longer needed")
+        start = time.perf_counter()
+        try:
+            result = self.clients[model].complete(messages, cancel=cancel)
+        except (CircuitOpenError, RequestCancelledError):
+            # No call was made (or it was abandoned), so there is nothing to learn
+            raise
+        except Exception:
+            self._record(model, time.perf_counter() - start, False)
+            raise
+        self._record(model, time.perf_counter() - start, True)
+        return result
+
+    def _record(self, model: str, seconds: float, ok: bool):
+        with self._lock:
+            self._model_stats[model].record(seconds, ok)
+
+    def _event(self, event: str, model: str):
+        if self.listener is not None:
+            self.listener(event, model)
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            models = {model: model_stats.snapshot() for model, model_stats in self._model_stats.items()}
+        for model, snap in models.items():
+            snap["circuit"] = self.clients[model].breaker.state
+        stats["models"] = models
+        stats["ranking"] = self.ranked()
+        return stats
@@ -0,0 +1,89 @@
+import gzip
+from typing import Dict, Optional
+
+try:
+    import brotli  # optional: pip install brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+# Suffix added to a strong ETag per encoding: each encoding is a different
+# representation, so it needs its own tag
+ETAG_SUFFIXES = {"br": "-br", "gzip": "-gz"}
+
+
+def _accepted(header: str) -> Dict[str, float]:
+    """Accept-Encoding as {coding: q}"""
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def choose_encoding(header: Optional[str]) -> Optional[str]:
+    """Best coding we can produce that the client accepts: brotli, then gzip, else None"""
+    if not header:
+        return None
+    accepted = _accepted(header)
+    wildcard = accepted.get("*", 0.0)
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best, best_q = None, 0.0
+    for coding in candidates:
+        q = accepted.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def strip_etag_suffix(etag: str) -> str:
+    """The ETag a client sent back, without the encoding suffix we added"""
+    quoted = etag.strip()
+    for suffix in ETAG_SUFFIXES.values():
+        if quoted.endswith(suffix + '"'):
+            return quoted[:-len(suffix) - 1] + '"'
+    return quoted
+
+
+def compress_response(response, accept_encoding: Optional[str], min_bytes: int = 1024,
+                      gzip_level: int = 6, brotli_quality: int = 5):
+    """Compress a finished Flask response in place if it's worth it and the client accepts it.
+
+    Streamed responses (server-sent events), anything but a 200 and bodies
+    that are already encoded are left alone. Compressible responses always
+    get ``Vary: Accept-Encoding`` so shared caches key on it.
+    """
+    if response.direct_passthrough or response.is_streamed or "Content-Encoding" in response.headers:
+        return response
+    if not (response.mimetype or "").startswith(COMPRESSIBLE_TYPES) or response.status_code != 200:
+        return response
+    response.vary.add("Accept-Encoding")
+
+    data = response.get_data()
+    if len(data) < min_bytes:
+        return response
+    coding = choose_encoding(accept_encoding)
+    if coding is None:
+        return response
+
+    if coding == "br":
+        body = brotli.compress(data, quality=brotli_quality)
+    else:
+        body = gzip.compress(data, compresslevel=gzip_level, mtime=0)
+    response.set_data(body)
+    response.headers["Content-Encoding"] = coding
+    etag = response.headers.get("ETag")
+    if etag and etag.endswith('"') and not etag.startswith("W/"):
+        response.headers["ETag"] = etag[:-1] + ETAG_SUFFIXES[coding] + '"'
+    return response
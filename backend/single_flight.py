@@ -0,0 +1,96 @@
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class CoalesceTimeoutError(Exception):
+    """Raised to a request that gave up waiting for a shared call"""
+
+
+class CoalesceCancelledError(Exception):
+    """Raised to waiting requests when the call they shared was interrupted"""
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into one.
+
+    The first caller for a key (the leader) runs the function in its own
+    thread; callers arriving while it runs wait for its result instead of
+    making their own call, and get the leader's exception if it fails. Once
+    the call finishes the key is forgotten, so results are never reused
+    afterwards; that is the completion cache's job.
+
+    A waiter gives up after ``wait_timeout`` seconds with
+    CoalesceTimeoutError; leaving does not affect the leader or other
+    waiters. If the leader is interrupted by something other than an
+    Exception (a worker timeout, a closed generator), waiters get
+    CoalesceCancelledError rather than that signal.
+    """
+
+    def __init__(self, wait_timeout: float = 60.0):
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._stats = {"calls": 0, "coalesced": 0, "shared_errors": 0, "timeouts": 0}
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """Return ``(result, shared)``; ``shared`` is True when another request made the call"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats["calls"] += 1
+            else:
+                call.waiters += 1
+
+        if leader:
+            return self._run(key, call, fn), False
+        return self._wait(call, self.wait_timeout if timeout is None else timeout), True
+
+    def _run(self, key: str, call: _Call, fn: Callable[[], Any]):
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _wait(self, call: _Call, timeout: float):
+        finished = call.done.wait(timeout)
+        with self._lock:
+            call.waiters -= 1
+            if not finished:
+                self._stats["timeouts"] += 1
+            elif call.error is not None:
+                self._stats["shared_errors"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not finished:
+            raise CoalesceTimeoutError(f"Gave up after {timeout}s waiting for an identical request to finish")
+        if call.error is not None:
+            if not isinstance(call.error, Exception):
+                raise CoalesceCancelledError("The identical request this one was waiting for was interrupted")
+            raise call.error
+        return call.result
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+            stats["waiting"] = sum(call.waiters for call in self._calls.values())
+        return stats
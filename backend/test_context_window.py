@@ -0,0 +1,61 @@
+import unittest
+
+from context_window import build_context
+
+
+class FakeHistory:
+    """The DatabaseManager methods build_context uses, over an in-memory conversation"""
+
+    def __init__(self, turns):
+        self.turns = turns
+        self.summary = None
+
+    def get_system_message(self, user_id):
+        return {"role": "system", "content": "You are a cooking assistant."}
+
+    def get_conversation_summary(self, user_id):
+        return self.summary
+
+    def get_recent_conversation(self, user_id, limit):
+        return self.turns[-limit:]
+
+    def save_conversation_summary(self, user_id, summary, summarized_through_id):
+        self.summary = {"summary": summary, "summarized_through_id": summarized_through_id}
+
+
+def conversation(count):
+    return [
+        {"id": i, "role": "user" if i % 2 else "assistant", "content": f"turn {i} " + "x" * 200}
+        for i in range(1, count + 1)
+    ]
+
+
+class SummarizedTurnsTest(unittest.TestCase):
+    def test_folded_turns_stay_out_when_the_budget_grows(self):
+        db = FakeHistory(conversation(8))
+        build_context(db, 1, "something with leeks", token_budget=250)
+        summarized_through = db.summary["summarized_through_id"]
+        self.assertGreater(summarized_through, 0)
+
+        messages, stats = build_context(db, 1, "and a dessert", token_budget=10000)
+        sent = [message["content"] for message in messages]
+        for turn in db.turns:
+            if turn["id"] <= summarized_through:
+                self.assertNotIn(turn["content"], sent)
+            else:
+                self.assertIn(turn["content"], sent)
+        # Nothing new was pushed out, so the summary is unchanged and counted once
+        self.assertEqual(db.summary["summarized_through_id"], summarized_through)
+        self.assertEqual(stats["turns_included"], len(db.turns) - summarized_through)
+        self.assertEqual(stats["total_tokens"] - stats["summary_tokens"] - stats["system_tokens"]
+                         - stats["message_tokens"], stats["history_tokens"])
+
+    def test_without_summary_every_turn_that_fits_is_sent(self):
+        db = FakeHistory(conversation(4))
+        messages, stats = build_context(db, 1, "soup", token_budget=10000, summarize=False)
+        self.assertEqual(stats["turns_included"], 4)
+        self.assertEqual(len(messages), 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.models import DatabaseManager  # noqa: E402
+from job_queue import RecipeJobQueue  # noqa: E402
+
+
+class JobQueueRunOnceTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db = DatabaseManager(os.path.join(self.dir.name, "test.db"))
+        self.user_id = self.db.create_or_update_user("g1", "cook@example.com", "Cook")["id"]
+        self.runs = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        self.db.close()
+        self.dir.cleanup()
+
+    def run_job(self, job):
+        with self.lock:
+            self.runs.append(job["job_id"])
+        return "done", {"response": "<h3>Soup</h3>"}, [("user", job["message"]), ("assistant", "<h3>Soup</h3>")]
+
+    def test_job_queued_twice_runs_once(self):
+        # e.g. taken over by another worker's sweep while still queued here. One
+        # worker takes jobs in order, so once the job after the copy is done, so is the copy
+        queue = RecipeJobQueue(self.db, self.run_job, workers=1, sweep_interval=3600)
+        job, _ = queue.submit(self.user_id, "leek soup")
+        queue._queue.put(job["job_id"])
+        later, _ = queue.submit(self.user_id, "curry")
+        self.assertEqual(queue.wait(self.user_id, later["job_id"], timeout=5)["status"], "done")
+
+        self.assertEqual(self.runs, [job["job_id"], later["job_id"]])
+        self.assertEqual(queue.wait(self.user_id, job["job_id"])["status"], "done")
+        self.assertEqual(len(self.db.get_recent_conversation(self.user_id, 10)), 4)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import threading
+import time
+import unittest
+
+import requests
+
+from llm_client import CircuitBreaker, LLMClient, RequestCancelledError
+from model_router import ModelRouter
+
+
+class FailingSession:
+    """Stands in for requests.Session: every post raises ``error``"""
+
+    def __init__(self, error):
+        self.error = error
+        self.posts = 0
+
+    def post(self, *args, **kwargs):
+        self.posts += 1
+        raise self.error
+
+
+class TrackedResponse(requests.Response):
+    """A response with ``status`` that records whether it was closed"""
+
+    def __init__(self, status):
+        super().__init__()
+        self.status_code = status
+        self.url = "http://upstream.invalid"
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class RejectingSession:
+    """Stands in for requests.Session: every post is answered with ``status``"""
+
+    def __init__(self, status):
+        self.status = status
+        self.responses = []
+
+    def post(self, *args, **kwargs):
+        self.responses.append(TrackedResponse(self.status))
+        return self.responses[-1]
+
+
+def half_open_client(model="m", error=None):
+    """A client whose breaker has opened once and is now half-open"""
+    client = LLMClient("http://upstream.invalid", "key", model, max_retries=1, backoff_base=5.0,
+                       breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.01))
+    client.session = FailingSession(error or requests.ConnectionError("refused"))
+    client.breaker.record_failure()
+    time.sleep(0.02)
+    assert client.breaker.state == "half-open"
+    return client
+
+
+class HalfOpenTrialTest(unittest.TestCase):
+    def test_cancelled_trial_is_released(self):
+        client = half_open_client()
+        cancel = threading.Event()
+        threading.Timer(0.05, cancel.set).start()  # cancelled while backing off before its retry
+        with self.assertRaises(RequestCancelledError):
+            client.complete([{"role": "user", "content": "soup"}], cancel=cancel)
+        self.assertEqual(client.breaker.state, "half-open")
+        self.assertTrue(client.breaker.available)
+        self.assertTrue(client.breaker.allow())
+
+    def test_unexpected_error_releases_trial(self):
+        client = half_open_client(error=ValueError("bad payload"))
+        with self.assertRaises(ValueError):
+            client.complete([{"role": "user", "content": "soup"}])
+        self.assertTrue(client.breaker.allow())
+
+    def test_trial_is_not_released_by_another_thread(self):
+        breaker = half_open_client().breaker
+        self.assertTrue(breaker.allow())
+        releaser = threading.Thread(target=breaker.release_trial)
+        releaser.start()
+        releaser.join()
+        self.assertFalse(breaker.allow())
+
+    def test_router_ranks_taken_trial_last(self):
+        busy, idle = half_open_client("busy"), half_open_client("idle")
+        router = ModelRouter([busy, idle], hedge=False)
+        self.assertTrue(busy.breaker.allow())  # trial in flight elsewhere
+        self.assertEqual(router.ranked(), ["idle", "busy"])
+
+
+
+class RejectedRequestTest(unittest.TestCase):
+    def test_streamed_4xx_closes_response(self):
+        client = LLMClient("http://upstream.invalid", "key", "m", max_retries=2)
+        client.session = RejectingSession(400)
+        with self.assertRaises(requests.HTTPError):
+            list(client.stream([{"role": "user", "content": "soup"}]))
+        self.assertEqual(len(client.session.responses), 1)  # not retried
+        self.assertTrue(client.session.responses[0].closed)
+        self.assertEqual(client.breaker.state, "closed")
+
+
+if __name__ == "__main__":
+    unittest.main()
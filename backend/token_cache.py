@@ -0,0 +1,66 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class TokenCache:
+    """Bounded LRU of JWTs that already passed signature verification.
+
+    Keys are SHA-256 digests of the raw token, so the cache never holds a
+    usable credential. Only tokens with an ``exp`` claim are stored, and an
+    entry is served strictly while ``time.time() < exp``, the same rule
+    PyJWT applies without leeway, so a cached token expires at exactly the
+    moment ``jwt.decode`` would start rejecting it. Rejected tokens are
+    never cached.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()  # digest -> (payload, exp)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, token: str) -> Optional[Dict]:
+        """Payload of a previously verified, still unexpired token"""
+        digest = self._digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            payload, exp = entry
+            if time.time() >= exp:
+                del self._entries[digest]
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(digest)
+            self._stats["hits"] += 1
+        # Callers get their own copy to annotate
+        return dict(payload)
+
+    def put(self, token: str, payload: Dict):
+        exp = payload.get("exp")
+        if not isinstance(exp, (int, float)) or self.max_entries <= 0:
+            return
+        digest = self._digest(token)
+        with self._lock:
+            self._entries[digest] = (dict(payload), exp)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
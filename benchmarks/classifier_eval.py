@@ -0,0 +1,149 @@
+"""Precision and recall of the local prompt classifier against the model's own answers.
+
+Each line of ``--cases`` (default classifier_cases.jsonl) is a chat message
+and what /suggest_recipe does with it today, when only the model decides:
+
+    recipe       the model writes a recipe (or adjusts the previous one)
+    off_topic    it answers "I can only help with cooking."
+    non_english  it answers "I only understand English."
+
+A case with ``"follow_up": true`` is sent after an earlier exchange, as a
+message from a user with history is classified in the app.
+
+For both refusal classes the report gives precision (local rejections the
+model would also have made), recall (model refusals caught locally) and
+the share of cooking requests wrongly rejected, which must stay at zero,
+plus classify() latency. With ``--live`` the expected labels are refreshed
+by sending every message to the configured OpenRouter model first
+(OPENROUTER_API_KEY, OPENROUTER_MODEL):
+
+    python benchmarks/classifier_eval.py --output classifier.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+from harness import BACKEND_DIR, percentile, run_metadata, write_report
+
+sys.path.insert(0, BACKEND_DIR)
+
+from classifier import NON_ENGLISH_REPLY, OFF_TOPIC_REPLY, PromptClassifier  # noqa: E402
+
+from database.models import CHEF_SYSTEM_PROMPT  # noqa: E402
+
+# The exchange a follow_up case comes after
+EARLIER_TURNS = [
+    {"role": "user", "content": "chickpea curry"},
+    {"role": "assistant", "content": "<h3>Chickpea Curry</h3><h4>Ingredients</h4><ul><li>1 can chickpeas</li>"
+                                     "<li>1 can coconut milk</li></ul><h4>Instructions</h4><ol><li>Simmer.</li></ol>"},
+]
+
+CASES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "classifier_cases.jsonl")
+REJECTIONS = ("off_topic", "non_english")
+
+
+def load_cases(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def model_label(reply):
+    """What the model's reply amounts to, by the same exact phrases the prompt asks for"""
+    text = reply.strip()
+    if text.startswith(NON_ENGLISH_REPLY.rstrip(".")):
+        return "non_english"
+    if text.startswith(OFF_TOPIC_REPLY.rstrip(".")):
+        return "off_topic"
+    return "recipe"
+
+
+def relabel_live(cases):
+    from llm_client import LLMClient
+
+    client = LLMClient(
+        os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions"),
+        os.environ["OPENROUTER_API_KEY"],
+        os.getenv("OPENROUTER_MODEL", "mistralai/mistral-7b-instruct"),
+    )
+    changed = 0
+    for case in cases:
+        earlier = EARLIER_TURNS if case.get("follow_up") else []
+        jr = client.complete([{"role": "system", "content": CHEF_SYSTEM_PROMPT}] + earlier + [
+            {"role": "user", "content": case["message"]},
+        ])
+        label = model_label(jr.get("choices", [])[0].get("message", {}).get("content", ""))
+        if label != case["expected"]:
+            changed += 1
+            case["file_label"] = case["expected"]
+            case["expected"] = label
+    return changed
+
+
+def evaluate(classifier, cases, repeat):
+    confusion = Counter()
+    mistakes = []
+    timings = []
+    for case in cases:
+        follow_up = case.get("follow_up", False)
+        verdict = classifier.classify(case["message"], follow_up)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            classifier.classify(case["message"], follow_up)
+            timings.append(time.perf_counter() - start)
+        # "cooking" and "unknown" both go to the model, so neither is a decision here
+        predicted = verdict.label if verdict.reply else "model"
+        confusion[(case["expected"], predicted)] += 1
+        if predicted != "model" and predicted != case["expected"]:
+            mistakes.append({"message": case["message"], "expected": case["expected"],
+                             "predicted": predicted, "matches": list(verdict.matches)})
+
+    expected = Counter(case["expected"] for case in cases)
+    classes = {}
+    for label in REJECTIONS:
+        predicted = sum(count for (_, p), count in confusion.items() if p == label)
+        correct = confusion[(label, label)]
+        classes[label] = {
+            "expected": expected[label],
+            "rejected_locally": predicted,
+            "precision": round(correct / predicted, 4) if predicted else None,
+            "recall": round(correct / expected[label], 4) if expected[label] else None,
+        }
+    wrongly_rejected = sum(confusion[("recipe", label)] for label in REJECTIONS)
+    local = sum(count for (_, p), count in confusion.items() if p != "model")
+    return {
+        "cases": len(cases),
+        "classes": classes,
+        "false_rejection_rate": round(wrongly_rejected / expected["recipe"], 4) if expected["recipe"] else None,
+        "answered_locally": round(local / len(cases), 4),
+        "classify_us": {
+            "mean": round(sum(timings) / len(timings) * 1e6, 2),
+            "p50": round(percentile(timings, 50) * 1e6, 2),
+            "p99": round(percentile(timings, 99) * 1e6, 2),
+        },
+        "confusion": {f"{e}->{p}": count for (e, p), count in sorted(confusion.items())},
+        "mistakes": mistakes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", default=CASES_PATH)
+    parser.add_argument("--repeat", type=int, default=200, help="timed classify() calls per case")
+    parser.add_argument("--live", action="store_true", help="take the expected labels from the real model")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    cases = load_cases(args.cases)
+    relabelled = relabel_live(cases) if args.live else None
+    results = evaluate(PromptClassifier(), cases, args.repeat)
+    if relabelled is not None:
+        results["labels_changed_by_model"] = relabelled
+    write_report({"benchmark": "classifier_eval", "meta": run_metadata(), "config": vars(args), "results": results},
+                 args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Compare two saved benchmark reports (any of the --output JSON files).
+
+Prints every latency/throughput figure present in both reports with its
+relative change, and exits non-zero when a latency grew (or a throughput
+fell) by more than ``--threshold`` percent:
+
+    python benchmarks/compare.py before.json after.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+
+def flatten(node, prefix=""):
+    """{"a": {"p50_ms": 1}} -> {"a.p50_ms": 1} for numeric leaves"""
+    items = {}
+    if isinstance(node, dict):
+        for key, value in node.items():
+            items.update(flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        items[prefix] = node
+    return items
+
+
+def is_metric(key):
+    leaf = key.rsplit(".", 1)[-1]
+    return leaf.endswith("_ms") or leaf.endswith("rps")
+
+
+def compare(before, after, threshold):
+    old, new = flatten(before["results"]), flatten(after["results"])
+    rows, regressions = [], []
+    for key in sorted(old.keys() & new.keys()):
+        if not is_metric(key) or not old[key]:
+            continue
+        change = (new[key] - old[key]) / old[key] * 100
+        # Lower is better for latencies, higher for throughput
+        worse = -change if key.endswith("rps") else change
+        rows.append((key, old[key], new[key], change))
+        if worse > threshold:
+            regressions.append(key)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent change counted as a regression")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before.get("benchmark") != after.get("benchmark"):
+        sys.exit(f"Reports come from different benchmarks: {before.get('benchmark')} vs {after.get('benchmark')}")
+
+    rows, regressions = compare(before, after, args.threshold)
+    width = max((len(key) for key, *_ in rows), default=10)
+    for key, old, new, change in rows:
+        flag = "  <-- regression" if key in regressions else ""
+        print(f"{key:<{width}}  {old:>12.3f}  {new:>12.3f}  {change:+8.1f}%{flag}")
+    print(f"\n{len(regressions)} regression(s) over {args.threshold}%"
+          f" ({before.get('meta', {}).get('commit')} -> {after.get('meta', {}).get('commit')})")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Compressed body storage: compression ratio and its cost on writes and reads.
+
+Generates ``--bodies`` varied recipe replies (the HTML the system prompt asks
+for) and short chat messages, then:
+
+    ratio     stored size with plain zlib and with the preset recipe dictionary
+              that database/compression.py uses, and compress/decompress time
+    database  for each ``--thresholds`` entry (0 = compression off), a fresh
+              database gets the same favorites and exchanges through
+              DatabaseManager; reports write and read latency per method and
+              the database file size
+
+Prints one JSON document (``--output`` also writes it to a file; see
+compare.py):
+
+    python benchmarks/compression.py --thresholds 0 512
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+import zlib
+
+from harness import DatabaseManager, percentile, run_metadata, write_report
+
+from database.compression import compress_body, decompress_body
+
+DISHES = ["Chickpea Curry", "Mushroom Risotto", "Lentil Soup", "Pad Thai", "Shakshuka",
+          "Banana Bread", "Fish Tacos", "Minestrone", "Falafel", "Ratatouille", "Paella",
+          "Beef Stew", "Vegetable Lasagna", "Chicken Tikka Masala", "Miso Ramen"]
+INGREDIENTS = ["olive oil", "garlic cloves", "onion", "tomatoes", "salt", "black pepper", "butter",
+               "flour", "eggs", "milk", "rice", "chickpeas", "coconut milk", "lemon juice", "parsley",
+               "carrots", "celery", "mushrooms", "parmesan cheese", "chicken thighs", "cumin",
+               "smoked paprika", "spinach", "ginger", "soy sauce", "vegetable stock", "red lentils"]
+AMOUNTS = ["1 tablespoon", "2 tablespoons", "1 teaspoon", "1/2 teaspoon", "1 cup", "2 cups",
+           "200 grams", "400 grams", "1 can of", "3", "2 large", "1 medium"]
+STEPS = ["Heat the olive oil in a large skillet over medium heat.",
+         "Add the garlic and cook until fragrant, about 1 minute.",
+         "Stir in the onion and cook until softened, about 5 minutes.",
+         "Add the {a} and {b} and stir to combine.",
+         "Pour in the {a} and bring to a boil.",
+         "Reduce the heat and simmer for {n} minutes, stirring occasionally.",
+         "Season with salt and pepper to taste.",
+         "Preheat the oven to 180°C (350°F).",
+         "Bake for {n} minutes until golden brown.",
+         "Fold in the {a} and let it rest for 5 minutes.",
+         "Garnish with fresh parsley and serve immediately."]
+ASKS = ["something with {a} and {b}", "a quick dinner using {a}", "vegetarian please, I have {a}",
+        "can you make it spicier?", "what can I cook with {a}, {b} and rice?", "{d} but without {a}"]
+
+
+def recipe(rng):
+    picked = rng.sample(INGREDIENTS, rng.randint(5, 10))
+    items = "".join(f"<li>{rng.choice(AMOUNTS)} {name}</li>" for name in picked)
+    steps = "".join(
+        "<li>" + rng.choice(STEPS).format(a=rng.choice(picked), b=rng.choice(picked), n=rng.randint(5, 45)) + "</li>"
+        for _ in range(rng.randint(4, 9))
+    )
+    return (
+        f"<h3>{rng.choice(DISHES)}</h3><p>Serves {rng.randint(2, 6)}</p>"
+        f"<h4>Ingredients</h4><ul>{items}</ul>"
+        f"<h4>Preparation Time</h4><p>{rng.choice([5, 10, 15, 20])} minutes</p>"
+        f"<h4>Cooking Time</h4><p>{rng.choice([10, 20, 30, 45, 60])} minutes</p>"
+        f"<h4>Instructions</h4><ol>{steps}</ol><br><br>"
+        f"<p>Serve warm with {rng.choice(['rice', 'bread', 'a green salad', 'pasta'])}. Enjoy your meal!</p>"
+    )
+
+
+def ask(rng):
+    return rng.choice(ASKS).format(a=rng.choice(INGREDIENTS), b=rng.choice(INGREDIENTS),
+                                   d=rng.choice(DISHES).lower())
+
+
+def summary(timings):
+    return {
+        "calls": len(timings),
+        "mean_ms": round(sum(timings) / len(timings) * 1000, 4),
+        "p50_ms": round(percentile(timings, 50) * 1000, 4),
+        "p95_ms": round(percentile(timings, 95) * 1000, 4),
+        "p99_ms": round(percentile(timings, 99) * 1000, 4),
+    }
+
+
+def bench_ratio(bodies, threshold):
+    raw = [body.encode("utf-8") for body in bodies]
+    plain = sum(len(zlib.compress(data, 6)) for data in raw)
+    packed, compress_times, decompress_times = [], [], []
+    for body in bodies:
+        start = time.perf_counter()
+        value = compress_body(body, threshold)
+        compress_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        decompress_body(value)
+        decompress_times.append(time.perf_counter() - start)
+        packed.append(value)
+    stored = sum(len(value) if isinstance(value, bytes) else len(value.encode("utf-8")) for value in packed)
+    total = sum(len(data) for data in raw)
+    return {
+        "bodies": len(bodies),
+        "mean_body_bytes": round(total / len(bodies)),
+        "compressed_share": round(sum(isinstance(value, bytes) for value in packed) / len(bodies), 3),
+        "ratio_zlib": round(total / plain, 2),
+        "ratio_stored": round(total / stored, 2),
+        "compress_us": round(sum(compress_times) / len(bodies) * 1e6, 2),
+        "decompress_us": round(sum(decompress_times) / len(bodies) * 1e6, 2),
+    }
+
+
+def bench_database(threshold, recipes, asks, iterations, seed_value=7):
+    with tempfile.TemporaryDirectory(prefix="recipe-compression-") as tmp:
+        path = os.path.join(tmp, "bench.db")
+        with contextlib.redirect_stdout(io.StringIO()):  # keep migration output out of the JSON
+            db = DatabaseManager(path, compress_threshold=threshold)
+            user_ids = [
+                db.create_or_update_user(f"g{i}", f"user{i}@example.com", f"User {i}", "")["id"]
+                for i in range(max(1, len(recipes) // 50))
+            ]
+
+        timings = {"add_favorite_recipe": [], "add_conversation_messages": []}
+        favorites = []
+        for i, (body, message) in enumerate(zip(recipes, asks)):
+            uid = user_ids[i % len(user_ids)]
+            start = time.perf_counter()
+            favorites.append((uid, db.add_favorite_recipe(uid, f"Recipe {i}", body)["id"]))
+            timings["add_favorite_recipe"].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            db.add_conversation_messages(uid, [("user", message), ("assistant", body)], wait=True)
+            timings["add_conversation_messages"].append(time.perf_counter() - start)
+
+        rng = random.Random(seed_value)
+        reads = {
+            "get_favorite_recipe": lambda: db.get_favorite_recipe(*rng.choice(favorites)),
+            "get_user_favorites_page": lambda: db.get_user_favorites_page(rng.choice(user_ids), limit=20),
+            "get_recent_conversation": lambda: db.get_recent_conversation(rng.choice(user_ids), 20),
+            "search": lambda: db.search(rng.choice(user_ids), rng.choice(INGREDIENTS)),
+        }
+        for name, call in reads.items():
+            timings[name] = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                call()
+                timings[name].append(time.perf_counter() - start)
+
+        with db.connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            content_bytes = {
+                table: conn.execute(f"SELECT COALESCE(SUM(length(CAST(content AS BLOB))), 0) FROM {table}").fetchone()[0]
+                for table in ("favorite_recipes", "conversation_history")
+            }
+        db_size = os.path.getsize(path)
+        db.close()
+    return {
+        "threshold": threshold,
+        "db_bytes": db_size,
+        "content_bytes": content_bytes,
+        "methods": {name: summary(values) for name, values in timings.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bodies", type=int, default=2000, help="recipes (and chat exchanges) generated")
+    parser.add_argument("--thresholds", type=int, nargs="+", default=[0, 512],
+                        help="compression thresholds to compare (0 = off)")
+    parser.add_argument("--iterations", type=int, default=500, help="calls per read method")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    recipes = [recipe(rng) for _ in range(args.bodies)]
+    asks = [ask(rng) for _ in range(args.bodies)]
+    threshold = max(args.thresholds) or 512
+    results = {
+        "ratio": {"recipes": bench_ratio(recipes, threshold), "messages": bench_ratio(asks, threshold)},
+        "database": {str(t): bench_database(t, recipes, asks, args.iterations) for t in args.thresholds},
+    }
+    write_report({"benchmark": "compression", "meta": run_metadata(), "config": vars(args), "results": results},
+                 args.output)
+
+
+if __name__ == "__main__":
+    main()
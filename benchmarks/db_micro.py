@@ -0,0 +1,192 @@
+"""Microbenchmarks for DatabaseManager methods at several table sizes.
+
+For each ``--sizes`` entry N a fresh database is seeded with N favorite
+recipes and N conversation messages (spread over N / ``--rows-per-user``
+users) using bulk SQL, so the FTS triggers and indexes are populated
+exactly as in production. Every method is then called ``--iterations``
+times against random users. Prints one JSON document with mean and
+p50/p95/p99 per method and size (``--output`` also writes it to a file;
+see compare.py):
+
+    python benchmarks/db_micro.py --sizes 1000 100000 1000000
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+from harness import DatabaseManager, percentile, run_metadata, write_report
+from stubs import STUB_RECIPE
+
+from database.models import content_digest
+
+DISHES = ["chickpea curry", "mushroom risotto", "lentil soup", "pad thai", "shakshuka",
+          "banana bread", "fish tacos", "minestrone", "falafel", "ratatouille"]
+
+
+def seed(db, rows, rows_per_user, batch=10000):
+    """Bulk-insert users, favorites and history; returns the list of user ids"""
+    users = max(1, rows // rows_per_user)
+    with db.connection() as conn:
+        conn.executemany(
+            "INSERT INTO users (google_id, email, name, password_hash, terms_accepted) VALUES (?, ?, ?, ?, TRUE)",
+            ((f"micro-{u}", f"micro{u}@example.com", f"Micro {u}", "x") for u in range(users)),
+        )
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users ORDER BY id")]
+        conn.executemany(
+            "INSERT INTO conversation_history (user_id, role, content, prompt_version) VALUES (?, 'system', '', ?)",
+            ((uid, db.current_prompt_version) for uid in user_ids),
+        )
+        conn.commit()
+
+        for start in range(0, rows, batch):
+            favorites, history = [], []
+            for i in range(start, min(start + batch, rows)):
+                uid = user_ids[i % users]
+                dish = DISHES[i % len(DISHES)]
+                content = f"{STUB_RECIPE}<p>{dish} variation {i}</p>"
+                favorites.append((uid, f"{dish.title()} #{i}", content, content_digest(content), rows - i))
+                history.append((uid, "user" if i % 2 == 0 else "assistant",
+                                f"{dish} please" if i % 2 == 0 else content))
+            conn.executemany("""
+                INSERT INTO favorite_recipes (user_id, title, content, content_digest, date_added)
+                VALUES (?, ?, ?, ?, datetime('now', '-' || ? || ' seconds'))
+            """, favorites)
+            conn.executemany(
+                "INSERT INTO conversation_history (user_id, role, content) VALUES (?, ?, ?)", history
+            )
+            conn.commit()
+        db.backfill_recipe_fields()  # ingredient index and times, as add_favorite_recipe would have written
+        conn.execute("ANALYZE")
+    return user_ids
+
+
+def method_calls(db, user_ids, rng):
+    """name -> callable(i) making one call; state shared between calls lives in closures"""
+    added = {}
+    state = {"cleared": 0}
+
+    def user(i):
+        return rng.choice(user_ids)
+
+    def favorite_id(uid):
+        with db.connection() as conn:
+            row = conn.execute(
+                "SELECT id FROM favorite_recipes WHERE user_id = ? LIMIT 1", (uid,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def get_user_uncached(i):
+        db.user_cache.invalidate(f"micro-{i % len(user_ids)}")
+        return db.get_user_by_google_id(f"micro-{i % len(user_ids)}")
+
+    def add_favorite(i):
+        uid = user(i)
+        added[i] = (uid, db.add_favorite_recipe(uid, f"Micro add {i}", f"{STUB_RECIPE}<p>added {i}</p>")["id"])
+
+    def remove_favorite(i):
+        uid, recipe_id = added.pop(i, (user(i), 0))
+        db.remove_favorite_recipe(uid, recipe_id)
+
+    def clear_history(i):
+        # A different user each call, so every call deletes real rows
+        uid = user_ids[-1 - state["cleared"] % len(user_ids)]
+        state["cleared"] += 1
+        db.clear_conversation_history(uid)
+
+    completion = {"choices": [{"message": {"role": "assistant", "content": STUB_RECIPE}}]}
+    favorite_ids = {}
+
+    def get_favorite(i):
+        uid = user(i)
+        if uid not in favorite_ids:
+            favorite_ids[uid] = favorite_id(uid)
+        db.get_favorite_recipe(uid, favorite_ids[uid])
+
+    return {
+        "get_user_by_google_id": lambda i: db.get_user_by_google_id(f"micro-{i % len(user_ids)}"),
+        "get_user_by_google_id_uncached": get_user_uncached,
+        "create_or_update_user": lambda i: db.create_or_update_user(
+            f"micro-{i % len(user_ids)}", f"micro{i % len(user_ids)}@example.com", f"Micro {i}"),
+        "accept_terms": lambda i: db.accept_terms(user(i)),
+        "add_favorite_recipe": add_favorite,
+        "get_user_favorites": lambda i: db.get_user_favorites(user(i)),
+        "get_user_favorites_page": lambda i: db.get_user_favorites_page(user(i), limit=20),
+        "get_user_favorites_page_summary": lambda i: db.get_user_favorites_page(user(i), limit=20, summary_only=True),
+        "get_favorite_recipe": get_favorite,
+        "remove_favorite_recipe": remove_favorite,
+        "add_conversation_message": lambda i: db.add_conversation_message(user(i), "user", f"micro {i}"),
+        "add_conversation_messages": lambda i: db.add_conversation_messages(
+            user(i), [("user", f"micro {i}"), ("assistant", STUB_RECIPE)]),
+        "get_conversation_history": lambda i: db.get_conversation_history(user(i)),
+        "get_recent_conversation": lambda i: db.get_recent_conversation(user(i), 40),
+        "get_system_message": lambda i: db.get_system_message(user(i)),
+        "save_conversation_summary": lambda i: db.save_conversation_summary(user(i), f"summary {i}", i),
+        "get_conversation_summary": lambda i: db.get_conversation_summary(user(i)),
+        "put_cached_completion": lambda i: db.put_cached_completion(
+            f"micro:{i}", "stub", completion, time.time() + 3600),
+        "get_cached_completion": lambda i: db.get_cached_completion(f"micro:{i}"),
+        "search": lambda i: db.search(user(i), rng.choice(DISHES).split()[0]),
+        "query_favorites": lambda i: db.query_favorites(user(i), have=["chickpeas", "onion", "coconut milk"]),
+        "query_favorites_max_minutes": lambda i: db.query_favorites(user(i), max_minutes=30),
+        "clear_conversation_history": clear_history,
+    }
+
+
+def bench_size(rows, rows_per_user, iterations, methods, seed_value=7):
+    with tempfile.TemporaryDirectory(prefix="recipe-micro-") as tmp:
+        with contextlib.redirect_stdout(io.StringIO()):  # keep migration output out of the JSON
+            db = DatabaseManager(os.path.join(tmp, "micro.db"))
+        started = time.perf_counter()
+        user_ids = seed(db, rows, rows_per_user)
+        seed_time = time.perf_counter() - started
+
+        rng = random.Random(seed_value)
+        calls = method_calls(db, user_ids, rng)
+        results = {}
+        for name, call in calls.items():
+            if methods and name not in methods:
+                continue
+            timings = []
+            for i in range(iterations):
+                start = time.perf_counter()
+                call(i)
+                timings.append(time.perf_counter() - start)
+            results[name] = {
+                "calls": iterations,
+                "mean_ms": round(sum(timings) / len(timings) * 1000, 4),
+                "p50_ms": round(percentile(timings, 50) * 1000, 4),
+                "p95_ms": round(percentile(timings, 95) * 1000, 4),
+                "p99_ms": round(percentile(timings, 99) * 1000, 4),
+            }
+        db_size = os.path.getsize(os.path.join(tmp, "micro.db"))
+        db.close()
+    return {
+        "users": len(user_ids),
+        "seed_seconds": round(seed_time, 2),
+        "db_bytes": db_size,
+        "methods": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000],
+                        help="rows per table (favorites and history each)")
+    parser.add_argument("--rows-per-user", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--methods", nargs="*", help="only these methods (default: all)")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    results = {str(rows): bench_size(rows, args.rows_per_user, args.iterations, args.methods)
+               for rows in args.sizes}
+    write_report({"benchmark": "db_micro", "meta": run_metadata(), "config": vars(args), "results": results},
+                 args.output)
+
+
+if __name__ == "__main__":
+    main()
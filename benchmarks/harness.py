@@ -0,0 +1,163 @@
+"""Helpers for running backend/app.py under gunicorn against a throwaway database."""
+import json
+import os
+import platform
+import re
+import secrets
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import jwt
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT, "backend")
+sys.path.insert(0, ROOT)
+
+from database.models import DatabaseManager  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def latency_summary(latencies, elapsed):
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p95_ms": _ms(percentile(latencies, 95)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+_DB_TIMING_RE = re.compile(r"\bdb;dur=([\d.]+)")
+
+
+def server_db_time(response):
+    """Database seconds reported in a response's Server-Timing header (SERVER_TIMING=true)"""
+    match = _DB_TIMING_RE.search(response.headers.get("Server-Timing", ""))
+    return float(match.group(1)) / 1000 if match else None
+
+
+def run_metadata():
+    """Where and on what a benchmark ran, so saved reports can be compared"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def write_report(report, output=None):
+    """Print a benchmark report as JSON and optionally save it to ``output``"""
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+
+
+class Backend:
+    """gunicorn running backend/app.py with its own temporary database.
+
+    Extra environment (stub URLs, worker class, limits) is passed through
+    ``env``. ``create_user`` seeds a user straight into the database and
+    returns a JWT the backend accepts.
+    """
+
+    def __init__(self, env=None, workers=2):
+        self.tmpdir = tempfile.TemporaryDirectory(prefix="recipe-bench-")
+        self.db_path = os.path.join(self.tmpdir.name, "recipe_app.db")
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.jwt_secret = secrets.token_hex(16)
+        self.env = dict(os.environ)
+        self.env.update({
+            "DATABASE_PATH": self.db_path,
+            "JWT_SECRET_KEY": self.jwt_secret,
+            "OPENROUTER_API_KEY": "stub",
+            "WEB_CONCURRENCY": str(workers),
+        })
+        self.env.update(env or {})
+        self.process = None
+        self.db = None
+
+    def start(self, timeout: float = 20.0):
+        # Create the schema before the workers race to do it
+        self.db = DatabaseManager(self.db_path)
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "app:app",
+             "--bind", f"127.0.0.1:{self.port}", "--config", "gunicorn.conf.py",
+             "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=self.env,
+            stdout=subprocess.DEVNULL,
+        )
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                if requests.get(self.url + "/ping", timeout=1).status_code == 200:
+                    return self
+            except requests.RequestException:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError("Backend did not come up in time")
+
+    def create_user(self, n: int = 0) -> str:
+        user = self.db.create_or_update_user(f"bench-google-{n}", f"bench{n}@example.com", f"Bench {n}")
+        self.db.accept_terms(user["id"])
+        return jwt.encode({
+            "user_id": user["id"],
+            "google_id": user["google_id"],
+            "email": user["email"],
+            "exp": datetime.utcnow() + timedelta(days=1),
+        }, self.jwt_secret, algorithm="HS256")
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+        if self.db:
+            self.db.close()
+            self.db = None
+        self.tmpdir.cleanup()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,189 @@
+"""JWT-authenticated load profile over the main endpoints, against stub LLM and Google servers.
+
+Starts the stubs and the backend under gunicorn with a temporary database,
+seeds ``--users`` users with favorites and chat history, then runs
+``--clients`` client threads for ``--duration`` seconds. Each request picks
+an endpoint from the weighted ``--profile``, e.g.
+
+    python benchmarks/load_profile.py --profile me=5,favorites_page=3,suggest=1
+
+Reports throughput, p50/p95/p99 latency and server-side database time (from
+the backend's Server-Timing header) per endpoint as one JSON document
+(``--output`` also writes it to a file; see compare.py).
+"""
+import argparse
+import itertools
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+
+import requests
+
+from harness import Backend, latency_summary, percentile, run_metadata, server_db_time, write_report
+from stubs import GoogleStub, STUB_RECIPE, llm_stub
+
+DEFAULT_PROFILE = "me=20,favorites_page=20,favorite_get=10,favorite_add=5,search=10,suggest=10,login=5"
+
+DISHES = ["chickpea curry", "mushroom risotto", "lentil soup", "pad thai", "shakshuka",
+          "banana bread", "fish tacos", "minestrone", "falafel", "ratatouille"]
+
+
+class Workload:
+    """Seeded users plus the request each endpoint name stands for"""
+
+    def __init__(self, backend, google, users, favorites_per_user, history_per_user):
+        self.backend = backend
+        self.google = google
+        self.counter = itertools.count()
+        self.users = []
+        for n in range(users):
+            token = backend.create_user(n)
+            user = backend.db.get_user_by_google_id(f"bench-google-{n}")
+            favorite_ids = [
+                backend.db.add_favorite_recipe(
+                    user["id"], f"{DISHES[i % len(DISHES)].title()} #{i}", f"{STUB_RECIPE}<p>Variation {i}</p>"
+                )["id"]
+                for i in range(favorites_per_user)
+            ]
+            backend.db.add_conversation_messages(user["id"], [
+                (role, f"{DISHES[i % len(DISHES)]} please" if role == "user" else STUB_RECIPE)
+                for i in range(history_per_user // 2) for role in ("user", "assistant")
+            ], wait=True)
+            self.users.append({
+                "token": token,
+                "favorite_ids": favorite_ids,
+                "id_token": google.id_token(f"bench-google-{n}", f"bench{n}@example.com", f"Bench {n}"),
+            })
+
+    def request(self, name, session, user, rng):
+        url = self.backend.url
+        if name == "me":
+            return session.get(url + "/me")
+        if name == "favorites_page":
+            return session.get(url + "/favorites", params={"limit": 20, "fields": "summary"})
+        if name == "favorites_all":
+            return session.get(url + "/favorites")
+        if name == "favorite_get":
+            return session.get(url + f"/favorites/{rng.choice(user['favorite_ids'])}")
+        if name == "favorite_add":
+            n = next(self.counter)
+            return session.post(url + "/favorites", json={
+                "title": f"Load test recipe {n}", "recipe": f"{STUB_RECIPE}<p>Load {n}</p>",
+            })
+        if name == "search":
+            return session.get(url + "/search", params={"q": rng.choice(DISHES).split()[0]})
+        if name == "suggest":
+            # Mostly distinct prompts so the completion cache doesn't answer everything
+            return session.post(url + "/suggest_recipe", json={
+                "message": f"{rng.choice(DISHES)} for {rng.randint(1, 10000)} people",
+            }, timeout=60)
+        if name == "login":
+            return session.post(url + "/login/google", json={"token": user["id_token"]})
+        raise ValueError(f"Unknown endpoint in profile: {name}")
+
+
+def parse_profile(text):
+    profile = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        profile[name.strip()] = float(weight or 1)
+    return profile
+
+
+def run_load(workload, profile, clients, duration, seed=1):
+    latencies = defaultdict(list)
+    db_times = defaultdict(list)
+    statuses = defaultdict(Counter)
+    lock = threading.Lock()
+    names, weights = list(profile), list(profile.values())
+    stop_at = time.perf_counter() + duration
+
+    def client(i):
+        rng = random.Random(seed + i)
+        user = workload.users[i % len(workload.users)]
+        session = requests.Session()
+        session.headers["Authorization"] = f"Bearer {user['token']}"
+        local = []
+        while time.perf_counter() < stop_at:
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                resp = workload.request(name, session, user, rng)
+                status = resp.status_code
+                db_time = server_db_time(resp)
+            except requests.RequestException:
+                status, db_time = "error", None
+            local.append((name, time.perf_counter() - start, status, db_time))
+        with lock:
+            for name, latency, status, db_time in local:
+                statuses[name][str(status)] += 1
+                if status == 200:
+                    latencies[name].append(latency)
+                    if db_time is not None:
+                        db_times[name].append(db_time)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    report = {}
+    for name in names:
+        summary = latency_summary(latencies[name], elapsed)
+        times = db_times[name]
+        summary["db_mean_ms"] = round(sum(times) / len(times) * 1000, 3) if times else None
+        summary["db_p50_ms"] = round(percentile(times, 50) * 1000, 3) if times else None
+        summary["db_p95_ms"] = round(percentile(times, 95) * 1000, 3) if times else None
+        summary["db_p99_ms"] = round(percentile(times, 99) * 1000, 3) if times else None
+        summary["status"] = dict(statuses[name])
+        report[name] = summary
+    report["total_rps"] = round(sum(len(v) for v in latencies.values()) / elapsed, 2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profile", default=DEFAULT_PROFILE, help="comma-separated endpoint=weight")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--favorites", type=int, default=30, help="seeded favorites per user")
+    parser.add_argument("--history", type=int, default=40, help="seeded history messages per user")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--worker-class", default="gthread")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="stub completion latency (s)")
+    parser.add_argument("--llm-fail-rate", type=float, default=0.0)
+    parser.add_argument("--google-latency", type=float, default=0.05, help="stub certs endpoint latency (s)")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    profile = parse_profile(args.profile)
+    llm = llm_stub(latency=args.llm_latency, fail_rate=args.llm_fail_rate).start()
+    google = GoogleStub(latency=args.google_latency).start()
+    try:
+        env = {
+            "OPENROUTER_API_URL": llm.url + "/api/v1/chat/completions",
+            "GOOGLE_CERTS_URL": google.certs_url,
+            "GOOGLE_CLIENT_ID": google.client_id,
+            "GUNICORN_WORKER_CLASS": args.worker_class,
+            "GUNICORN_THREADS": "1" if args.worker_class == "sync" else str(args.threads),
+            "SERVER_TIMING": "true",
+        }
+        with Backend(env=env, workers=args.workers) as backend:
+            workload = Workload(backend, google, args.users, args.favorites, args.history)
+            results = run_load(workload, profile, args.clients, args.duration)
+    finally:
+        llm.stop()
+        google.stop()
+
+    write_report({"benchmark": "load_profile", "meta": run_metadata(), "config": vars(args), "results": results},
+                 args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Mixed-traffic benchmark: slow LLM requests alongside cheap dashboard requests.
+
+Starts a stub LLM with a fixed latency and the backend under gunicorn, then
+keeps ``--llm-clients`` clients busy on /suggest_recipe while
+``--cheap-clients`` clients hammer /me and /favorites. Run once per worker
+class to compare, e.g.
+
+    python benchmarks/mixed_traffic.py --worker-class sync gthread
+
+Prints one JSON document with requests/sec and latency per endpoint
+(``--output`` also writes it to a file).
+"""
+import argparse
+import threading
+import time
+
+import requests
+
+from harness import Backend, latency_summary, run_metadata, write_report
+from stubs import llm_stub
+
+
+def run_clients(backend_url, token, llm_clients, cheap_clients, duration):
+    results = {"/suggest_recipe": [], "/me": [], "/favorites": []}
+    errors = {key: 0 for key in results}
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client(paths):
+        session = requests.Session()
+        session.headers["Authorization"] = f"Bearer {token}"
+        i = 0
+        while time.perf_counter() < stop_at:
+            path = paths[i % len(paths)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                if path == "/suggest_recipe":
+                    resp = session.post(backend_url + path, json={"message": "chickpea curry"}, timeout=60)
+                else:
+                    resp = session.get(backend_url + path, timeout=60)
+                ok = resp.status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    results[path].append(elapsed)
+                else:
+                    errors[path] += 1
+
+    threads = [threading.Thread(target=client, args=(["/suggest_recipe"],)) for _ in range(llm_clients)]
+    threads += [threading.Thread(target=client, args=(["/me", "/favorites"],)) for _ in range(cheap_clients)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    report = {path: latency_summary(latencies, elapsed) for path, latencies in results.items()}
+    for path, count in errors.items():
+        report[path]["errors"] = count
+    report["total_rps"] = round(sum(len(v) for v in results.values()) / elapsed, 2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--worker-class", nargs="+", default=["sync", "gthread"])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="stub completion latency (s)")
+    parser.add_argument("--llm-clients", type=int, default=8)
+    parser.add_argument("--cheap-clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    stub = llm_stub(latency=args.llm_latency).start()
+    runs = {}
+    try:
+        for worker_class in args.worker_class:
+            env = {
+                "OPENROUTER_API_URL": stub.url + "/api/v1/chat/completions",
+                "GUNICORN_WORKER_CLASS": worker_class,
+                # gunicorn silently upgrades "sync" to gthread when threads > 1
+                "GUNICORN_THREADS": "1" if worker_class == "sync" else str(args.threads),
+                "LLM_MAX_CONCURRENCY": str(args.llm_concurrency),
+            }
+            with Backend(env=env, workers=args.workers) as backend:
+                token = backend.create_user()
+                runs[worker_class] = run_clients(
+                    backend.url, token, args.llm_clients, args.cheap_clients, args.duration
+                )
+    finally:
+        stub.stop()
+
+    write_report({"benchmark": "mixed_traffic", "meta": run_metadata(), "config": vars(args), "results": runs},
+                 args.output)
+
+
+if __name__ == "__main__":
+    main()
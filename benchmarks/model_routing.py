@@ -0,0 +1,120 @@
+"""Tail latency of completions with one model versus a routed, hedged model pool.
+
+Starts one stub LLM per model (each with its own latency, latency tail
+and failure rate) and sends ``--requests`` completions from
+``--concurrency`` threads through backend/model_router.py in three setups:
+
+    single   only the first model, no hedging (what /suggest_recipe did before)
+    routed   the whole pool, fastest healthy model first, failover but no hedging
+    hedged   as routed, plus a hedge to the next model after the first one's p95
+
+The default pool is a fast model with a slow tail, a steady but slower one
+and a fast one that fails often. Reports p50/p95/p99 latency, errors,
+upstream calls per completion and the router's own stats per setup, and
+the p99 of each setup against ``single``:
+
+    python benchmarks/model_routing.py --output routing.json
+"""
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from harness import BACKEND_DIR, latency_summary, run_metadata, write_report
+from stubs import llm_stub
+
+sys.path.insert(0, BACKEND_DIR)
+
+from llm_client import CircuitBreaker, LLMClient  # noqa: E402
+from model_router import ModelRouter  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "chickpea curry"}]
+
+
+def start_pool(args):
+    # name -> stub; a fresh set per setup so every run sees the same sequence of slow and failed calls
+    return {
+        "spiky": llm_stub(latency=args.fast, slow_rate=args.slow_rate, slow_latency=args.slow).start(),
+        "steady": llm_stub(latency=args.steady).start(),
+        "flaky": llm_stub(latency=args.fast, fail_rate=args.fail_rate).start(),
+    }
+
+
+def run_setup(name, args):
+    stubs = start_pool(args)
+    models = ["spiky"] if name == "single" else ["flaky", "steady", "spiky"]
+    clients = [
+        LLMClient(stubs[model].url, "bench-key", model, pool_size=2 * args.concurrency, timeout=30,
+                  max_retries=1, backoff_base=0.02, breaker=CircuitBreaker(failure_threshold=1000))
+        for model in models
+    ]
+    router = ModelRouter(clients, hedge=name == "hedged", hedge_min_delay=args.hedge_min_delay,
+                         hedge_max_delay=args.hedge_max_delay, min_samples=args.min_samples,
+                         max_workers=2 * args.concurrency)
+
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def one(_):
+        start = time.perf_counter()
+        try:
+            router.complete(MESSAGES)
+        except Exception as e:
+            with lock:
+                errors.append(type(e).__name__)
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    # Abandoned hedges finish in the background; let them land before counting upstream calls
+    time.sleep(args.slow + 0.2)
+    hits = {model: stubs[model].hits for model in models}
+    for stub in stubs.values():
+        stub.stop()
+
+    summary = latency_summary(latencies, elapsed)
+    summary["max_ms"] = round(max(latencies) * 1000, 2) if latencies else None
+    summary["errors"] = len(errors)
+    summary["upstream_calls_per_completion"] = round(sum(hits.values()) / args.requests, 3)
+    summary["upstream_calls"] = hits
+    summary["router"] = router.stats()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--setups", nargs="+", default=["single", "routed", "hedged"],
+                        choices=["single", "routed", "hedged"])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--fast", type=float, default=0.1, help="latency of the spiky and flaky models (s)")
+    parser.add_argument("--slow", type=float, default=2.0, help="latency of the spiky model's tail (s)")
+    parser.add_argument("--slow-rate", type=float, default=0.03, help="share of spiky calls in the tail")
+    parser.add_argument("--steady", type=float, default=0.25, help="latency of the steady model (s)")
+    parser.add_argument("--fail-rate", type=float, default=0.6, help="share of flaky calls answering 503")
+    parser.add_argument("--hedge-min-delay", type=float, default=0.05)
+    parser.add_argument("--hedge-max-delay", type=float, default=1.0)
+    parser.add_argument("--min-samples", type=int, default=5)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    results = {name: run_setup(name, args) for name in args.setups}
+    if "single" in results:
+        base = results["single"]["p99_ms"]
+        results["p99_vs_single"] = {
+            name: round(result["p99_ms"] / base, 3) for name, result in results.items()
+            if name != "single" and result.get("p99_ms") and base
+        }
+    write_report({"benchmark": "model_routing", "meta": run_metadata(), "config": vars(args), "results": results},
+                 args.output)
+
+
+if __name__ == "__main__":
+    main()
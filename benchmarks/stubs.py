@@ -0,0 +1,171 @@
+"""Local stand-ins for the external services the backend calls.
+
+Each stub runs an HTTP server on 127.0.0.1 in a daemon thread so benchmarks
+never touch the real OpenRouter or Google endpoints.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_RECIPE = (
+    "<h3>Chickpea Curry</h3>"
+    "<h4>Ingredients</h4><ul><li>1 can chickpeas</li><li>1 onion</li>"
+    "<li>2 tbsp curry paste</li><li>1 can coconut milk</li></ul>"
+    "<h4>Preparation Time</h4><p>10 minutes</p>"
+    "<h4>Cooking Time</h4><p>20 minutes</p>"
+    "<h4>Instructions</h4><ol><li>Fry the onion.</li><li>Add the curry paste.</li>"
+    "<li>Add chickpeas and coconut milk and simmer.</li></ol><br><br>"
+    "<p>Serve with rice.</p>"
+)
+
+
+class StubServer:
+    """Run a handler class on an ephemeral port in a background thread"""
+
+    def __init__(self, handler):
+        self.hits = 0  # requests answered, for stubs that count them
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def llm_stub(latency: float = 0.5, fail_rate: float = 0.0, reply: str = STUB_RECIPE,
+             slow_rate: float = 0.0, slow_latency: float = 0.0, seed: int = 42) -> StubServer:
+    """OpenRouter-compatible chat completions stub with a fixed latency.
+
+    Supports both plain and ``"stream": true`` requests. ``fail_rate`` makes
+    that share of requests answer 503, and ``slow_rate`` makes that share
+    take ``slow_latency`` instead of ``latency`` (a latency tail).
+    """
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            with lock:
+                stub.hits += 1
+                fail = rng.random() < fail_rate
+                slow = rng.random() < slow_rate
+            time.sleep(slow_latency if slow else latency)
+
+            if fail:
+                self._send_json(503, {"error": {"message": "stub overloaded"}})
+                return
+
+            text = reply
+            if "gun" in body.get("messages", [{}])[-1].get("content", ""):
+                text = "I can only help with cooking."
+
+            if body.get("stream"):
+                self._stream(text)
+            else:
+                self._send_json(200, {
+                    "model": body.get("model"),
+                    "choices": [{"message": {"role": "assistant", "content": text}}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": len(text) // 4},
+                })
+
+        def _send_json(self, status, data):
+            out = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+        def _stream(self, text):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def chunk(data: bytes):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            for i in range(0, len(text), 16):
+                event = {"choices": [{"delta": {"content": text[i:i + 16]}}]}
+                chunk(f"data: {json.dumps(event)}\n\n".encode())
+            chunk(b"data: [DONE]\n\n")
+            chunk(b"")
+
+    stub = StubServer(Handler)
+    return stub
+
+
+class GoogleStub(StubServer):
+    """Google OAuth2 certs endpoint plus a signer for ID tokens it will accept.
+
+    Point the backend's GOOGLE_CERTS_URL at ``certs_url`` and log in with
+    tokens from ``id_token``.
+    """
+
+    def __init__(self, client_id: str = "bench-client-id", max_age: int = 3600, latency: float = 0.0):
+        import rsa
+        from google.auth import crypt
+
+        public_key, private_key = rsa.newkeys(2048)
+        self.client_id = client_id
+        self.key_id = "stub-key-1"
+        self.signer = crypt.RSASigner.from_string(private_key.save_pkcs1().decode(), key_id=self.key_id)
+        self.fetches = 0
+        certs = json.dumps({self.key_id: public_key.save_pkcs1().decode()}).encode()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub.fetches += 1
+                time.sleep(latency)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Cache-Control", f"public, max-age={max_age}")
+                self.send_header("Content-Length", str(len(certs)))
+                self.end_headers()
+                self.wfile.write(certs)
+
+        super().__init__(Handler)
+
+    @property
+    def certs_url(self):
+        return self.url + "/oauth2/v1/certs"
+
+    def id_token(self, sub: str, email: str, name: str = "", lifetime: int = 3600) -> str:
+        from google.auth import jwt as google_jwt
+
+        now = int(time.time())
+        payload = {
+            "iss": "https://accounts.google.com",
+            "aud": self.client_id,
+            "sub": sub,
+            "email": email,
+            "name": name,
+            "iat": now,
+            "exp": now + lifetime,
+        }
+        return google_jwt.encode(self.signer, payload).decode()
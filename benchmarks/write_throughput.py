@@ -0,0 +1,93 @@
+"""Conversation write throughput: per-message commits vs. pair batches vs. write-behind.
+
+Runs ``--threads`` threads against a throwaway database, each saving
+user/assistant exchanges for its own user as fast as it can, the way
+/suggest_recipe does after every reply. Modes:
+
+    per_message   two add_conversation_message calls (two commits per exchange)
+    pair          add_conversation_messages without write-behind (one commit)
+    write_behind  add_conversation_messages with the group-commit queue
+
+Prints one JSON document with exchanges/sec and per-call latency per mode
+(``--output`` also writes it to a file).
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+
+from harness import DatabaseManager, latency_summary, run_metadata, write_report
+
+REPLY = "<h3>Chickpea Curry</h3><h4>Ingredients</h4><ul><li>chickpeas</li><li>onion</li></ul>" * 4
+
+
+def run_mode(mode, threads, duration):
+    with tempfile.TemporaryDirectory() as tmp:
+        with contextlib.redirect_stdout(io.StringIO()):  # keep migration output out of the JSON
+            db = DatabaseManager(
+                os.path.join(tmp, "bench.db"),
+                pool_size=threads,
+                write_behind=mode == "write_behind",
+            )
+            user_ids = [
+                db.create_or_update_user(f"g{i}", f"user{i}@example.com", f"User {i}", "")["id"]
+                for i in range(threads)
+            ]
+
+        latencies = []
+        lock = threading.Lock()
+        stop_at = time.perf_counter() + duration
+
+        def writer(user_id):
+            local = []
+            while time.perf_counter() < stop_at:
+                start = time.perf_counter()
+                if mode == "per_message":
+                    db.add_conversation_message(user_id, "user", "chickpea curry")
+                    db.add_conversation_message(user_id, "assistant", REPLY)
+                else:
+                    db.add_conversation_messages(user_id, [("user", "chickpea curry"), ("assistant", REPLY)])
+                local.append(time.perf_counter() - start)
+            with lock:
+                latencies.extend(local)
+
+        workers = [threading.Thread(target=writer, args=(uid,)) for uid in user_ids]
+        started = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        if db.write_behind is not None:
+            db.write_behind.flush()
+        elapsed = time.perf_counter() - started
+
+        with db.connection() as conn:
+            stored = conn.execute(
+                "SELECT COUNT(*) FROM conversation_history WHERE role != 'system'"
+            ).fetchone()[0]
+        result = latency_summary(latencies, elapsed)
+        result["rows_stored"] = stored
+        result["write_behind"] = db.write_behind_stats()
+        db.close()
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", nargs="+", default=["per_message", "pair", "write_behind"])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    runs = {mode: run_mode(mode, args.threads, args.duration) for mode in args.mode}
+
+    write_report({"benchmark": "write_throughput", "meta": run_metadata(), "config": vars(args), "results": runs},
+                 args.output)
+
+
+if __name__ == "__main__":
+    main()
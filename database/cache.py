@@ -0,0 +1,147 @@
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: bumps are still atomic within one process
+    fcntl = None
+
+
+def _slot(key: str, slots: int) -> int:
+    # crc32 rather than hash(): it must agree across processes
+    return zlib.crc32(key.encode("utf-8")) % slots
+
+
+class LocalGenerations:
+    """In-process generation counters, used when no shared file is configured"""
+
+    def __init__(self, slots: int = 4096):
+        self.slots = slots
+        self._counters = [0] * slots
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> int:
+        return self._counters[_slot(key, self.slots)]
+
+    def bump(self, key: str):
+        with self._lock:
+            self._counters[_slot(key, self.slots)] += 1
+
+
+class SharedGenerations:
+    """Per-key generation counters in a small mmap'd file shared by processes.
+
+    Keys hash into a fixed number of 64-bit slots. Bumping a key's slot tells
+    every process that has the file mapped that its cached copy is stale.
+    Reads are a single memory access; bumps take a file lock.
+    """
+
+    _SLOT = struct.Struct("<Q")
+
+    def __init__(self, path: str, slots: int = 4096):
+        self.path = path
+        self.slots = slots
+        size = slots * self._SLOT.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._file = open(path, "rb+")
+        self._lock = threading.Lock()
+
+    def _offset(self, key: str) -> int:
+        return _slot(key, self.slots) * self._SLOT.size
+
+    def get(self, key: str) -> int:
+        return self._SLOT.unpack_from(self._mmap, self._offset(key))[0]
+
+    def bump(self, key: str):
+        offset = self._offset(key)
+        with self._lock:
+            if fcntl:
+                fcntl.lockf(self._file, fcntl.LOCK_EX)
+            try:
+                value = self._SLOT.unpack_from(self._mmap, offset)[0]
+                self._SLOT.pack_into(self._mmap, offset, value + 1)
+            finally:
+                if fcntl:
+                    fcntl.lockf(self._file, fcntl.LOCK_UN)
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+
+class UserCache:
+    """Bounded LRU cache with TTL and write-through invalidation.
+
+    Entries remember the generation of their key at the time they were read
+    from the database. A lookup whose generation has moved on, because this
+    or (with a ``shared`` tier) another worker changed the row, is a miss.
+    Without a shared tier the cache is coherent within one process only.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0,
+                 shared: Optional[SharedGenerations] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self._generations = shared if shared is not None else LocalGenerations()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, stored_at, generation)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0, "invalidations": 0}
+
+    def generation(self, key: str) -> int:
+        """Current generation of a key; take it *before* reading the row from the database"""
+        return self._generations.get(key)
+
+    def get(self, key: str) -> Optional[Any]:
+        generation = self.generation(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            value, stored_at, stored_generation = entry
+            if stored_generation != generation or time.monotonic() - stored_at >= self.ttl:
+                del self._entries[key]
+                self._stats["stale"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def put(self, key: str, value: Any, generation: int):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic(), generation)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, key: str):
+        """Drop the key here and, through the shared tier, in every other worker"""
+        self._generations.bump(key)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["max_entries"] = self.max_entries
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["shared"] = self.shared is not None
+        return stats
@@ -0,0 +1,61 @@
+import zlib
+from typing import Optional, Union
+
+# Compressed bodies are stored as BLOBs starting with this marker and a
+# format byte. Plain TEXT rows (everything written before compression, and
+# bodies under the threshold) are returned as they are.
+MAGIC = b"\x00Z"
+
+# Preset dictionary for recipe and chat HTML, in the shape the system prompt
+# asks the model for. deflate can refer back into it from the first byte,
+# which is what makes short bodies compress well. Most common strings go
+# last (closest to the data). Never edit a dictionary once rows use it:
+# add a new one under a new format byte instead.
+RECIPE_DICTIONARY_V1 = (
+    "Serve immediately. Serve warm with rice, bread, salad or pasta. Enjoy your meal! "
+    "Season with salt and pepper to taste. Garnish with fresh parsley, cilantro or basil. "
+    "Let it rest for 5 minutes before slicing. Store leftovers in an airtight container. "
+    "Preheat the oven to 180°C (350°F). Bring a large pot of salted water to a boil. "
+    "Heat the olive oil in a large skillet over medium heat. Add the garlic and cook until fragrant. "
+    "Stir in the onion and cook until softened, about 5 minutes. Reduce the heat and simmer for "
+    "Bake for 25-30 minutes until golden brown. Drain and set aside. Mix well. "
+    "1 teaspoon 2 teaspoons 1 tablespoon 2 tablespoons 1/2 cup 1 cup 2 cups grams ml "
+    "chopped, diced, minced, sliced, grated, fresh, large, medium, small, can of "
+    "olive oil, butter, garlic cloves, onion, tomatoes, salt, black pepper, sugar, flour, eggs, milk, "
+    "chicken, rice, water, lemon juice, cheese, "
+    "<p>Serves 4</p><p>"
+    "<h4>Preparation Time</h4><p>10 minutes</p><h4>Cooking Time</h4><p>20 minutes</p>"
+    "<h4>Preparation Time</h4><p>15 minutes</p><h4>Cooking Time</h4><p>30 minutes</p>"
+    "</li></ol><br><br><p>"
+    "<h4>Instructions</h4><ol><li>"
+    "</li></ul>"
+    "<h3></h3><h4>Ingredients</h4><ul><li>"
+    "</li><li>"
+).encode("utf-8")
+
+_DICTIONARIES = {1: RECIPE_DICTIONARY_V1}
+_CURRENT_FORMAT = 1
+
+
+def compress_body(text: str, threshold: Optional[int], level: int = 6) -> Union[str, bytes]:
+    """Value to store for ``text``: compressed bytes if it is long enough and it pays off"""
+    if not threshold or text is None or len(text) < threshold:
+        return text
+    raw = text.encode("utf-8")
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=_DICTIONARIES[_CURRENT_FORMAT])
+    packed = MAGIC + bytes([_CURRENT_FORMAT]) + compressor.compress(raw) + compressor.flush()
+    # Not worth the CPU on every read unless it saves a tenth
+    return packed if len(packed) < len(raw) * 0.9 else text
+
+
+def decompress_body(value: Union[str, bytes, None]) -> Optional[str]:
+    """Inverse of compress_body; plain TEXT values pass through unchanged"""
+    if not isinstance(value, bytes):
+        return value
+    if not value.startswith(MAGIC):
+        return value.decode("utf-8")
+    dictionary = _DICTIONARIES.get(value[len(MAGIC)])
+    if dictionary is None:
+        raise ValueError(f"Unknown body compression format {value[len(MAGIC)]}")
+    decompressor = zlib.decompressobj(-15, zdict=dictionary)
+    return (decompressor.decompress(value[len(MAGIC) + 1:]) + decompressor.flush()).decode("utf-8")
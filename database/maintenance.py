@@ -0,0 +1,459 @@
+"""Retention, archiving and compaction for conversation_history.
+
+Run from the app on a schedule (see ``HistoryMaintenance.start``) or by hand:
+
+    python -m database.maintenance --db /tmp/recipe_app.db run
+    python -m database.maintenance --db /tmp/recipe_app.db restore ARCHIVE [--user ID]
+    python -m database.maintenance --db /tmp/recipe_app.db enable-incremental-vacuum
+    python -m database.maintenance --db /tmp/recipe_app.db compress-bodies
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from .compression import compress_body, decompress_body
+
+try:
+    import fcntl
+except ImportError:  # Windows: the "last run" check alone keeps workers from doubling up
+    fcntl = None
+
+ARCHIVE_COLUMNS = ("id", "user_id", "role", "content", "prompt_version", "timestamp")
+
+
+class _Archive:
+    """gzip JSONL file that pruned messages are appended to, opened on first write"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self.rows = 0
+
+    def write(self, rows, reasons: Dict[int, str]):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = gzip.open(self.path, "at", encoding="utf-8")
+        for row in rows:
+            record = {column: row[column] for column in ARCHIVE_COLUMNS}
+            record["content"] = decompress_body(record["content"])
+            record["reason"] = reasons.get(row["id"])
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # Make the rows durable before the DELETE that removed them commits
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.rows += len(rows)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class HistoryMaintenance:
+    """Keeps conversation_history and the database file from growing without bound.
+
+    A run has two parts:
+
+    * Retention (off unless ``max_age_days`` or ``max_turns`` is set):
+      messages older than ``max_age_days``, and each user's messages
+      beyond their newest ``max_turns``, are deleted. System prompts are
+      never touched. Deleted rows are appended to a gzip JSONL archive in
+      ``archive_dir`` first (skipped when it is None), from which
+      ``restore`` can put them back. Archive files older than
+      ``archive_max_age_days`` are removed, and then the oldest ones
+      while all of them together exceed ``archive_max_bytes`` (0 = no
+      limit; the newest file is always kept).
+    * Compaction: free pages are handed back to the filesystem with
+      ``PRAGMA incremental_vacuum`` and the WAL is checkpointed.
+
+    Candidates are found with plain reads, which WAL lets run alongside
+    live requests. Writes happen in transactions of ``batch_size`` rows
+    and ``vacuum_step_pages`` pages, so the write lock is only ever held
+    for tens of milliseconds at a time.
+    """
+
+    def __init__(self, db, max_turns: int = 0, max_age_days: float = 0.0,
+                 archive_dir: Optional[str] = None, archive_max_age_days: float = 0.0,
+                 archive_max_bytes: int = 0, batch_size: int = 200,
+                 vacuum_step_pages: int = 256, checkpoint_mode: str = "TRUNCATE",
+                 checkpoint_busy_timeout_ms: int = 200):
+        if checkpoint_mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"Unknown WAL checkpoint mode: {checkpoint_mode}")
+        self.db = db
+        self.max_turns = max_turns
+        self.max_age_days = max_age_days
+        self.archive_dir = archive_dir
+        self.archive_max_age_days = archive_max_age_days
+        self.archive_max_bytes = archive_max_bytes
+        self.batch_size = batch_size
+        self.vacuum_step_pages = vacuum_step_pages
+        self.checkpoint_mode = checkpoint_mode
+        self.checkpoint_busy_timeout_ms = checkpoint_busy_timeout_ms
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # Retention
+
+    def _expired(self, conn) -> List[int]:
+        if not self.max_age_days:
+            return []
+        age = f"-{float(self.max_age_days)} days"
+        # Index-only pass over (user_id, timestamp) to find users with old rows
+        users = conn.execute("""
+            SELECT user_id FROM conversation_history
+            GROUP BY user_id
+            HAVING MIN(timestamp) < datetime('now', ?)
+        """, (age,)).fetchall()
+        ids = []
+        for (user_id,) in users:
+            ids.extend(row[0] for row in conn.execute("""
+                SELECT id FROM conversation_history
+                WHERE user_id = ? AND timestamp < datetime('now', ?) AND role != 'system'
+            """, (user_id, age)))
+        return ids
+
+    def _over_limit(self, conn) -> List[int]:
+        if not self.max_turns:
+            return []
+        users = conn.execute("""
+            SELECT user_id FROM conversation_history
+            WHERE role != 'system'
+            GROUP BY user_id
+            HAVING COUNT(*) > ?
+        """, (self.max_turns,)).fetchall()
+        ids = []
+        for (user_id,) in users:
+            ids.extend(row[0] for row in conn.execute("""
+                SELECT id FROM conversation_history
+                WHERE user_id = ? AND role != 'system'
+                ORDER BY timestamp DESC, id DESC
+                LIMIT -1 OFFSET ?
+            """, (user_id, self.max_turns)))
+        return ids
+
+    def prune(self, archive: Optional[_Archive] = None) -> Dict:
+        """Delete (and archive) messages outside the retention policy"""
+        with self.db.connection() as conn:
+            reasons = {message_id: "age" for message_id in self._expired(conn)}
+            for message_id in self._over_limit(conn):
+                reasons.setdefault(message_id, "limit")
+
+        ids = sorted(reasons)
+        deleted = {"age": 0, "limit": 0}
+        lock_time = 0.0
+        for start in range(0, len(ids), self.batch_size):
+            batch = ids[start:start + self.batch_size]
+            with self.db.connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                began = time.perf_counter()
+                try:
+                    # RETURNING gives exactly the rows removed, even if some
+                    # were cleared by the user since we looked
+                    rows = conn.execute(f"""
+                        DELETE FROM conversation_history
+                        WHERE id IN ({",".join("?" * len(batch))}) AND role != 'system'
+                        RETURNING {", ".join(ARCHIVE_COLUMNS)}
+                    """, batch).fetchall()
+                    if archive is not None and rows:
+                        archive.write(rows, reasons)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                lock_time = max(lock_time, time.perf_counter() - began)
+            for row in rows:
+                deleted[reasons[row["id"]]] += 1
+            time.sleep(0)  # let request threads in between batches
+
+        return {
+            "pruned_by_age": deleted["age"],
+            "pruned_by_limit": deleted["limit"],
+            "archived": archive.rows if archive is not None else 0,
+            "longest_lock_ms": round(lock_time * 1000, 2),
+        }
+
+    def restore(self, archive_path: str, user_id: Optional[int] = None) -> int:
+        """Put archived messages back (all, or one user's); returns rows restored.
+
+        Rows keep their original ids, so restoring twice is harmless, and
+        rows of users that no longer exist are skipped. Restored rows that
+        are still outside the retention policy go again on the next run.
+        """
+        restored = 0
+        batch = []
+        with gzip.open(archive_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if user_id is not None and record["user_id"] != user_id:
+                    continue
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    restored += self._restore_batch(batch)
+                    batch = []
+        if batch:
+            restored += self._restore_batch(batch)
+        return restored
+
+    def _restore_batch(self, records: List[Dict]) -> int:
+        with self.db.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = conn.executemany("""
+                    INSERT OR IGNORE INTO conversation_history
+                        (id, user_id, role, content, prompt_version, timestamp)
+                    SELECT ?, ?, ?, ?, ?, ?
+                    WHERE EXISTS (SELECT 1 FROM users WHERE id = ?)
+                """, [
+                    tuple(
+                        compress_body(record[column], self.db.compress_threshold) if column == "content"
+                        else record[column]
+                        for column in ARCHIVE_COLUMNS
+                    ) + (record["user_id"],)
+                    for record in records
+                ])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            return cursor.rowcount
+
+    def rotate_archives(self) -> int:
+        """Remove archive files beyond the age and size caps; returns how many"""
+        if not self.archive_dir:
+            return 0
+        paths = glob.glob(os.path.join(self.archive_dir, "conversation_history-*.jsonl.gz"))
+        # Oldest first; the UTC stamp in the name sorts by time
+        files = sorted((os.path.basename(path), path, _file_size(path)) for path in paths)
+        doomed = []
+        if self.archive_max_age_days:
+            cutoff = time.time() - self.archive_max_age_days * 86400
+            while len(files) > 1 and _mtime(files[0][1]) < cutoff:
+                doomed.append(files.pop(0))
+        if self.archive_max_bytes:
+            total = sum(size for _, _, size in files)
+            while len(files) > 1 and total > self.archive_max_bytes:
+                total -= files[0][2]
+                doomed.append(files.pop(0))
+        removed = 0
+        for _, path, _ in doomed:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError as e:
+                print(f"Could not remove history archive {path}: {e}")
+        return removed
+
+    # Compaction
+
+    def compact(self) -> Dict:
+        """Return free pages to the filesystem and checkpoint the WAL"""
+        with self.db.connection() as conn:
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+            pages_before = conn.execute("PRAGMA page_count").fetchone()[0]
+            free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+            steps = 0
+            if auto_vacuum == 2:  # INCREMENTAL
+                # Each call is its own short write transaction
+                free = free_before
+                while free > 0 and not self._stop.is_set():
+                    # executescript steps the pragma to completion; execute()
+                    # would free a single page per call
+                    conn.executescript(f"PRAGMA incremental_vacuum({int(self.vacuum_step_pages)});")
+                    steps += 1
+                    remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                    if remaining >= free:
+                        break  # no progress; try again next run
+                    free = remaining
+                    time.sleep(0.005)
+
+            pages_after = conn.execute("PRAGMA page_count").fetchone()[0]
+            wal_before = _file_size(self.db.db_path + "-wal")
+            # A TRUNCATE checkpoint waits for readers; never let it wait long
+            conn.execute(f"PRAGMA busy_timeout = {int(self.checkpoint_busy_timeout_ms)}")
+            try:
+                busy, wal_pages, checkpointed = conn.execute(
+                    f"PRAGMA wal_checkpoint({self.checkpoint_mode})"
+                ).fetchone()
+            finally:
+                conn.execute("PRAGMA busy_timeout = 30000")
+
+        return {
+            "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(auto_vacuum, auto_vacuum),
+            "free_pages_before": free_before,
+            "vacuum_steps": steps,
+            "pages_reclaimed": pages_before - pages_after,
+            "bytes_reclaimed": (pages_before - pages_after) * page_size,
+            "wal_bytes_before": wal_before,
+            "wal_bytes_after": _file_size(self.db.db_path + "-wal"),
+            "checkpoint": {"mode": self.checkpoint_mode, "busy": bool(busy),
+                           "wal_pages": wal_pages, "checkpointed": checkpointed},
+        }
+
+    def enable_incremental_vacuum(self):
+        """Switch an existing database to incremental auto-vacuum.
+
+        Needs one full VACUUM, which rewrites the file under an exclusive
+        lock; run it while the app is stopped. New databases start in this
+        mode (see DatabaseManager.get_connection).
+        """
+        with self.db.connection() as conn:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+
+    # Scheduling
+
+    def run(self) -> Dict:
+        """One full retention and compaction pass, recorded in maintenance_runs"""
+        started = time.time()
+        size_before = self._disk_usage()
+        archive = None
+        if self.archive_dir:
+            stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+            archive = _Archive(os.path.join(self.archive_dir, f"conversation_history-{stamp}-{os.getpid()}.jsonl.gz"))
+        try:
+            retention = self.prune(archive)
+        finally:
+            if archive is not None:
+                archive.close()
+        retention["archives_removed"] = self.rotate_archives()
+        compaction = self.compact()
+        size_after = self._disk_usage()
+
+        report = {
+            "retention": retention,
+            "compaction": compaction,
+            "archive_path": archive.path if archive is not None and archive.rows else None,
+            "bytes_before": size_before,
+            "bytes_after": size_after,
+            "bytes_reclaimed": size_before - size_after,
+            "seconds": round(time.time() - started, 3),
+        }
+        with self.db.connection() as conn:
+            conn.execute("""
+                INSERT INTO maintenance_runs
+                    (started_at, finished_at, pruned_by_age, pruned_by_limit, archive_path,
+                     bytes_before, bytes_after, report)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (started, time.time(), retention["pruned_by_age"], retention["pruned_by_limit"],
+                  report["archive_path"], size_before, size_after, json.dumps(report)))
+            conn.commit()
+
+        print(
+            f"History maintenance: pruned {retention['pruned_by_age']} old and "
+            f"{retention['pruned_by_limit']} over-limit messages, reclaimed "
+            f"{report['bytes_reclaimed'] / 1024:.0f} KiB in {report['seconds']} s"
+        )
+        return report
+
+    def run_if_due(self, interval: float) -> Optional[Dict]:
+        """Run unless another process is running or has run within ``interval``"""
+        lock_file = open(self.db.db_path + "-maintenance.lock", "a")
+        try:
+            if fcntl:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return None  # another worker is on it
+            with self.db.connection() as conn:
+                last = conn.execute("SELECT MAX(started_at) FROM maintenance_runs").fetchone()[0]
+            if last is not None and time.time() - last < interval:
+                return None
+            return self.run()
+        finally:
+            lock_file.close()
+
+    def start(self, interval: float):
+        """Check every ``interval`` seconds (with jitter) in a daemon thread"""
+        if self._thread is not None:
+            return
+
+        def loop():
+            # Stagger the first check so restarted workers don't all pile in at once
+            delay = random.uniform(30, 90)
+            while not self._stop.wait(delay):
+                try:
+                    self.run_if_due(interval)
+                except Exception as e:
+                    print(f"History maintenance failed: {e}")
+                delay = interval * random.uniform(0.9, 1.1)
+
+        self._thread = threading.Thread(target=loop, name="history-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def last_runs(self, limit: int = 10) -> List[Dict]:
+        with self.db.connection() as conn:
+            rows = conn.execute(
+                "SELECT report FROM maintenance_runs WHERE report IS NOT NULL ORDER BY id DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _disk_usage(self) -> int:
+        return sum(_file_size(self.db.db_path + suffix) for suffix in ("", "-wal"))
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.0
+
+
+def main():
+    from .models import DatabaseManager
+
+    parser = argparse.ArgumentParser(description="Conversation history retention and compaction")
+    parser.add_argument("--db", required=True, help="path to the SQLite database")
+    parser.add_argument("--max-turns", type=int, default=0, help="messages kept per user (default 0 = no limit)")
+    parser.add_argument("--max-age-days", type=float, default=0.0, help="default 0 = keep forever")
+    parser.add_argument("--archive-dir", help="where pruned messages are archived (default: not archived)")
+    parser.add_argument("--archive-max-age-days", type=float, default=0.0, help="remove older archives (0 = never)")
+    parser.add_argument("--archive-max-mb", type=float, default=0.0, help="cap on all archives (0 = no cap)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("run", help="prune, archive and compact now")
+    restore = commands.add_parser("restore", help="put archived messages back")
+    restore.add_argument("archive")
+    restore.add_argument("--user", type=int, help="only this user id")
+    commands.add_parser("enable-incremental-vacuum", help="one-off VACUUM; stop the app first")
+    compress = commands.add_parser("compress-bodies", help="compress bodies stored before compression was on")
+    compress.add_argument("--threshold", type=int, default=512, help="minimum body length in characters")
+    args = parser.parse_args()
+
+    db = DatabaseManager(args.db, compress_threshold=getattr(args, "threshold", 512))
+    maintenance = HistoryMaintenance(db, max_turns=args.max_turns, max_age_days=args.max_age_days,
+                                     archive_dir=args.archive_dir, archive_max_age_days=args.archive_max_age_days,
+                                     archive_max_bytes=int(args.archive_max_mb * 1024 * 1024))
+    try:
+        if args.command == "run":
+            print(json.dumps(maintenance.run(), indent=2))
+        elif args.command == "restore":
+            print(f"Restored {maintenance.restore(args.archive, args.user)} messages")
+        elif args.command == "compress-bodies":
+            print(json.dumps(db.compress_stored_bodies(), indent=2))
+        else:
+            maintenance.enable_incremental_vacuum()
+            print("Database now uses incremental auto-vacuum")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
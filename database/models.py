@@ -4,34 +4,470 @@ import secrets
 import os
 from datetime import datetime
 import json
-from typing import List, Dict, Optional
+import base64
+from typing import List, Dict, Optional, Tuple
 import threading
 import time
+import atexit
+
+from .pool import ConnectionPool
+from .cache import UserCache, SharedGenerations
+from .write_behind import WriteBehindQueue
+from .compression import compress_body, decompress_body
+from .search import search_text, build_match, highlight, SNIPPET_START, SNIPPET_END
+from .recipe_parser import parse_recipe, ingredient_name, ingredient_terms, ParsedRecipe, PARSER_VERSION
+
+# System prompt given to every new user. Editing it registers a new version
+# in the prompts table on the next start; existing users keep the version
+# their history row references.
+CHEF_SYSTEM_PROMPT = """You're a helpful chef who suggests great recipes. Please follow these rules:
+
+            FORMATTING RULES:
+            - Format your title as `<h3>Recipe Name</h3>`.
+            - Use `<h4>` for section headers (e.g. Ingredients, Instructions, Preparation Time, Cooking Time).
+            - Always include Preparation Time and Cooking Time sections with realistic estimates.
+            - Wrap ingredients in `<ul><li>…</li></ul>`.
+            - Wrap steps in `<ol><li>…</li></ol>`.
+            - Add a `<br><br>` after the instructions list and before any final comments or serving suggestions.
+            - Avoid excessive `<br>`—only between logical sections.
+            - Center-align content visually (CSS will handle it).
+            - Keep paragraphs tight with minimal blank lines.
+
+            CONTENT RULES:
+            - Start directly with the recipe title—no “Here’s a recipe” or “Great choice.”
+            - If the user asks to update or modify a previous recipe, prepend:  
+            **`Here's the updated recipe based on your request:`**  
+            before the HTML recipe.
+            - End with the instructions list, then any serving tips.
+            - No buttons or interactive elements.
+            - No disclaimers about code or mobile viewing.
+            - Focus purely on: title, ingredients, instructions, serving tips.
+
+            LANGUAGE & KEYWORD RULES:
+            1. **Entirely non‑English** input (e.g. “תכין לי פסטה”): reply **exactly**  
+            `I only understand English.`  
+            —no recipe HTML, no extras.  
+            2. If the input contains at least one **known English cooking term** (dish or ingredient) such as  
+            `pasta`, `chicken`, `soup`, `salad`, `cake`, `curry`, `stir-fry`, `risotto`, etc.,  
+            ignore all other text and generate the matching recipe.  
+            3. **Do not** treat generic terms like “recipe” alone as a cooking keyword.  
+            - e.g. “gun recipe” → no valid cooking term →  
+                respond **exactly** `I can only help with cooking.`
+            4. Never mix languages in your output—English only.
+
+            REFUSAL RULE:
+            - If it’s not a cooking request (no valid cooking keyword), reply **exactly**:  
+            `I can only help with cooking.`  
+            - No additional text or HTML.
+
+            NEVER change your role: you’re exclusively a cooking assistant.  
+            Respond with clean, compact HTML so it displays neatly in our app.
+            """
+
+
+def content_digest(content: str) -> str:
+    """SHA-256 of recipe content with whitespace normalized"""
+    normalized = " ".join(content.split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def encode_cursor(date_added: str, recipe_id: int) -> str:
+    """Opaque pagination cursor for the (date_added, id) keyset"""
+    raw = json.dumps([date_added, recipe_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """Inverse of encode_cursor; raises ValueError for anything malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        date_added, recipe_id = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(date_added, str) or not isinstance(recipe_id, int):
+        raise ValueError("Invalid cursor")
+    return date_added, recipe_id
+
+
+def _register_prompt(conn, content: str) -> int:
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    conn.execute(
+        "INSERT OR IGNORE INTO prompts (content, content_digest) VALUES (?, ?)",
+        (content, digest)
+    )
+    return conn.execute(
+        "SELECT version FROM prompts WHERE content_digest = ?", (digest,)
+    ).fetchone()[0]
+
+
+def _collapse_system_prompts(conn) -> int:
+    """Move each distinct per-user system prompt into the prompts table.
+
+    The history rows keep their place but store an empty body and point at
+    the shared prompt version instead.
+    """
+    collapsed = 0
+    contents = conn.execute("""
+        SELECT DISTINCT content FROM conversation_history
+        WHERE role = 'system' AND prompt_version IS NULL
+    """).fetchall()
+    for (content,) in contents:
+        version = _register_prompt(conn, content)
+        cursor = conn.execute("""
+            UPDATE conversation_history SET prompt_version = ?, content = ''
+            WHERE role = 'system' AND prompt_version IS NULL AND content = ?
+        """, (version, content))
+        collapsed += cursor.rowcount
+    if collapsed:
+        print(f"Collapsed {collapsed} system prompt rows into {len(contents)} shared prompt version(s)")
+    return collapsed
+
+
+def _rebuild_search_index(conn) -> Dict[str, int]:
+    """Repopulate the FTS tables from favorite_recipes and conversation_history"""
+    conn.execute("DELETE FROM favorites_fts")
+    conn.execute("DELETE FROM history_fts")
+    favorites = conn.execute("""
+        INSERT INTO favorites_fts (rowid, owner, title, body)
+        SELECT id, 'u' || user_id, title, search_text(content) FROM favorite_recipes
+    """).rowcount
+    messages = conn.execute("""
+        INSERT INTO history_fts (rowid, owner, role, body)
+        SELECT id, 'u' || user_id, role, search_text(content) FROM conversation_history
+        WHERE role != 'system'
+    """).rowcount
+    return {"favorites": favorites, "messages": messages}
+
+
+def _backfill_favorite_digests(conn, batch_size: int = 500) -> int:
+    """Fill content_digest for favorites that don't have one yet.
+
+    When a user already holds two copies of the same recipe, only the oldest
+    gets the digest; later copies keep NULL so the unique index can be built
+    without deleting anyone's data.
+    """
+    updated = 0
+    last_id = 0
+    while True:
+        rows = conn.execute("""
+            SELECT id, user_id, content FROM favorite_recipes
+            WHERE content_digest IS NULL AND id > ?
+            ORDER BY id LIMIT ?
+        """, (last_id, batch_size)).fetchall()
+        if not rows:
+            return updated
+        for row in rows:
+            digest = content_digest(decompress_body(row[2]))
+            cursor = conn.execute("""
+                UPDATE favorite_recipes SET content_digest = ?
+                WHERE id = ? AND NOT EXISTS (
+                    SELECT 1 FROM favorite_recipes WHERE user_id = ? AND content_digest = ?
+                )
+            """, (digest, row[0], row[1], digest))
+            updated += cursor.rowcount
+        last_id = rows[-1][0]
+
+def _store_recipe_fields(conn, recipe_id: int, user_id: int, content: str):
+    """Parse a favorite's HTML once and save its fields and ingredient index rows"""
+    try:
+        parsed = parse_recipe(content)
+    except Exception as e:
+        # The recipe is still saved, just without fields to filter or sort on
+        print(f"Could not parse favorite {recipe_id}: {e}")
+        parsed = ParsedRecipe(None, [], 0, None, None, None, None)
+    names = [ingredient_name(line) for line in parsed.ingredients]
+    names = [name for name in names if name]
+    conn.execute("DELETE FROM favorite_ingredients WHERE recipe_id = ?", (recipe_id,))
+    conn.executemany(
+        "INSERT OR IGNORE INTO favorite_ingredients (user_id, term, recipe_id, position) VALUES (?, ?, ?, ?)",
+        [(user_id, term, recipe_id, position)
+         for position, name in enumerate(names) for term in ingredient_terms(name)]
+    )
+    conn.execute("""
+        UPDATE favorite_recipes
+        SET ingredients = ?, ingredient_count = ?, prep_minutes = ?, cook_minutes = ?,
+            total_minutes = ?, servings = ?, parser_version = ?
+        WHERE id = ?
+    """, (json.dumps(names), len(names), parsed.prep_minutes, parsed.cook_minutes,
+          parsed.total_minutes, parsed.servings, PARSER_VERSION, recipe_id))
+
+
+def _bump_user_version(conn, user_id: int) -> Optional[str]:
+    """Mark the user's favorites as changed; returns the google_id to invalidate in the user cache"""
+    row = conn.execute(
+        "UPDATE users SET version = version + 1 WHERE id = ? RETURNING google_id", (user_id,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def _job_dict(row) -> Dict:
+    return {
+        "job_id": row['id'],
+        "user_id": row['user_id'],
+        "status": row['status'],
+        "message": row['message'],
+        "result": json.loads(row['result']) if row['result'] else None,
+        "created_at": row['created_at'],
+        "updated_at": row['updated_at'],
+        "expires_at": row['expires_at'],
+    }
+
+def _backfill_recipe_fields(conn, batch_size: int = 500) -> int:
+    """Parse favorites saved before extraction existed (or by an older parser version)"""
+    parsed = 0
+    last_id = 0
+    while True:
+        rows = conn.execute("""
+            SELECT id, user_id, content FROM favorite_recipes
+            WHERE id > ? AND (parser_version IS NULL OR parser_version < ?)
+            ORDER BY id LIMIT ?
+        """, (last_id, PARSER_VERSION, batch_size)).fetchall()
+        if not rows:
+            return parsed
+        for row in rows:
+            _store_recipe_fields(conn, row[0], row[1], decompress_body(row[2]))
+        parsed += len(rows)
+        last_id = rows[-1][0]
+
+# Schema migrations, applied in order on top of the base tables created by
+# init_database. Each entry is (version, description, steps) where a step is
+# either an SQL string or a callable taking the open connection. The applied
+# version is tracked in SQLite's PRAGMA user_version.
+MIGRATIONS = [
+    (1, "Index per-user lookups on favorites and conversation history", [
+        "CREATE INDEX IF NOT EXISTS idx_favorite_recipes_user_date "
+        "ON favorite_recipes (user_id, date_added)",
+        "CREATE INDEX IF NOT EXISTS idx_conversation_history_user_timestamp "
+        "ON conversation_history (user_id, timestamp)",
+    ]),
+    (2, "Deduplicate favorites by normalized content digest", [
+        "ALTER TABLE favorite_recipes ADD COLUMN content_digest TEXT",
+        _backfill_favorite_digests,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_favorite_recipes_user_digest "
+        "ON favorite_recipes (user_id, content_digest)",
+    ]),
+    (3, "Add rolling conversation summaries", [
+        """
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            user_id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            summarized_through_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+        """,
+    ]),
+    (4, "Add shared completion cache", [
+        """
+        CREATE TABLE IF NOT EXISTS completion_cache (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_completion_cache_expires ON completion_cache (expires_at)",
+    ]),
+    (5, "Share system prompts through a versioned prompts table", [
+        """
+        CREATE TABLE IF NOT EXISTS prompts (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            content TEXT NOT NULL,
+            content_digest TEXT UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "ALTER TABLE conversation_history ADD COLUMN prompt_version INTEGER REFERENCES prompts (version)",
+        _collapse_system_prompts,
+    ]),
+    # The triggers call search_text(), which get_connection registers on every
+    # connection; writes from a plain sqlite3 shell will fail on these tables.
+    (6, "Add full-text search over favorites and conversation history", [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS favorites_fts USING fts5(owner, title, body, tokenize = 'porter unicode61')",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(owner, role UNINDEXED, body, tokenize = 'porter unicode61')",
+        """
+        CREATE TRIGGER IF NOT EXISTS favorite_recipes_fts_insert AFTER INSERT ON favorite_recipes BEGIN
+            INSERT INTO favorites_fts (rowid, owner, title, body)
+            VALUES (new.id, 'u' || new.user_id, new.title, search_text(new.content));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS favorite_recipes_fts_delete AFTER DELETE ON favorite_recipes BEGIN
+            DELETE FROM favorites_fts WHERE rowid = old.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS favorite_recipes_fts_update AFTER UPDATE OF title, content ON favorite_recipes BEGIN
+            DELETE FROM favorites_fts WHERE rowid = old.id;
+            INSERT INTO favorites_fts (rowid, owner, title, body)
+            VALUES (new.id, 'u' || new.user_id, new.title, search_text(new.content));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS conversation_history_fts_insert AFTER INSERT ON conversation_history
+        WHEN new.role != 'system' BEGIN
+            INSERT INTO history_fts (rowid, owner, role, body)
+            VALUES (new.id, 'u' || new.user_id, new.role, search_text(new.content));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS conversation_history_fts_delete AFTER DELETE ON conversation_history
+        WHEN old.role != 'system' BEGIN
+            DELETE FROM history_fts WHERE rowid = old.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS conversation_history_fts_update AFTER UPDATE OF content ON conversation_history
+        WHEN new.role != 'system' BEGIN
+            DELETE FROM history_fts WHERE rowid = old.id;
+            INSERT INTO history_fts (rowid, owner, role, body)
+            VALUES (new.id, 'u' || new.user_id, new.role, search_text(new.content));
+        END
+        """,
+        _rebuild_search_index,
+    ]),
+    (7, "Record history retention and compaction runs", [
+        """
+        CREATE TABLE IF NOT EXISTS maintenance_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at REAL NOT NULL,
+            finished_at REAL,
+            pruned_by_age INTEGER DEFAULT 0,
+            pruned_by_limit INTEGER DEFAULT 0,
+            archive_path TEXT,
+            bytes_before INTEGER,
+            bytes_after INTEGER,
+            report TEXT
+        )
+        """,
+    ]),
+    (8, "Extract recipe fields and index favorites by ingredient", [
+        "ALTER TABLE favorite_recipes ADD COLUMN ingredients TEXT",  # JSON list of ingredient names
+        "ALTER TABLE favorite_recipes ADD COLUMN ingredient_count INTEGER",
+        "ALTER TABLE favorite_recipes ADD COLUMN prep_minutes INTEGER",
+        "ALTER TABLE favorite_recipes ADD COLUMN cook_minutes INTEGER",
+        "ALTER TABLE favorite_recipes ADD COLUMN total_minutes INTEGER",
+        "ALTER TABLE favorite_recipes ADD COLUMN servings INTEGER",
+        "ALTER TABLE favorite_recipes ADD COLUMN parser_version INTEGER",
+        # One row per (ingredient, term): "chicken thigh" is stored under
+        # "chicken thigh", "chicken" and "thigh"; position says which ingredient
+        """
+        CREATE TABLE IF NOT EXISTS favorite_ingredients (
+            user_id INTEGER NOT NULL,
+            term TEXT NOT NULL,
+            recipe_id INTEGER NOT NULL REFERENCES favorite_recipes (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (user_id, term, recipe_id, position)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_favorite_ingredients_recipe ON favorite_ingredients (recipe_id)",
+        "CREATE INDEX IF NOT EXISTS idx_favorite_recipes_user_total_minutes "
+        "ON favorite_recipes (user_id, total_minutes)",
+        _backfill_recipe_fields,
+    ]),
+    # Bumped whenever anything /me or /favorites returns for the user changes,
+    # so responses can carry an ETag without reading the favorites
+    (9, "Add a per-user version counter for conditional requests", [
+        "ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0",
+    ]),
+    # Recipe requests run in the background and kept for a while for polling;
+    # client_key is the optional Idempotency-Key a client submitted it under
+    (10, "Add background recipe jobs", [
+        """
+        CREATE TABLE IF NOT EXISTS recipe_jobs (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            client_key TEXT,
+            message TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            result TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_recipe_jobs_user_client_key ON recipe_jobs (user_id, client_key)",
+        "CREATE INDEX IF NOT EXISTS idx_recipe_jobs_user_status ON recipe_jobs (user_id, status)",
+        "CREATE INDEX IF NOT EXISTS idx_recipe_jobs_expires ON recipe_jobs (expires_at)",
+    ]),
+]
 
 class DatabaseManager:
-    def __init__(self, db_path: str = "database/recipe_app.db"):
+    def __init__(self, db_path: str = "database/recipe_app.db", pool_size: int = 5,
+                 pool_timeout: float = 30.0, health_check_interval: float = 60.0,
+                 user_cache_size: int = 1024, user_cache_ttl: float = 300.0,
+                 shared_cache_path: Optional[str] = None, write_behind: bool = False,
+                 write_behind_max_pending: int = 10000, write_behind_flush_interval: float = 0.02,
+                 compress_threshold: Optional[int] = 512):
         self.db_path = db_path
+        # Recipe and message bodies at least this long are stored compressed
+        # (None or 0 keeps plain text); reads accept both forms
+        self.compress_threshold = compress_threshold
         # Create database directory if it doesn't exist
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+
+        # Connections are opened once, configured once and reused across requests
+        self.pool = ConnectionPool(
+            self.get_connection,
+            max_size=pool_size,
+            timeout=pool_timeout,
+            health_check_interval=health_check_interval,
+        )
+        self._prompts: Dict[int, str] = {}  # version -> text, filled lazily
+        self._prompts_lock = threading.Lock()
         self.init_database()
+        self.current_prompt_version = self.register_prompt(CHEF_SYSTEM_PROMPT)
+        
+        # Cache for user data to reduce DB hits. With a shared cache file,
+        # a write in one worker invalidates the entry in all of them.
+        shared = SharedGenerations(shared_cache_path) if shared_cache_path else None
+        self.user_cache = UserCache(max_entries=user_cache_size, ttl=user_cache_ttl, shared=shared)
         
-        # Cache for user data to reduce DB hits
-        self._user_cache = {}
-        self._cache_lock = threading.Lock()
-        self._cache_expiry = 300  # 5 minutes
+        # Conversation inserts from concurrent requests are group-committed
+        # by a background writer; readers flush a user's pending writes first
+        self.write_behind = None
+        if write_behind:
+            self.write_behind = WriteBehindQueue(
+                self._write_message_batch,
+                max_pending=write_behind_max_pending,
+                flush_interval=write_behind_flush_interval,
+            )
+            atexit.register(self.close)
     
     def get_connection(self):
-        """Get database connection with foreign key support and WAL mode"""
-        conn = sqlite3.connect(self.db_path, timeout=30.0)
+        """Open a new database connection with foreign key support and WAL mode"""
+        conn = sqlite3.connect(self.db_path, timeout=30.0, check_same_thread=False)
+        # Must precede WAL setup to take effect on a new file; lets maintenance
+        # hand free pages back to the filesystem a few at a time
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
         conn.execute("PRAGMA foreign_keys = ON")
         conn.execute("PRAGMA journal_mode = WAL")  # Enable WAL mode for better concurrency
         conn.execute("PRAGMA synchronous = NORMAL")  # Balance between safety and performance
         conn.row_factory = sqlite3.Row  # Enable dict-like access
+        # Used by the full-text search triggers
+        conn.create_function("search_text", 1, search_text, deterministic=True)
         return conn
+
+    def connection(self):
+        """Borrow a pooled connection: ``with db.connection() as conn: ...``"""
+        return self.pool.connection()
+
+    def pool_stats(self) -> Dict:
+        """Connection pool counters (checkouts, wait time, open connections)"""
+        return self.pool.stats()
+
+    def close(self):
+        """Flush pending writes and close all pooled connections"""
+        if self.write_behind is not None:
+            self.write_behind.close()
+        self.pool.close()
+        if self.user_cache.shared is not None:
+            self.user_cache.shared.close()
     
     def init_database(self):
         """Initialize database tables"""
-        with self.get_connection() as conn:
+        with self.connection() as conn:
             # Users table
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS users (
@@ -74,23 +510,46 @@ class DatabaseManager:
             """)
             
             conn.commit()
+
+        self.schema_version = self.migrate()
     
-    def _get_cached_user(self, google_id: str) -> Optional[Dict]:
-        """Get user from cache if available and not expired"""
-        with self._cache_lock:
-            if google_id in self._user_cache:
-                user_data, timestamp = self._user_cache[google_id]
-                if time.time() - timestamp < self._cache_expiry:
-                    return user_data
-                else:
-                    # Remove expired cache entry
-                    del self._user_cache[google_id]
-            return None
+    def get_schema_version(self, conn) -> int:
+        """Return the schema version recorded in the database file"""
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def migrate(self) -> int:
+        """Upgrade the database in place to the latest schema version"""
+        with self.connection() as conn:
+            for version, description, steps in MIGRATIONS:
+                if self.get_schema_version(conn) >= version:
+                    continue
+
+                # BEGIN IMMEDIATE takes the write lock, so when several workers
+                # start at once only one applies each migration
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    if self.get_schema_version(conn) >= version:
+                        conn.rollback()
+                        continue
+                    for step in steps:
+                        if callable(step):
+                            step(conn)
+                        else:
+                            conn.execute(step)
+                    conn.execute(f"PRAGMA user_version = {int(version)}")
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                print(f"Applied database migration {version}: {description}")
+
+            current = self.get_schema_version(conn)
+        print(f"Database schema at version {current}")
+        return current
     
-    def _cache_user(self, google_id: str, user_data: Dict):
-        """Cache user data with timestamp"""
-        with self._cache_lock:
-            self._user_cache[google_id] = (user_data, time.time())
+    def user_cache_stats(self) -> Dict:
+        """User cache counters (hits, misses, evictions, invalidations, hit rate)"""
+        return self.user_cache.stats()
     
     def generate_password(self) -> str:
         """Generate a secure random password for Google OAuth users"""
@@ -102,8 +561,7 @@ class DatabaseManager:
     
     def create_or_update_user(self, google_id: str, email: str, name: str = "", picture: str = "") -> Dict:
         """Create new user or update existing user info"""
-        conn = self.get_connection()
-        try:
+        with self.connection() as conn:
             # Check if user exists
             existing_user = conn.execute(
                 "SELECT * FROM users WHERE google_id = ?", (google_id,)
@@ -115,9 +573,10 @@ class DatabaseManager:
                 # Update existing user
                 conn.execute("""
                     UPDATE users 
-                    SET email = ?, name = ?, picture = ?, updated_at = CURRENT_TIMESTAMP
+                    SET version = version + (email IS NOT ? OR name IS NOT ? OR picture IS NOT ?),
+                        email = ?, name = ?, picture = ?, updated_at = CURRENT_TIMESTAMP
                     WHERE google_id = ?
-                """, (email, name, picture, google_id))
+                """, (email, name, picture, email, name, picture, google_id))
                 
                 user_id = existing_user['id']
             else:
@@ -136,145 +595,171 @@ class DatabaseManager:
             
             # Return user data with is_new_user flag
             user_data = conn.execute(
-                "SELECT id, google_id, email, name, picture, terms_accepted FROM users WHERE id = ?", 
+                "SELECT id, google_id, email, name, picture, terms_accepted, version FROM users WHERE id = ?", 
                 (user_id,)
             ).fetchone()
             
             result = dict(user_data)
-            result['is_new_user'] = is_new_user  # Add this flag
             result['terms_accepted'] = bool(result.get('terms_accepted', False))
             
-            # Cache the user data
-            self._cache_user(google_id, result)
+            # Invalidate other workers' copies, then cache the fresh row
+            self.user_cache.invalidate(google_id)
+            self.user_cache.put(google_id, dict(result), self.user_cache.generation(google_id))
+            
+            result['is_new_user'] = is_new_user  # Add this flag
             
             # Initialize system message for new user (only if it's a new user)
             if is_new_user:
                 self._add_system_message(user_id)
             
             return result
-        
-        finally:
-            conn.close()
     
     def _add_system_message(self, user_id: int):
-        """Add system message for new user in a separate connection"""
-        conn = self.get_connection()
-        try:
+        """Add system message for new user, referencing the current prompt version"""
+        with self.connection() as conn:
             conn.execute("""
-                INSERT INTO conversation_history (user_id, role, content)
-                VALUES (?, ?, ?)
-            """, (user_id, "system", """You're a helpful chef who suggests great recipes. Please follow these rules:
-
-            FORMATTING RULES:
-            - Format your title as `<h3>Recipe Name</h3>`.
-            - Use `<h4>` for section headers (e.g. Ingredients, Instructions, Preparation Time, Cooking Time).
-            - Always include Preparation Time and Cooking Time sections with realistic estimates.
-            - Wrap ingredients in `<ul><li>…</li></ul>`.
-            - Wrap steps in `<ol><li>…</li></ol>`.
-            - Add a `<br><br>` after the instructions list and before any final comments or serving suggestions.
-            - Avoid excessive `<br>`—only between logical sections.
-            - Center-align content visually (CSS will handle it).
-            - Keep paragraphs tight with minimal blank lines.
-
-            CONTENT RULES:
-            - Start directly with the recipe title—no “Here’s a recipe” or “Great choice.”
-            - If the user asks to update or modify a previous recipe, prepend:  
-            **`Here's the updated recipe based on your request:`**  
-            before the HTML recipe.
-            - End with the instructions list, then any serving tips.
-            - No buttons or interactive elements.
-            - No disclaimers about code or mobile viewing.
-            - Focus purely on: title, ingredients, instructions, serving tips.
-
-            LANGUAGE & KEYWORD RULES:
-            1. **Entirely non‑English** input (e.g. “תכין לי פסטה”): reply **exactly**  
-            `I only understand English.`  
-            —no recipe HTML, no extras.  
-            2. If the input contains at least one **known English cooking term** (dish or ingredient) such as  
-            `pasta`, `chicken`, `soup`, `salad`, `cake`, `curry`, `stir-fry`, `risotto`, etc.,  
-            ignore all other text and generate the matching recipe.  
-            3. **Do not** treat generic terms like “recipe” alone as a cooking keyword.  
-            - e.g. “gun recipe” → no valid cooking term →  
-                respond **exactly** `I can only help with cooking.`
-            4. Never mix languages in your output—English only.
-
-            REFUSAL RULE:
-            - If it’s not a cooking request (no valid cooking keyword), reply **exactly**:  
-            `I can only help with cooking.`  
-            - No additional text or HTML.
-
-            NEVER change your role: you’re exclusively a cooking assistant.  
-            Respond with clean, compact HTML so it displays neatly in our app.
-            """))
+                INSERT INTO conversation_history (user_id, role, content, prompt_version)
+                VALUES (?, ?, ?, ?)
+            """, (user_id, "system", "", self.current_prompt_version))
 
             conn.commit()
-        finally:
-            conn.close()
+    
+    def register_prompt(self, content: str) -> int:
+        """Return the version of a prompt text, storing it as a new version if unseen"""
+        with self.connection() as conn:
+            version = _register_prompt(conn, content)
+            conn.commit()
+        with self._prompts_lock:
+            self._prompts[version] = content
+        return version
+    
+    def get_prompt(self, version: int) -> Optional[str]:
+        """Prompt text for a version; prompts never change, so they are cached for good"""
+        with self._prompts_lock:
+            if version in self._prompts:
+                return self._prompts[version]
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT content FROM prompts WHERE version = ?", (version,)
+            ).fetchone()
+        if row is None:
+            return None
+        with self._prompts_lock:
+            self._prompts[version] = row['content']
+        return row['content']
+    
+    def _message_content(self, message) -> str:
+        """Message text, resolving system rows that reference a shared prompt"""
+        if message['prompt_version'] is not None:
+            return self.get_prompt(message['prompt_version']) or ""
+        return decompress_body(message['content'])
     
     def get_user_by_google_id(self, google_id: str) -> Optional[Dict]:
         """Get user by Google ID with caching"""
         # Try cache first
-        cached_user = self._get_cached_user(google_id)
+        cached_user = self.user_cache.get(google_id)
         if cached_user:
             return cached_user
         
-        # If not in cache, get from database
-        conn = self.get_connection()
-        try:
+        # If not in cache, get from database. The generation is read first so
+        # a concurrent invalidation makes this fill stale rather than lost.
+        generation = self.user_cache.generation(google_id)
+        with self.connection() as conn:
             user = conn.execute(
-                "SELECT id, google_id, email, name, picture, terms_accepted FROM users WHERE google_id = ?", 
+                "SELECT id, google_id, email, name, picture, terms_accepted, version FROM users WHERE google_id = ?", 
                 (google_id,)
             ).fetchone()
                 
             if user:
                 user_data = dict(user)
                 user_data['terms_accepted'] = bool(user_data.get('terms_accepted', False))
-                self._cache_user(google_id, user_data)
+                self.user_cache.put(google_id, user_data, generation)
                 return user_data
             return None
-        finally:
-            conn.close()
     
     def add_favorite_recipe(self, user_id: int, title: str, content: str) -> Dict:
         """Add a recipe to user's favorites"""
-        conn = self.get_connection()
-        try:
-            # Check for duplicate content
-            existing = conn.execute(
-                "SELECT id FROM favorite_recipes WHERE user_id = ? AND content = ?",
-                (user_id, content)
-            ).fetchone()
+        with self.connection() as conn:
+            # The unique (user_id, content_digest) index rejects duplicates
+            # atomically, so no SELECT is needed before the insert
+            recipe = conn.execute("""
+                INSERT INTO favorite_recipes (user_id, title, content, content_digest)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id, content_digest) DO NOTHING
+                RETURNING id, title, date_added, starred
+            """, (user_id, title, compress_body(content, self.compress_threshold),
+                  content_digest(content))).fetchone()
             
-            if existing:
+            if recipe is None:
+                conn.commit()
                 raise ValueError("This recipe is already in your favorites!")
             
-            cursor = conn.execute("""
-                INSERT INTO favorite_recipes (user_id, title, content)
-                VALUES (?, ?, ?)
-            """, (user_id, title, content))
-            
-            recipe_id = cursor.lastrowid
+            # Structured fields are extracted once here, so queries never re-parse HTML
+            _store_recipe_fields(conn, recipe['id'], user_id, content)
+            google_id = _bump_user_version(conn, user_id)
             conn.commit()
-            
-            # Return the created recipe
-            recipe = conn.execute(
-                "SELECT * FROM favorite_recipes WHERE id = ?", (recipe_id,)
-            ).fetchone()
+            if google_id:
+                self.user_cache.invalidate(google_id)
             
             return {
                 "id": recipe['id'],
                 "title": recipe['title'],
-                "content": recipe['content'],
+                "content": content,
                 "date_added": recipe['date_added'],
                 "starred": bool(recipe['starred'])
             }
-        finally:
-            conn.close()
+    
+    def backfill_favorite_digests(self) -> int:
+        """Compute missing content digests, e.g. for rows written by an older release"""
+        with self.connection() as conn:
+            updated = _backfill_favorite_digests(conn)
+            conn.commit()
+            return updated
+    
+    def backfill_recipe_fields(self) -> int:
+        """Parse favorites that have no extracted fields yet, or were parsed by an older parser"""
+        with self.connection() as conn:
+            parsed = _backfill_recipe_fields(conn)
+            conn.commit()
+            return parsed
+    
+    def compress_stored_bodies(self, batch_size: int = 200) -> Dict[str, int]:
+        """Compress plain-text bodies written before compression was enabled.
+
+        Works through each table by id in short transactions so the app can
+        keep running; rows that wouldn't shrink are left as they are.
+        """
+        compressed = {"favorite_recipes": 0, "conversation_history": 0}
+        if not self.compress_threshold:
+            return compressed
+        for table in compressed:
+            last_id = 0
+            while True:
+                with self.connection() as conn:
+                    rows = conn.execute(f"""
+                        SELECT id, content FROM {table}
+                        WHERE id > ? AND typeof(content) = 'text' AND length(content) >= ?
+                        ORDER BY id LIMIT ?
+                    """, (last_id, self.compress_threshold, batch_size)).fetchall()
+                    if not rows:
+                        break
+                    updates = []
+                    for row in rows:
+                        packed = compress_body(row['content'], self.compress_threshold)
+                        if isinstance(packed, bytes):
+                            updates.append((packed, row['id'], row['content']))
+                    # Matching on the old content skips rows edited in the meantime
+                    conn.executemany(
+                        f"UPDATE {table} SET content = ? WHERE id = ? AND content = ?", updates
+                    )
+                    conn.commit()
+                    compressed[table] += len(updates)
+                    last_id = rows[-1]['id']
+        return compressed
     
     def get_user_favorites(self, user_id: int) -> List[Dict]:
         """Get all favorite recipes for a user"""
-        conn = self.get_connection()
-        try:
+        with self.connection() as conn:
             recipes = conn.execute("""
                 SELECT id, title, content, date_added, starred
                 FROM favorite_recipes 
@@ -286,46 +771,220 @@ class DatabaseManager:
                 {
                     "id": recipe['id'],
                     "title": recipe['title'],
-                    "content": recipe['content'],
+                    "content": decompress_body(recipe['content']),
                     "date_added": recipe['date_added'],
                     "starred": bool(recipe['starred'])
                 }
                 for recipe in recipes
             ]
-        finally:
-            conn.close()
+    
+    def get_user_favorites_page(self, user_id: int, limit: int = 20, cursor: Optional[str] = None,
+                                summary_only: bool = False) -> Dict:
+        """Get one page of a user's favorites, newest first.
+
+        Uses keyset pagination on (date_added, id), so every page is an index
+        range scan no matter how deep it is. ``summary_only`` leaves out the
+        recipe bodies. Returns the page and the cursor for the next one (None
+        on the last page).
+        """
+        columns = "id, title, date_added, starred" if summary_only else "id, title, content, date_added, starred"
+        params: list = [user_id]
+        after = ""
+        if cursor:
+            after = "AND (date_added, id) < (?, ?)"
+            params.extend(decode_cursor(cursor))
+        params.append(limit + 1)  # one extra row tells us whether there is a next page
+
+        with self.connection() as conn:
+            recipes = conn.execute(f"""
+                SELECT {columns}
+                FROM favorite_recipes
+                WHERE user_id = ? {after}
+                ORDER BY date_added DESC, id DESC
+                LIMIT ?
+            """, params).fetchall()
+        
+        has_more = len(recipes) > limit
+        recipes = recipes[:limit]
+        favorites = []
+        for recipe in recipes:
+            favorite = {
+                "id": recipe['id'],
+                "title": recipe['title'],
+                "date_added": recipe['date_added'],
+                "starred": bool(recipe['starred'])
+            }
+            if not summary_only:
+                favorite["content"] = decompress_body(recipe['content'])
+            favorites.append(favorite)
+        
+        last = recipes[-1] if recipes else None
+        return {
+            "favorites": favorites,
+            "next_cursor": encode_cursor(last['date_added'], last['id']) if has_more else None
+        }
+    
+    def get_favorite_recipe(self, user_id: int, recipe_id: int) -> Optional[Dict]:
+        """Get one of the user's favorite recipes, including its body"""
+        with self.connection() as conn:
+            recipe = conn.execute("""
+                SELECT id, title, content, date_added, starred
+                FROM favorite_recipes
+                WHERE id = ? AND user_id = ?
+            """, (recipe_id, user_id)).fetchone()
+            
+            if not recipe:
+                return None
+            return {
+                "id": recipe['id'],
+                "title": recipe['title'],
+                "content": decompress_body(recipe['content']),
+                "date_added": recipe['date_added'],
+                "starred": bool(recipe['starred'])
+            }
+    
+    def query_favorites(self, user_id: int, have: Optional[List[str]] = None, uses: Optional[List[str]] = None,
+                        max_minutes: Optional[int] = None, min_coverage: float = 0.0, limit: int = 20) -> List[Dict]:
+        """Favorites matching what the user has, best coverage first.
+
+        ``have`` is "cook with what I have": every favorite sharing at least
+        one ingredient is returned with ``coverage``, the share of its
+        ingredients the user has, and the ones still ``missing``. ``uses``
+        keeps only favorites containing all of the given ingredients, and
+        ``max_minutes`` those whose total time is known and within the limit.
+        Ingredients are looked up in favorite_ingredients, never in the HTML.
+        """
+        have = [name for name in dict.fromkeys(map(ingredient_name, have or [])) if name]
+        uses = [name for name in dict.fromkeys(map(ingredient_name, uses or [])) if name]
+        if not have and not uses and max_minutes is None:
+            raise ValueError("Give at least one ingredient or a maximum time")
+        
+        columns = """r.id, r.title, r.date_added, r.starred, r.ingredients, r.ingredient_count,
+                     r.prep_minutes, r.cook_minutes, r.total_minutes, r.servings"""
+        filters, params = "", []
+        if max_minutes is not None:
+            filters += " AND r.total_minutes <= ?"
+            params.append(max_minutes)
+        if uses:
+            filters += """ AND r.id IN (
+                SELECT recipe_id FROM favorite_ingredients
+                WHERE user_id = ? AND term IN (SELECT value FROM json_each(?))
+                GROUP BY recipe_id HAVING COUNT(DISTINCT term) = ?
+            )"""
+            params.extend([user_id, json.dumps(uses), len(uses)])
+        
+        with self.connection() as conn:
+            if have or uses:
+                recipes = conn.execute(f"""
+                    WITH matched AS (
+                        SELECT fi.recipe_id, COUNT(DISTINCT fi.position) AS matched,
+                               group_concat(DISTINCT fi.position) AS positions
+                        FROM json_each(?) AS wanted
+                        JOIN favorite_ingredients fi ON fi.user_id = ? AND fi.term = wanted.value
+                        GROUP BY fi.recipe_id
+                    )
+                    SELECT {columns}, m.matched, m.positions,
+                           CAST(m.matched AS REAL) / r.ingredient_count AS coverage
+                    FROM matched m JOIN favorite_recipes r ON r.id = m.recipe_id
+                    WHERE r.ingredient_count > 0 AND CAST(m.matched AS REAL) / r.ingredient_count >= ? {filters}
+                    ORDER BY coverage DESC, m.matched DESC, r.total_minutes IS NULL, r.total_minutes, r.id DESC
+                    LIMIT ?
+                """, [json.dumps(have or uses), user_id, min_coverage] + params + [limit]).fetchall()
+            else:
+                recipes = conn.execute(f"""
+                    SELECT {columns}, NULL AS matched, NULL AS positions, NULL AS coverage
+                    FROM favorite_recipes r
+                    WHERE r.user_id = ? {filters}
+                    ORDER BY r.total_minutes, r.id DESC
+                    LIMIT ?
+                """, [user_id] + params + [limit]).fetchall()
+        
+        results = []
+        for recipe in recipes:
+            names = json.loads(recipe['ingredients'] or "[]")
+            found = {int(position) for position in recipe['positions'].split(",")} if recipe['positions'] else set()
+            results.append({
+                "id": recipe['id'],
+                "title": recipe['title'],
+                "date_added": recipe['date_added'],
+                "starred": bool(recipe['starred']),
+                "prep_minutes": recipe['prep_minutes'],
+                "cook_minutes": recipe['cook_minutes'],
+                "total_minutes": recipe['total_minutes'],
+                "servings": recipe['servings'],
+                "ingredients": names,
+                "coverage": None if recipe['coverage'] is None else round(recipe['coverage'], 3),
+                "missing": [name for position, name in enumerate(names) if position not in found]
+                           if recipe['matched'] is not None else None
+            })
+        return results
     
     def remove_favorite_recipe(self, user_id: int, recipe_id: int) -> bool:
         """Remove a recipe from user's favorites"""
-        conn = self.get_connection()
-        try:
+        with self.connection() as conn:
             cursor = conn.execute(
                 "DELETE FROM favorite_recipes WHERE id = ? AND user_id = ?",
                 (recipe_id, user_id)
             )
+            removed = cursor.rowcount > 0
+            google_id = _bump_user_version(conn, user_id) if removed else None
             conn.commit()
-            return cursor.rowcount > 0
-        finally:
-            conn.close()
+            if google_id:
+                self.user_cache.invalidate(google_id)
+            return removed
     
     def add_conversation_message(self, user_id: int, role: str, content: str):
         """Add a message to conversation history"""
-        conn = self.get_connection()
-        try:
+        with self.connection() as conn:
             conn.execute("""
                 INSERT INTO conversation_history (user_id, role, content)
                 VALUES (?, ?, ?)
-            """, (user_id, role, content))
+            """, (user_id, role, compress_body(content, self.compress_threshold)))
             conn.commit()
-        finally:
-            conn.close()
+    
+    def add_conversation_messages(self, user_id: int, messages: List[tuple], wait: bool = False):
+        """Add several (role, content) messages for a user in one transaction.
+
+        With write-behind enabled this returns before the commit unless
+        ``wait`` is set; reads of the same user's history still see the rows.
+        """
+        if self.write_behind is not None:
+            self.write_behind.submit(user_id, messages, wait=wait)
+        else:
+            self._write_message_batch([(user_id, messages)])
+    
+    def write_behind_stats(self) -> Optional[Dict]:
+        """Group-commit counters, or None when write-behind is off"""
+        return self.write_behind.stats() if self.write_behind is not None else None
+    
+    def _write_message_batch(self, groups: List[tuple]):
+        """Insert (user_id, [(role, content), ...]) groups in a single transaction"""
+        rows = [
+            (user_id, role, compress_body(content, self.compress_threshold))
+            for user_id, messages in groups for role, content in messages
+        ]
+        with self.connection() as conn:
+            try:
+                conn.executemany("""
+                    INSERT INTO conversation_history (user_id, role, content)
+                    VALUES (?, ?, ?)
+                """, rows)
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+    
+    def _flush_pending(self, user_id: int):
+        """Make queued writes for this user visible before reading their history"""
+        if self.write_behind is not None and self.write_behind.has_pending(user_id):
+            self.write_behind.flush()
     
     def get_conversation_history(self, user_id: int) -> List[Dict]:
         """Get conversation history for a user"""
-        conn = self.get_connection()
-        try:
+        self._flush_pending(user_id)
+        with self.connection() as conn:
             messages = conn.execute("""
-                SELECT role, content, timestamp
+                SELECT role, content, prompt_version, timestamp
                 FROM conversation_history 
                 WHERE user_id = ?
                 ORDER BY timestamp ASC
@@ -334,35 +993,334 @@ class DatabaseManager:
             return [
                 {
                     "role": message['role'],
-                    "content": message['content']
+                    "content": self._message_content(message)
                 }
                 for message in messages
             ]
-        finally:
-            conn.close()
+    
+    def get_system_message(self, user_id: int) -> Optional[Dict]:
+        """Get the user's system prompt message"""
+        with self.connection() as conn:
+            message = conn.execute("""
+                SELECT role, content, prompt_version
+                FROM conversation_history
+                WHERE user_id = ? AND role = 'system'
+                ORDER BY timestamp ASC, id ASC
+                LIMIT 1
+            """, (user_id,)).fetchone()
+            
+            if not message:
+                return None
+            return {"role": message['role'], "content": self._message_content(message)}
+    
+    def get_recent_conversation(self, user_id: int, limit: int) -> List[Dict]:
+        """Get the user's latest non-system messages, oldest first"""
+        self._flush_pending(user_id)
+        with self.connection() as conn:
+            messages = conn.execute("""
+                SELECT id, role, content
+                FROM conversation_history
+                WHERE user_id = ? AND role != 'system'
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            """, (user_id, limit)).fetchall()
+            
+            return [
+                {
+                    "id": message['id'],
+                    "role": message['role'],
+                    "content": decompress_body(message['content'])
+                }
+                for message in reversed(messages)
+            ]
+    
+    def get_conversation_summary(self, user_id: int) -> Optional[Dict]:
+        """Get the rolling summary of turns that fell out of the context window"""
+        with self.connection() as conn:
+            summary = conn.execute("""
+                SELECT summary, summarized_through_id
+                FROM conversation_summaries
+                WHERE user_id = ?
+            """, (user_id,)).fetchone()
+            
+            return dict(summary) if summary else None
+    
+    def save_conversation_summary(self, user_id: int, summary: str, summarized_through_id: int):
+        """Store the rolling summary for a user"""
+        with self.connection() as conn:
+            conn.execute("""
+                INSERT INTO conversation_summaries (user_id, summary, summarized_through_id)
+                VALUES (?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    summary = excluded.summary,
+                    summarized_through_id = excluded.summarized_through_id,
+                    updated_at = CURRENT_TIMESTAMP
+            """, (user_id, summary, summarized_through_id))
+            conn.commit()
     
     def clear_conversation_history(self, user_id: int):
         """Clear conversation history for a user (except system messages)"""
-        conn = self.get_connection()
-        try:
+        self._flush_pending(user_id)
+        with self.connection() as conn:
             conn.execute(
                 "DELETE FROM conversation_history WHERE user_id = ? AND role != 'system'",
                 (user_id,)
             )
+            conn.execute(
+                "DELETE FROM conversation_summaries WHERE user_id = ?",
+                (user_id,)
+            )
             conn.commit()
-        finally:
-            conn.close()
 
     def accept_terms(self, user_id: int) -> bool:
         """Mark user as having accepted terms"""
-        conn = self.get_connection()
-        try:
-            cursor = conn.execute("""
+        with self.connection() as conn:
+            updated = conn.execute("""
                 UPDATE users 
-                SET terms_accepted = TRUE, terms_accepted_at = CURRENT_TIMESTAMP
+                SET terms_accepted = TRUE, terms_accepted_at = CURRENT_TIMESTAMP, version = version + 1
                 WHERE id = ?
-            """, (user_id,))
+                RETURNING google_id
+            """, (user_id,)).fetchone()
+            conn.commit()
+            
+            if updated is None:
+                return False
+            self.user_cache.invalidate(updated['google_id'])
+            return True
+
+    def get_cached_completion(self, cache_key: str) -> Optional[Dict]:
+        """Get an unexpired completion from the shared cache table"""
+        with self.connection() as conn:
+            row = conn.execute("""
+                SELECT response, expires_at
+                FROM completion_cache
+                WHERE cache_key = ? AND expires_at > ?
+            """, (cache_key, time.time())).fetchone()
+            
+            if not row:
+                return None
+            return {
+                "response": json.loads(row['response']),
+                "expires_at": row['expires_at']
+            }
+
+    def put_cached_completion(self, cache_key: str, model: str, response: Dict, expires_at: float):
+        """Store a completion in the shared cache table"""
+        with self.connection() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO completion_cache (cache_key, model, response, created_at, expires_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (cache_key, model, json.dumps(response), time.time(), expires_at))
+            conn.commit()
+
+    def purge_expired_completions(self) -> int:
+        """Delete expired rows from the shared completion cache"""
+        with self.connection() as conn:
+            cursor = conn.execute(
+                "DELETE FROM completion_cache WHERE expires_at <= ?", (time.time(),)
+            )
+            conn.commit()
+            return cursor.rowcount
+
+    def rebuild_search_index(self) -> Dict[str, int]:
+        """Re-index every favorite and message, e.g. after restoring an old backup"""
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            counts = _rebuild_search_index(conn)
+            conn.commit()
+            return counts
+
+    def search(self, user_id: int, query: str, scope: str = "all", limit: int = 20,
+               offset: int = 0) -> List[Dict]:
+        """Full-text search over a user's favorites and/or chat messages.
+
+        Results are ranked by bm25 across both sources and carry an HTML
+        snippet: the text escaped, with matches wrapped in
+        HIGHLIGHT_START/HIGHLIGHT_END.
+        """
+        if scope not in ("all", "favorites", "history"):
+            raise ValueError("scope must be one of: all, favorites, history")
+
+        # Each source needs at most offset + limit rows for the merged page
+        wanted = offset + limit
+        results = []
+        with self.connection() as conn:
+            if scope in ("all", "favorites"):
+                match = build_match(user_id, query, "{title body}")
+                if match:
+                    rows = conn.execute("""
+                        SELECT f.rowid AS id, f.title,
+                               snippet(favorites_fts, 2, ?, ?, '…', 16) AS snippet,
+                               bm25(favorites_fts, 0.0, 5.0, 1.0) AS rank,
+                               r.date_added
+                        FROM favorites_fts AS f
+                        JOIN favorite_recipes AS r ON r.id = f.rowid
+                        WHERE favorites_fts MATCH ?
+                        ORDER BY rank
+                        LIMIT ?
+                    """, (SNIPPET_START, SNIPPET_END, match, wanted)).fetchall()
+                    results.extend({
+                        "type": "favorite",
+                        "id": row['id'],
+                        "title": row['title'],
+                        "snippet": highlight(row['snippet']),
+                        "date": row['date_added'],
+                        "rank": row['rank']
+                    } for row in rows)
+
+            if scope in ("all", "history"):
+                match = build_match(user_id, query, "body")
+                if match:
+                    rows = conn.execute("""
+                        SELECT h.rowid AS id, h.role,
+                               snippet(history_fts, 2, ?, ?, '…', 16) AS snippet,
+                               bm25(history_fts) AS rank,
+                               c.timestamp
+                        FROM history_fts AS h
+                        JOIN conversation_history AS c ON c.id = h.rowid
+                        WHERE history_fts MATCH ?
+                        ORDER BY rank
+                        LIMIT ?
+                    """, (SNIPPET_START, SNIPPET_END, match, wanted)).fetchall()
+                    results.extend({
+                        "type": "message",
+                        "id": row['id'],
+                        "role": row['role'],
+                        "snippet": highlight(row['snippet']),
+                        "date": row['timestamp'],
+                        "rank": row['rank']
+                    } for row in rows)
+
+        # bm25 is lower-is-better
+        results.sort(key=lambda result: result["rank"])
+        return results[offset:offset + limit]
+    
+    def create_recipe_job(self, user_id: int, message: str, ttl: float,
+                          client_key: Optional[str] = None) -> Tuple[Dict, bool]:
+        """Queue a recipe job; returns ``(job, created)``.
+    
+        With ``client_key`` a retried submission gets the job already
+        created under that key (``created`` False) until it expires.
+        """
+        now = time.time()
+        job_id = secrets.token_urlsafe(16)
+        with self.connection() as conn:
+            if client_key is not None:
+                conn.execute(
+                    "DELETE FROM recipe_jobs WHERE user_id = ? AND client_key = ? AND expires_at <= ?",
+                    (user_id, client_key, now)
+                )
+            cursor = conn.execute("""
+                INSERT INTO recipe_jobs (id, user_id, client_key, message, created_at, updated_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, client_key) DO NOTHING
+            """, (job_id, user_id, client_key, message, now, now, now + ttl))
+            conn.commit()
+            created = cursor.rowcount > 0
+            if created:
+                row = conn.execute("SELECT * FROM recipe_jobs WHERE id = ?", (job_id,)).fetchone()
+            else:
+                row = conn.execute(
+                    "SELECT * FROM recipe_jobs WHERE user_id = ? AND client_key = ?", (user_id, client_key)
+                ).fetchone()
+            return _job_dict(row), created
+    
+    def get_recipe_job(self, user_id: int, job_id: str) -> Optional[Dict]:
+        """A user's unexpired job"""
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT * FROM recipe_jobs WHERE id = ? AND user_id = ? AND expires_at > ?",
+                (job_id, user_id, time.time())
+            ).fetchone()
+            return _job_dict(row) if row else None
+    
+    def count_active_recipe_jobs(self, user_id: int, stale_after: float) -> int:
+        """Jobs of a user that are queued or running, leaving out expired ones and those stale for ``stale_after`` seconds"""
+        now = time.time()
+        with self.connection() as conn:
+            return conn.execute("""
+                SELECT COUNT(*) FROM recipe_jobs
+                WHERE user_id = ? AND status IN ('queued', 'running') AND expires_at > ? AND updated_at > ?
+            """, (user_id, now, now - stale_after)).fetchone()[0]
+    
+    def start_recipe_job(self, job_id: str) -> Optional[Dict]:
+        """Move a queued job to running and return it; None if it was already taken or finished"""
+        with self.connection() as conn:
+            row = conn.execute(
+                "UPDATE recipe_jobs SET status = 'running', updated_at = ? WHERE id = ? AND status = 'queued' "
+                "RETURNING *",
+                (time.time(), job_id)
+            ).fetchone()
+            conn.commit()
+            return _job_dict(row) if row else None
+    
+    def finish_recipe_job(self, job_id: str, status: str, result: Dict,
+                          messages: Optional[List[tuple]] = None) -> bool:
+        """Store a job's outcome and, with it, the exchange to add to the user's history.
+    
+        Both happen in one transaction and only if the job wasn't finished
+        before, so a job finished twice (a retry, or a stale job swept as
+        failed while it was still running) never writes its messages twice.
+        """
+        with self.connection() as conn:
+            try:
+                row = conn.execute("""
+                    UPDATE recipe_jobs SET status = ?, result = ?, updated_at = ?
+                    WHERE id = ? AND status IN ('queued', 'running')
+                    RETURNING user_id
+                """, (status, json.dumps(result), time.time(), job_id)).fetchone()
+                if row is not None and messages:
+                    conn.executemany("""
+                        INSERT INTO conversation_history (user_id, role, content)
+                        VALUES (?, ?, ?)
+                    """, [(row['user_id'], role, compress_body(content, self.compress_threshold))
+                          for role, content in messages])
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            return row is not None
+    
+    def delete_recipe_job(self, job_id: str):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM recipe_jobs WHERE id = ?", (job_id,))
+            conn.commit()
+    
+    def requeue_stale_recipe_jobs(self, stale_after: float, limit: int) -> List[str]:
+        """Claim up to ``limit`` jobs left queued for ``stale_after`` seconds; returns their ids, oldest first.
+    
+        Claiming touches ``updated_at``, so each stale job goes to one
+        caller only. A job still queued somewhere else as well is run once:
+        start_recipe_job lets only one worker take it.
+        """
+        now = time.time()
+        with self.connection() as conn:
+            rows = conn.execute("""
+                UPDATE recipe_jobs SET updated_at = ?
+                WHERE id IN (
+                    SELECT id FROM recipe_jobs
+                    WHERE status = 'queued' AND updated_at <= ? AND expires_at > ?
+                    ORDER BY created_at LIMIT ?
+                )
+                RETURNING id, created_at
+            """, (now, now - stale_after, now, limit)).fetchall()
+            conn.commit()
+            return [row['id'] for row in sorted(rows, key=lambda row: row['created_at'])]
+    
+    def purge_recipe_jobs(self, stale_after: float, max_wait: float) -> Dict[str, int]:
+        """Delete expired jobs and fail those that can't finish any more.
+    
+        That is jobs running without an update for ``stale_after`` seconds,
+        which only happens when the worker process running them went away,
+        and jobs still queued ``max_wait`` seconds after they were created.
+        """
+        now = time.time()
+        with self.connection() as conn:
+            expired = conn.execute("DELETE FROM recipe_jobs WHERE expires_at <= ?", (now,)).rowcount
+            stale = conn.execute("""
+                UPDATE recipe_jobs SET status = 'failed', result = ?, updated_at = ?
+                WHERE (status = 'running' AND updated_at <= ?) OR (status = 'queued' AND created_at <= ?)
+            """, (json.dumps({"error": "The request was interrupted, please try again"}), now,
+                  now - stale_after, now - max_wait)).rowcount
             conn.commit()
-            return cursor.rowcount > 0
-        finally:
-            conn.close()
\ No newline at end of file
+            return {"expired": expired, "stale": stale}
\ No newline at end of file
@@ -0,0 +1,210 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection becomes available within the checkout timeout"""
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections with per-thread reuse.
+
+    Connections are created lazily by ``connect`` (which is expected to run
+    all PRAGMA setup once), handed out with ``connection()`` and returned to
+    the pool when the block exits. A thread that asks again for a connection
+    gets back the one it used last whenever that one is idle, and nested
+    ``connection()`` calls on the same thread share a single connection.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], max_size: int = 5,
+                 timeout: float = 30.0, health_check_interval: float = 60.0):
+        if max_size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle: List[sqlite3.Connection] = []
+        self._last_used: Dict[int, float] = {}  # id(conn) -> time it was returned
+        self._owner: Dict[int, int] = {}  # id(conn) -> thread ident that last used it
+        self._open = 0
+        self._closed = False
+        self._local = threading.local()
+
+        # Pool stats
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._created = 0
+        self._health_check_failures = 0
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of the ``with`` block"""
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            # Re-entrant use on the same thread shares the held connection
+            self._local.depth += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+
+        start = time.perf_counter()
+        conn = self._checkout()
+        self._local.conn = conn
+        self._local.depth = 0
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._checkin(conn)
+            self._local.busy_time = getattr(self._local, "busy_time", 0.0) + time.perf_counter() - start
+
+    def thread_busy_time(self, reset: bool = False) -> float:
+        """Seconds this thread has spent holding (or waiting for) a connection.
+
+        Lets a caller attribute database time to a unit of work such as an
+        HTTP request: reset at the start, read at the end.
+        """
+        busy = getattr(self._local, "busy_time", 0.0)
+        if reset:
+            self._local.busy_time = 0.0
+        return busy
+
+    def _checkout(self) -> sqlite3.Connection:
+        start = time.perf_counter()
+        deadline = start + self.timeout
+        me = threading.get_ident()
+        waited = False
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+
+                if self._idle:
+                    # Prefer the connection this thread used last
+                    conn = next((c for c in self._idle if self._owner.get(id(c)) == me), None)
+                    if conn is None:
+                        conn = self._idle[-1]
+                    self._idle.remove(conn)
+                    break
+
+                if self._open < self.max_size:
+                    # Reserve the slot before connecting outside the lock
+                    self._open += 1
+                    conn = None
+                    break
+
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise PoolTimeoutError(
+                        f"Timed out after {self.timeout}s waiting for a database connection"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+                self._wait_time += time.perf_counter() - start
+
+        if conn is None:
+            conn = self._create()
+        elif not self._is_healthy(conn):
+            self._discard(conn)
+            with self._cond:
+                self._open += 1
+            conn = self._create()
+
+        with self._cond:
+            self._owner[id(conn)] = me
+        return conn
+
+    def _checkin(self, conn: sqlite3.Connection):
+        try:
+            if conn.in_transaction:
+                # Never hand a half-finished transaction to the next caller
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            if self._closed:
+                self._open -= 1
+                conn.close()
+                return
+            self._last_used[id(conn)] = time.monotonic()
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def _create(self) -> sqlite3.Connection:
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created += 1
+            self._last_used[id(conn)] = time.monotonic()
+        return conn
+
+    def _is_healthy(self, conn: sqlite3.Connection) -> bool:
+        """Ping connections that have been idle longer than the check interval"""
+        idle_for = time.monotonic() - self._last_used.get(id(conn), 0.0)
+        if idle_for < self.health_check_interval:
+            return True
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            with self._cond:
+                self._health_check_failures += 1
+            return False
+
+    def _discard(self, conn: sqlite3.Connection):
+        with self._cond:
+            self._open -= 1
+            self._last_used.pop(id(conn), None)
+            self._owner.pop(id(conn), None)
+            self._cond.notify()
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def close(self):
+        """Close all idle connections; checked-out ones close when returned"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> Dict:
+        """Snapshot of pool counters"""
+        with self._cond:
+            return {
+                "max_size": self.max_size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+                "created": self._created,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_time_total": round(self._wait_time, 6),
+                "wait_time_avg": round(self._wait_time / self._waits, 6) if self._waits else 0.0,
+                "health_check_failures": self._health_check_failures,
+            }
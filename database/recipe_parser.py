@@ -0,0 +1,258 @@
+import re
+from html.parser import HTMLParser
+from typing import List, NamedTuple, Optional, Set
+
+# Bump when extraction changes; rows parsed by an older version are picked
+# up again by backfill_recipe_fields
+PARSER_VERSION = 1
+
+_HEADER_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6", "strong", "b"}
+_TITLE_TAGS = {"h1", "h2", "h3"}
+_BLOCK_TAGS = {"p", "div", "li", "ul", "ol", "br", "h1", "h2", "h3", "h4", "h5", "h6", "tr"}
+
+_FRACTIONS = {"½": 0.5, "⅓": 1 / 3, "⅔": 2 / 3, "¼": 0.25, "¾": 0.75}
+_NUMBER = r"(\d+(?:\.\d+)?(?:\s*\d/\d)?|\d/\d|[½⅓⅔¼¾]|\d+\s*[½⅓⅔¼¾])"
+_DURATION_RE = re.compile(
+    _NUMBER + r"(?:\s*(?:-|–|to)\s*" + _NUMBER + r")?\s*(hours?|hrs?|h|minutes?|mins?|m)\b",
+    re.IGNORECASE,
+)
+_SERVINGS_RE = re.compile(r"\b(?:serves|servings?|yield|makes)\s*:?\s*(?:about\s+)?(\d+)|(\d+)\s+servings\b",
+                          re.IGNORECASE)
+
+# Words dropped from an ingredient line to get at what it is
+_UNITS = {
+    "cup", "cups", "tablespoon", "tablespoons", "tbsp", "tbs", "teaspoon", "teaspoons", "tsp", "g", "gram",
+    "grams", "kg", "kilogram", "kilograms", "mg", "ml", "milliliter", "milliliters", "millilitre", "l",
+    "liter", "liters", "litre", "litres", "oz", "ounce", "ounces", "lb", "lbs", "pound", "pounds", "pinch",
+    "dash", "can", "cans", "jar", "jars", "package", "packages", "packet", "pack", "bag", "box", "stick",
+    "sticks", "slice", "slices", "piece", "pieces", "inch", "cm", "quart", "quarts", "pint", "pints",
+    "handful", "bunch", "sprig", "sprigs", "stalk", "stalks", "clove", "cloves", "head", "fillet", "fillets",
+    "container", "bottle", "knob", "drizzle", "splash", "x",
+}
+_DESCRIPTORS = {
+    "chopped", "diced", "minced", "sliced", "grated", "shredded", "crushed", "ground", "fresh", "freshly",
+    "dried", "large", "small", "medium", "finely", "roughly", "thinly", "coarsely", "peeled", "seeded",
+    "cooked", "uncooked", "raw", "boneless", "skinless", "ripe", "frozen", "canned", "drained", "rinsed",
+    "softened", "melted", "room", "temperature", "cold", "warm", "extra", "virgin", "plain",
+    "unsalted", "salted", "packed", "heaping", "level", "lean", "organic", "optional", "divided", "beaten",
+    "lightly", "halved", "quartered", "cubed", "trimmed", "toasted", "about", "approximately", "plus",
+    "more", "taste", "serving", "garnish", "needed", "each", "few", "some", "whole", "good", "quality",
+    "homemade", "store", "bought", "cut", "into", "pieces", "thick", "thin", "wedges", "rings", "strips",
+}
+_STOPWORDS = {"a", "an", "and", "or", "of", "to", "for", "the", "with", "in", "on", "your", "as", "if", "at"}
+_NO_SINGULAR = {"hummus", "couscous", "asparagus", "swiss", "molasses", "citrus", "grits", "harissa", "its"}
+_WORD_RE = re.compile(r"[a-zà-ÿ]+(?:-[a-zà-ÿ]+)*")
+
+
+class ParsedRecipe(NamedTuple):
+    title: Optional[str]
+    ingredients: List[str]  # ingredient lines as written
+    steps: int
+    prep_minutes: Optional[int]
+    cook_minutes: Optional[int]
+    total_minutes: Optional[int]  # stated total, else prep + cook
+    servings: Optional[int]
+
+
+def _number(text: str) -> Optional[float]:
+    """Value of a quantity like "1 1/2", "¾" or "2.5"; None if it isn't one (e.g. "1/0")"""
+    text = text.strip()
+    whole = 0.0
+    try:
+        if text and text[-1] in _FRACTIONS:
+            return float(text[:-1].strip() or 0) + _FRACTIONS[text[-1]]
+        for part in text.split():
+            if "/" in part:
+                numerator, denominator = part.split("/")
+                whole += int(numerator) / int(denominator)
+            else:
+                whole += float(part)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return whole
+
+
+def parse_minutes(text: str) -> Optional[int]:
+    """Minutes in a duration like "1 hour 30 minutes" or "10-15 mins" (ranges count as the upper bound)"""
+    total = None
+    for match in _DURATION_RE.finditer(text):
+        low, high, unit = match.groups()
+        value = _number(high or low)
+        if value is None:
+            continue
+        minutes = value * 60 if unit.lower().startswith("h") else value
+        total = (total or 0) + minutes
+    return None if total is None else int(round(total))
+
+
+def _section(heading: str) -> Optional[str]:
+    heading = heading.lower()
+    if "time" in heading:
+        if "total" in heading:
+            return "total"
+        if "prep" in heading:
+            return "prep"
+        if "cook" in heading or "bak" in heading:
+            return "cook"
+    if "ingredient" in heading:
+        return "ingredients"
+    if any(word in heading for word in ("instruction", "direction", "method", "steps", "preparation")):
+        return "instructions"
+    if heading.split(":")[0].strip() in ("servings", "serves", "yield", "makes", "portions"):
+        return "servings"
+    return None
+
+
+class RecipeParser(HTMLParser):
+    """Incremental parser for the recipe HTML the system prompt asks for.
+
+    Feed it the body in one piece or chunk by chunk (e.g. as a reply is
+    streamed), then call ``close()`` and read ``result()``. Section headings
+    (``<h4>``, or a ``<strong>`` label) are recognised by their text, so
+    "Prep Time: 10 minutes" works inline as well as in a following
+    paragraph. Unknown markup is ignored rather than rejected.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title: Optional[str] = None
+        self.ingredients: List[str] = []
+        self.steps = 0
+        self.times = {}  # section -> minutes
+        self.servings: Optional[int] = None
+        self._section: Optional[str] = None
+        self._header_tag: Optional[str] = None
+        self._header_text: List[str] = []
+        self._item: Optional[List[str]] = None  # text of the <li> being read
+        self._text: List[str] = []  # text of the current section outside list items
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _HEADER_TAGS and self._header_tag is None:
+            self._header_tag = tag
+            self._header_text = []
+        elif tag == "li":
+            self._end_item()
+            self._item = []
+        if tag in _BLOCK_TAGS:
+            self._text.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag == self._header_tag:
+            self._end_header()
+        elif tag in ("li", "ul", "ol"):
+            self._end_item()
+        if tag in _BLOCK_TAGS:
+            self._text.append("\n")
+
+    def handle_data(self, data):
+        if self._header_tag is not None:
+            self._header_text.append(data)
+        elif self._item is not None:
+            self._item.append(data)
+        else:
+            self._text.append(data)
+
+    def _end_header(self):
+        text = " ".join("".join(self._header_text).split())
+        tag, self._header_tag = self._header_tag, None
+        section = _section(text)
+        if section is None:
+            if tag in _TITLE_TAGS and self.title is None and text:
+                self.title = text
+            else:
+                # Just emphasis inside a paragraph or list item
+                (self._item if self._item is not None else self._text).append(text)
+            return
+        self._end_section()
+        self._section = section
+        # "Cooking Time: 20 minutes" carries its value in the heading itself
+        self._text = [text.split(":", 1)[1]] if ":" in text else []
+
+    def _end_item(self):
+        if self._item is None:
+            return
+        text = " ".join("".join(self._item).split())
+        self._item = None
+        if not text:
+            return
+        if self._section == "ingredients":
+            # "For the sauce:" sub-headings inside the list aren't ingredients
+            if not text.endswith(":"):
+                self.ingredients.append(text)
+        elif self._section == "instructions":
+            self.steps += 1
+
+    def _end_section(self):
+        text = "".join(self._text)
+        if self._section in ("prep", "cook", "total") and self._section not in self.times:
+            minutes = parse_minutes(text)
+            if minutes is not None:
+                self.times[self._section] = minutes
+        if self.servings is None:
+            match = _SERVINGS_RE.search(text)
+            if match:
+                self.servings = int(match.group(1) or match.group(2))
+            elif self._section == "servings":
+                number = re.search(r"\d+", text)
+                self.servings = int(number.group()) if number else None
+        self._text = []
+
+    def close(self):
+        super().close()
+        if self._header_tag is not None:
+            self._end_header()
+        self._end_item()
+        self._end_section()
+
+    def result(self) -> ParsedRecipe:
+        prep, cook = self.times.get("prep"), self.times.get("cook")
+        total = self.times.get("total")
+        if total is None and (prep is not None or cook is not None):
+            total = (prep or 0) + (cook or 0)
+        return ParsedRecipe(self.title, self.ingredients, self.steps, prep, cook, total, self.servings)
+
+
+def parse_recipe(html: str) -> ParsedRecipe:
+    parser = RecipeParser()
+    parser.feed(html or "")
+    parser.close()
+    return parser.result()
+
+
+def _singular(word: str) -> str:
+    if word in _NO_SINGULAR or len(word) <= 3:
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith("oes") or word.endswith(("ches", "shes", "xes", "sses")):
+        return word[:-2]
+    if word.endswith("ves") and word not in ("olives", "chives", "cloves"):
+        return word[:-3] + "f"
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def ingredient_name(line: str) -> str:
+    """What an ingredient line is, with amounts, units and preparation removed.
+
+    "2 tbsp extra virgin olive oil, divided" -> "olive oil";
+    "3 ripe tomatoes (about 400g)" -> "tomato". The same function
+    normalizes what a user types in, so both sides meet in the index.
+    """
+    text = re.sub(r"\([^)]*\)", " ", line.lower())
+    text = re.split(r",| - | – |;", text, maxsplit=1)[0]
+    words = [word for word in _WORD_RE.findall(text) if word not in _STOPWORDS]
+    kept = [word for word in words if word not in _UNITS and word not in _DESCRIPTORS]
+    # A line that is nothing but "cloves" or "ground" still names something
+    return " ".join(_singular(word) for word in (kept or words))
+
+
+def ingredient_terms(name: str) -> Set[str]:
+    """Index terms for a normalized ingredient: the full name and each of its words.
+
+    "chicken thigh" is found by a search for "chicken thigh", "chicken" or "thigh".
+    """
+    if not name:
+        return set()
+    return {name} | set(name.split())
@@ -0,0 +1,61 @@
+import html
+import re
+from typing import Optional, Union
+
+from .compression import decompress_body
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_WS_RE = re.compile(r"\s+")
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+# Markers around matches in a snippet; the API returns them as-is for the UI to style
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+
+# What FTS5's snippet() puts around matches: private-use characters, which
+# can't come from the indexed text's markup, so highlight() can tell them apart
+SNIPPET_START = "\ue000"
+SNIPPET_END = "\ue001"
+
+
+def search_text(content: Union[str, bytes, None]) -> str:
+    """Plain text indexed for a recipe or message body: tags removed, entities decoded.
+
+    Registered on every connection as the SQL function ``search_text`` and
+    called by the FTS triggers, so it must stay deterministic. Compressed
+    bodies are expanded first.
+    """
+    content = decompress_body(content)
+    if not content:
+        return ""
+    text = html.unescape(_TAG_RE.sub(" ", content))
+    return _WS_RE.sub(" ", text).strip()
+
+
+def highlight(snippet: Optional[str]) -> Optional[str]:
+    """An FTS5 snippet as HTML: the text escaped, so only the highlight markers are markup"""
+    if snippet is None:
+        return None
+    # html.escape leaves the private-use markers alone, so they survive to be swapped in
+    return html.escape(snippet).replace(SNIPPET_START, HIGHLIGHT_START).replace(SNIPPET_END, HIGHLIGHT_END)
+
+
+def owner_token(user_id: int) -> str:
+    """Token stored in the FTS ``owner`` column so a MATCH can be limited to one user"""
+    return f"u{int(user_id)}"
+
+
+def build_match(user_id: int, query: str, columns: str = "body") -> Optional[str]:
+    """Turn free text into a safe FTS5 MATCH expression scoped to one user.
+
+    Every word becomes a quoted term (so FTS operators in user input are
+    inert) and the last word is a prefix match, which suits search-as-you-type.
+    ``columns`` is an FTS5 column filter such as ``"{title body}"``. Returns
+    None when the query has no searchable words.
+    """
+    terms = _TERM_RE.findall(query.lower())[:16]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return f"owner:{owner_token(user_id)} AND {columns} : ({' '.join(quoted)})"
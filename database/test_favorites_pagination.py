@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+
+from database.models import DatabaseManager, decode_cursor, encode_cursor
+
+
+class CursorTest(unittest.TestCase):
+    def test_round_trip(self):
+        cursor = encode_cursor("2024-05-01 12:00:00", 42)
+        self.assertNotIn("=", cursor)
+        self.assertEqual(decode_cursor(cursor), ("2024-05-01 12:00:00", 42))
+
+    def test_malformed_cursor_is_rejected(self):
+        for cursor in ("", "not-base64!", encode_cursor("2024-05-01", 1)[:-3], "WzEsMl0"):  # last: [1,2]
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+
+class FavoritesPageTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db = DatabaseManager(os.path.join(self.dir.name, "test.db"))
+        self.user_id = self.db.create_or_update_user("g1", "cook@example.com", "Cook")["id"]
+        other = self.db.create_or_update_user("g2", "other@example.com", "Other")["id"]
+        ids = [self.db.add_favorite_recipe(self.user_id, f"Recipe {i}", f"<h3>Recipe {i}</h3>")["id"]
+               for i in range(7)]
+        self.db.add_favorite_recipe(other, "Not mine", "<h3>Not mine</h3>")
+        # Several recipes share a timestamp, so the id has to break ties
+        dates = ["2024-01-01 10:00:00", "2024-01-02 10:00:00", "2024-01-02 10:00:00", "2024-01-02 10:00:00",
+                 "2024-01-03 10:00:00", "2024-01-04 10:00:00", "2024-01-04 10:00:00"]
+        with self.db.connection() as conn:
+            conn.executemany("UPDATE favorite_recipes SET date_added = ? WHERE id = ?", list(zip(dates, ids)))
+            conn.commit()
+        self.expected = [recipe_id for _, recipe_id in sorted(zip(dates, ids), reverse=True)]
+
+    def tearDown(self):
+        self.db.close()
+        self.dir.cleanup()
+
+    def walk(self, limit):
+        pages, cursor = [], None
+        while True:
+            page = self.db.get_user_favorites_page(self.user_id, limit=limit, cursor=cursor, summary_only=True)
+            pages.append([favorite["id"] for favorite in page["favorites"]])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return pages
+
+    def test_pages_cover_every_recipe_once_in_order(self):
+        pages = self.walk(2)
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+        self.assertEqual([recipe_id for page in pages for recipe_id in page], self.expected)
+
+    def test_last_full_page_has_no_cursor(self):
+        # Seven recipes in pages of seven: no empty trailing page
+        self.assertEqual(self.walk(7), [self.expected])
+
+    def test_page_boundary_inside_a_tie(self):
+        # Pages of 3 split the three recipes of 2024-01-02 across two pages
+        pages = self.walk(3)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual([recipe_id for page in pages for recipe_id in page], self.expected)
+
+    def test_summary_only_leaves_out_bodies(self):
+        page = self.db.get_user_favorites_page(self.user_id, limit=1)
+        self.assertIn("content", page["favorites"][0])
+        page = self.db.get_user_favorites_page(self.user_id, limit=1, summary_only=True)
+        self.assertNotIn("content", page["favorites"][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from database.models import MIGRATIONS, DatabaseManager, content_digest
+
+# The tables as they were before any migration (init_database's CREATE statements)
+BASE_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    google_id TEXT UNIQUE NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    name TEXT,
+    picture TEXT,
+    password_hash TEXT NOT NULL,
+    terms_accepted BOOLEAN DEFAULT FALSE,
+    terms_accepted_at TIMESTAMP NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE favorite_recipes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    content TEXT NOT NULL,
+    date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    starred BOOLEAN DEFAULT TRUE,
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+CREATE TABLE conversation_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+"""
+
+SOUP = "<h3>Leek Soup</h3> <h4>Ingredients</h4> <ul><li>2 leeks</li><li>1 potato</li></ul>"
+SOUP_SPACED = "  <h3>Leek Soup</h3>\n<h4>Ingredients</h4>\n\t<ul><li>2 leeks</li><li>1 potato</li></ul>\n"
+CURRY = "<h3>Chickpea Curry</h3><h4>Cook Time</h4><p>25 minutes</p>"
+
+
+class MigrationTest(unittest.TestCase):
+    """Opens a version 0 database, as created before migrations existed, with DatabaseManager"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "old.db")
+        conn = sqlite3.connect(self.path)
+        conn.executescript(BASE_SCHEMA)
+        conn.executemany(
+            "INSERT INTO users (id, google_id, email, password_hash) VALUES (?, ?, ?, 'x')",
+            [(1, "g-alice", "alice@example.com"), (2, "g-bob", "bob@example.com")]
+        )
+        conn.executemany(
+            "INSERT INTO favorite_recipes (id, user_id, title, content) VALUES (?, ?, ?, ?)",
+            [
+                (1, 1, "Leek Soup", SOUP),
+                (2, 1, "Leek Soup again", SOUP_SPACED),  # same recipe, whitespace aside
+                (3, 1, "Curry", CURRY),
+                (4, 2, "Leek Soup", SOUP),  # another user's copy is not a duplicate
+                (5, 1, "Leek Soup thrice", SOUP),
+            ]
+        )
+        conn.executemany(
+            "INSERT INTO conversation_history (user_id, role, content) VALUES (?, ?, ?)",
+            [(1, "system", "Old prompt"), (2, "system", "Old prompt"), (1, "user", "leek soup please")]
+        )
+        conn.commit()
+        conn.close()
+        self.db = DatabaseManager(self.path)
+
+    def tearDown(self):
+        self.db.close()
+        self.dir.cleanup()
+
+    def rows(self, sql, params=()):
+        with self.db.connection() as conn:
+            return [tuple(row) for row in conn.execute(sql, params).fetchall()]
+
+    def test_reaches_latest_version(self):
+        self.assertEqual(self.db.schema_version, MIGRATIONS[-1][0])
+
+    def test_dedupe_keeps_every_row_and_digests_only_the_oldest_copy(self):
+        digests = dict(self.rows("SELECT id, content_digest FROM favorite_recipes"))
+        self.assertEqual(sorted(digests), [1, 2, 3, 4, 5])  # nothing deleted
+        self.assertEqual(digests[1], content_digest(SOUP))
+        self.assertEqual(content_digest(SOUP_SPACED), content_digest(SOUP))
+        self.assertIsNone(digests[2])
+        self.assertIsNone(digests[5])
+        self.assertEqual(digests[3], content_digest(CURRY))
+        self.assertEqual(digests[4], content_digest(SOUP))
+
+    def test_duplicates_are_rejected_after_migration(self):
+        with self.assertRaises(ValueError):
+            self.db.add_favorite_recipe(1, "Leek Soup", SOUP_SPACED)
+        self.db.add_favorite_recipe(2, "Curry", CURRY)
+
+    def test_later_migrations_cover_old_rows(self):
+        # Migration 5 shares the system prompt; 6 indexes old rows for search; 8 parses them
+        self.assertEqual(self.rows("SELECT DISTINCT content FROM conversation_history WHERE role = 'system'"),
+                         [("",)])
+        self.assertEqual([result["id"] for result in self.db.search(1, "curry", scope="favorites")], [3])
+        self.assertEqual(self.rows("SELECT cook_minutes FROM favorite_recipes WHERE id = 3"), [(25,)])
+
+    def test_reopening_is_a_no_op(self):
+        self.db.close()
+        self.db = DatabaseManager(self.path)
+        self.assertEqual(len(self.rows("SELECT id FROM favorite_recipes")), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
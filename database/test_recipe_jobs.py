@@ -0,0 +1,73 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from database.models import DatabaseManager
+
+
+class RecipeJobClaimTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db = DatabaseManager(os.path.join(self.dir.name, "test.db"), pool_size=8)
+        self.user_id = self.db.create_or_update_user("g1", "cook@example.com", "Cook")["id"]
+        self.job, _ = self.db.create_recipe_job(self.user_id, "leek soup", ttl=3600)
+
+    def tearDown(self):
+        self.db.close()
+        self.dir.cleanup()
+
+    def history(self):
+        with self.db.connection() as conn:
+            return conn.execute(
+                "SELECT role, content FROM conversation_history WHERE user_id = ? AND role != 'system'",
+                (self.user_id,)
+            ).fetchall()
+
+    def test_job_is_started_once(self):
+        self.assertEqual(self.db.start_recipe_job(self.job["job_id"])["status"], "running")
+        self.assertIsNone(self.db.start_recipe_job(self.job["job_id"]))
+
+    def test_concurrent_claims_start_it_once(self):
+        started = []
+        barrier = threading.Barrier(8)
+
+        def claim():
+            barrier.wait()
+            started.append(self.db.start_recipe_job(self.job["job_id"]))
+
+        threads = [threading.Thread(target=claim) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(job is not None for job in started), 1)
+
+    def test_finishing_twice_writes_history_once(self):
+        self.db.start_recipe_job(self.job["job_id"])
+        messages = [("user", "leek soup"), ("assistant", "<h3>Leek Soup</h3>")]
+        self.assertTrue(self.db.finish_recipe_job(self.job["job_id"], "done", {"response": "a"}, messages))
+        self.assertFalse(self.db.finish_recipe_job(self.job["job_id"], "done", {"response": "b"}, messages))
+        self.assertEqual(len(self.history()), 2)
+        job = self.db.get_recipe_job(self.user_id, self.job["job_id"])
+        self.assertEqual(job["result"], {"response": "a"})
+
+    def test_stale_job_is_requeued_to_one_caller(self):
+        with self.db.connection() as conn:
+            conn.execute("UPDATE recipe_jobs SET updated_at = updated_at - 1000")
+            conn.commit()
+        self.assertEqual(self.db.count_active_recipe_jobs(self.user_id, stale_after=600), 0)
+        self.assertEqual(self.db.requeue_stale_recipe_jobs(600, 10), [self.job["job_id"]])
+        self.assertEqual(self.db.requeue_stale_recipe_jobs(600, 10), [])
+        self.assertEqual(self.db.count_active_recipe_jobs(self.user_id, stale_after=600), 1)
+
+    def test_retried_submission_gets_the_same_job(self):
+        first, created = self.db.create_recipe_job(self.user_id, "curry", 3600, client_key="k1")
+        again, created_again = self.db.create_recipe_job(self.user_id, "curry", 3600, client_key="k1")
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(again["job_id"], first["job_id"])
+
+
+if __name__ == "__main__":
+    unittest.main()
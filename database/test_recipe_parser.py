@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from database import models
+from database.models import DatabaseManager
+from database.recipe_parser import parse_minutes, parse_recipe
+
+MALFORMED_TIME = "<h1>Soup</h1><h4>Prep Time</h4><p>1/0 minutes</p><h4>Cook Time</h4><p>20 minutes</p>"
+
+
+class MalformedQuantityTest(unittest.TestCase):
+    def test_zero_denominator_is_no_value(self):
+        self.assertIsNone(parse_minutes("1/0 minutes"))
+        parsed = parse_recipe(MALFORMED_TIME)
+        self.assertIsNone(parsed.prep_minutes)
+        self.assertEqual(parsed.cook_minutes, 20)
+
+    def test_malformed_fraction_is_skipped(self):
+        # "2 1/0" is one quantity; the well-formed duration after it still counts
+        self.assertEqual(parse_minutes("2 1/0 hours plus 15 minutes"), 15)
+        self.assertEqual(parse_minutes("1 1/2 hours"), 90)
+
+
+class StoreRecipeFieldsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db = DatabaseManager(os.path.join(self.dir.name, "test.db"))
+        self.user_id = self.db.create_or_update_user("g1", "cook@example.com", "Cook")["id"]
+
+    def tearDown(self):
+        self.db.close()
+        self.dir.cleanup()
+
+    def fields(self, recipe_id):
+        with self.db.connection() as conn:
+            return conn.execute(
+                "SELECT prep_minutes, cook_minutes, ingredient_count FROM favorite_recipes WHERE id = ?",
+                (recipe_id,)
+            ).fetchone()
+
+    def test_malformed_time_is_saved(self):
+        recipe = self.db.add_favorite_recipe(self.user_id, "Soup", MALFORMED_TIME)
+        row = self.fields(recipe["id"])
+        self.assertIsNone(row["prep_minutes"])
+        self.assertEqual(row["cook_minutes"], 20)
+
+    def test_parse_failure_still_saves_the_recipe(self):
+        with mock.patch.object(models, "parse_recipe", side_effect=RuntimeError("bad markup")):
+            recipe = self.db.add_favorite_recipe(self.user_id, "Soup", MALFORMED_TIME)
+        self.assertEqual(self.db.get_favorite_recipe(self.user_id, recipe["id"])["content"], MALFORMED_TIME)
+        row = self.fields(recipe["id"])
+        self.assertIsNone(row["cook_minutes"])
+        self.assertEqual(row["ingredient_count"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+
+from database.models import DatabaseManager
+from database.search import highlight, SNIPPET_END, SNIPPET_START
+
+
+class SearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db = DatabaseManager(os.path.join(self.dir.name, "test.db"))
+        self.alice = self.db.create_or_update_user("g-alice", "alice@example.com", "Alice")["id"]
+        self.bob = self.db.create_or_update_user("g-bob", "bob@example.com", "Bob")["id"]
+
+    def tearDown(self):
+        self.db.close()
+        self.dir.cleanup()
+
+
+class SnippetEscapingTest(SearchTestCase):
+    def test_highlight_escapes_everything_but_the_markers(self):
+        snippet = f"&lt;b&gt; <i>{SNIPPET_START}leek{SNIPPET_END} & potato"
+        self.assertEqual(highlight(snippet), "&amp;lt;b&amp;gt; &lt;i&gt;<mark>leek</mark> &amp; potato")
+
+    def test_entity_encoded_markup_stays_text(self):
+        content = "<h3>Tomato Soup</h3><p>&lt;img src=x onerror=alert(1)&gt; ripe tomatoes</p>"
+        self.db.add_favorite_recipe(self.alice, "Tomato Soup", content)
+        [result] = self.db.search(self.alice, "tomatoes", scope="favorites")
+        self.assertIn("<mark>tomatoes</mark>", result["snippet"])
+        self.assertIn("&lt;img src=x onerror=alert(1)&gt;", result["snippet"])
+        self.assertNotIn("<img", result["snippet"])
+
+
+class OwnerScopeTest(SearchTestCase):
+    def setUp(self):
+        super().setUp()
+        for user_id, name in ((self.alice, "Alice"), (self.bob, "Bob")):
+            self.db.add_favorite_recipe(user_id, f"{name}'s tomato soup", f"<h3>{name}'s tomato soup</h3>")
+            self.db.add_conversation_messages(user_id, [("user", f"tomato ideas for {name}"),
+                                                        ("assistant", "<h3>Tomato tart</h3>")])
+
+    def owners(self, user_id, query, scope="all"):
+        results = self.db.search(user_id, query, scope=scope)
+        with self.db.connection() as conn:
+            owners = set()
+            for result in results:
+                table = "favorite_recipes" if result["type"] == "favorite" else "conversation_history"
+                owners.add(conn.execute(f"SELECT user_id FROM {table} WHERE id = ?", (result["id"],)).fetchone()[0])
+        return results, owners
+
+    def test_only_own_rows_are_found(self):
+        for user_id in (self.alice, self.bob):
+            results, owners = self.owners(user_id, "tomato")
+            self.assertEqual(len(results), 3)  # a favorite and two messages
+            self.assertEqual(owners, {user_id})
+
+    def test_other_users_words_find_nothing(self):
+        results, _ = self.owners(self.alice, "bob")
+        self.assertEqual(results, [])
+
+    def test_fts_syntax_in_the_query_cannot_widen_the_scope(self):
+        other = f"u{self.bob}"
+        for query in (f"tomato OR owner:{other}", f'"{other}"', f"owner : {other}", "* OR tomato", f"NOT {other}"):
+            _, owners = self.owners(self.alice, query)
+            self.assertLessEqual(owners, {self.alice}, query)
+
+    def test_removed_favorite_is_no_longer_found(self):
+        [favorite] = self.db.search(self.alice, "soup", scope="favorites")
+        self.db.remove_favorite_recipe(self.alice, favorite["id"])
+        self.assertEqual(self.db.search(self.alice, "soup", scope="favorites"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
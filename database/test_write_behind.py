@@ -0,0 +1,78 @@
+import threading
+import time
+import unittest
+
+from database.write_behind import WriteBehindQueue
+
+
+class WriterDied(BaseException):
+    """Escapes the writer's error handling, ending its thread"""
+
+
+class RecordingWriter:
+    """A write_batch that records groups, and can stall (the writer thread only) or fail on request"""
+
+    def __init__(self):
+        self.groups = []
+        self.release = threading.Event()
+        self.release.set()
+        self.fail_users = set()
+        self.die = False
+
+    def __call__(self, groups):
+        if self.die:
+            self.die = False
+            raise WriterDied()
+        if threading.current_thread().name == "write-behind":
+            self.release.wait()
+        if any(user_id in self.fail_users for user_id, _ in groups):
+            raise RuntimeError("no such user")
+        self.groups.extend(groups)
+
+
+class WriteBehindTimeoutTest(unittest.TestCase):
+    def test_stalled_writer_falls_back_to_synchronous_write(self):
+        writer = RecordingWriter()
+        queue = WriteBehindQueue(writer, flush_interval=0, wait_timeout=0.1)
+        writer.release.clear()
+        queue.submit(1, [("user", "stuck")])  # the writer takes this one and stalls
+        time.sleep(0.05)
+
+        threading.Timer(0.3, writer.release.set).start()
+        started = time.monotonic()
+        queue.submit(2, [("user", "soup")], wait=True)
+        self.assertLess(time.monotonic() - started, 0.3)  # didn't wait for the writer
+        self.assertTrue(queue.flush(timeout=2))
+        self.assertEqual([user_id for user_id, _ in writer.groups].count(2), 1)  # written once
+        self.assertEqual(queue.stats()["sync_fallbacks"], 1)
+        queue.close()
+
+    def test_dead_writer_never_hangs_a_request(self):
+        writer = RecordingWriter()
+        queue = WriteBehindQueue(writer, flush_interval=0, wait_timeout=0.1)
+        writer.die = True
+        queue.submit(1, [("user", "lost")])  # the writer dies writing this one
+        queue._thread.join(timeout=1)
+        self.assertFalse(queue._thread.is_alive())
+
+        queue.submit(2, [("user", "soup")], wait=True)
+        self.assertFalse(queue.flush())
+        queue.close()
+        self.assertEqual([user_id for user_id, _ in writer.groups], [2])
+
+    def test_failed_group_is_counted(self):
+        writer = RecordingWriter()
+        writer.fail_users.add(3)
+        queue = WriteBehindQueue(writer, flush_interval=0)
+        queue.submit(3, [("user", "gone")])
+        queue.submit(4, [("user", "soup")])
+        queue.flush()
+        self.assertEqual(queue.stats()["errors"], 1)
+        self.assertEqual([user_id for user_id, _ in writer.groups], [4])
+        with self.assertRaises(RuntimeError):
+            queue.submit(3, [("user", "gone")], wait=True)
+        queue.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,213 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# One unit of work: (user_id, [(role, content), ...]). A unit is always
+# committed as a whole.
+WriteGroup = Tuple[int, Sequence[Tuple[str, str]]]
+
+
+class _Pending:
+    __slots__ = ("user_id", "messages", "done", "error", "claimed")
+
+    def __init__(self, user_id: int, messages: Sequence[Tuple[str, str]]):
+        self.user_id = user_id
+        self.messages = messages
+        self.done = threading.Event()
+        self.error = None
+        self.claimed = False  # taken by the writer, or by a caller that stopped waiting for it
+
+
+class WriteBehindQueue:
+    """Group-commits conversation inserts on a background thread.
+
+    Request threads hand over their user/assistant pair and return at once.
+    The writer drains whatever has queued up, from any number of requests,
+    and inserts it in a single transaction, so N concurrent requests cost
+    one write-lock acquisition and one WAL commit instead of 2N.
+
+    The queue is bounded: when it is full, ``submit`` blocks for up to
+    ``submit_timeout`` and then writes synchronously, which pushes back on
+    callers instead of buffering without limit. ``flush`` waits until
+    everything submitted so far is committed; ``close`` flushes and stops
+    the writer and is registered for interpreter/worker shutdown.
+
+    No caller waits on the writer for more than ``wait_timeout``: a
+    ``submit(wait=True)`` that isn't committed by then writes its group
+    itself (unless the writer has already taken it), and with the writer
+    thread gone every submit writes synchronously. Groups that can't be
+    written at all are counted in ``errors``.
+    """
+
+    def __init__(self, write_batch: Callable[[List[WriteGroup]], None], max_pending: int = 10000,
+                 flush_interval: float = 0.02, max_batch: int = 500, submit_timeout: float = 1.0,
+                 wait_timeout: float = 5.0):
+        self._write_batch = write_batch
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.submit_timeout = submit_timeout
+        self.wait_timeout = wait_timeout
+
+        self._queue: "queue.Queue[_Pending]" = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._per_user: Dict[int, int] = defaultdict(int)  # user_id -> groups not yet committed
+        self._closed = False
+        self._stats = {
+            "groups": 0,
+            "messages": 0,
+            "batches": 0,
+            "sync_fallbacks": 0,
+            "errors": 0,
+            "commit_time": 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id: int, messages: Sequence[Tuple[str, str]], wait: bool = False):
+        """Queue messages for one user; with ``wait`` return only once they are committed"""
+        item = _Pending(user_id, list(messages))
+        if self._closed or not self._thread.is_alive():
+            if not self._closed:
+                self._count("sync_fallbacks")  # the writer died; nothing would ever commit this
+            self._write_now(item)
+            if wait and item.error is not None:
+                raise item.error
+            return
+        with self._lock:
+            self._per_user[user_id] += 1
+        try:
+            self._queue.put(item, timeout=self.submit_timeout)
+        except queue.Full:
+            self._count("sync_fallbacks")
+            self._write_now(item)
+            self._mark_done([item])
+        if not wait:
+            return
+        if not item.done.wait(self.wait_timeout):
+            if self._claim(item):
+                # The writer is stuck or gone and hasn't taken this group: write it here
+                self._count("sync_fallbacks")
+                self._write_now(item)
+                self._mark_done([item])
+            elif not item.done.wait(self.wait_timeout):
+                raise TimeoutError(f"Conversation write for user {user_id} still not committed")
+        if item.error is not None:
+            raise item.error
+
+    def has_pending(self, user_id: int) -> bool:
+        with self._lock:
+            return self._per_user.get(user_id, 0) > 0
+
+    def flush(self, timeout: float = None) -> bool:
+        """Block until every group submitted before this call is committed, for at most
+        ``timeout`` (default ``wait_timeout``) seconds; returns whether it got there"""
+        marker = _Pending(-1, [])
+        if self._closed or not self._thread.is_alive():
+            return self._closed
+        try:
+            self._queue.put(marker, timeout=self.wait_timeout if timeout is None else timeout)
+        except queue.Full:
+            return False
+        return marker.done.wait(self.wait_timeout if timeout is None else timeout)
+
+    def close(self):
+        """Flush outstanding writes and stop the writer thread"""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        try:
+            self._queue.put(None, timeout=self.wait_timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=5)
+        if not self._thread.is_alive():
+            # Whatever a dead writer left behind is written here rather than lost
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None and item.user_id != -1 and self._claim(item):
+                    self._write_now(item)
+                    self._mark_done([item])
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            # Give concurrent requests a moment to join this commit
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch and item.user_id != -1:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._commit(batch)
+                    return
+                batch.append(item)  # a flush marker ends the batch early
+            self._commit(batch)
+
+    def _commit(self, batch: List[_Pending]):
+        # Groups whose caller stopped waiting and wrote them itself are skipped
+        batch = [item for item in batch if item.user_id == -1 or self._claim(item)]
+        groups = [item for item in batch if item.user_id != -1]
+        if groups:
+            start = time.perf_counter()
+            try:
+                self._write_batch([(item.user_id, item.messages) for item in groups])
+            except Exception:
+                # One bad group (e.g. a user deleted meanwhile) must not sink the rest
+                for item in groups:
+                    self._write_now(item)
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._stats["batches"] += 1
+                self._stats["commit_time"] += elapsed
+        self._mark_done(batch)
+
+    def _claim(self, item: _Pending) -> bool:
+        with self._lock:
+            if item.claimed:
+                return False
+            item.claimed = True
+            return True
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _write_now(self, item: _Pending):
+        try:
+            self._write_batch([(item.user_id, item.messages)])
+        except Exception as e:
+            item.error = e
+            with self._lock:
+                self._stats["errors"] += 1
+            print(f"Failed to write conversation messages for user {item.user_id}: {e}")
+
+    def _mark_done(self, batch: List[_Pending]):
+        with self._lock:
+            for item in batch:
+                if item.user_id == -1:
+                    continue
+                self._stats["groups"] += 1
+                self._stats["messages"] += len(item.messages)
+                self._per_user[item.user_id] -= 1
+                if self._per_user[item.user_id] <= 0:
+                    del self._per_user[item.user_id]
+        for item in batch:
+            item.done.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queued"] = self._queue.qsize()
+        stats["avg_batch"] = round(stats["groups"] / stats["batches"], 2) if stats["batches"] else 0.0
+        return stats
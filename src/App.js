@@ -158,11 +158,15 @@ function App() {
       setPlaceholder("Tell me what ingredients you have, or describe the dish you're craving... ✨");
 
       // Mark terms as accepted in backend
-      await axios.post(
+      const res = await axios.post(
         `${API_URL}/accept-terms`, 
         {}
         // ,{ withCredentials: true }
       );
+      // The backend may issue a token that records the acceptance
+      if (res.data.token) {
+        setAuthToken(res.data.token);
+      }
     } catch (error) {
       console.error('Error accepting terms:', error);
     }